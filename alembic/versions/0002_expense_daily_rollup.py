@@ -0,0 +1,88 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_expense_daily_rollup"
+down_revision = "0001_init_budget_tables"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "idx_expenses_project_created",
+        "expenses",
+        ["project_id", "created_at"],
+    )
+
+    # Дневные итоги по проекту: день (UTC) × категория × валюта.
+    # category_id = 0 — трата без категории (чтобы ключ оставался NOT NULL).
+    op.create_table(
+        "expense_daily_rollup",
+        sa.Column("project_id", sa.BigInteger, sa.ForeignKey("projects.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("day", sa.Date, nullable=False),
+        sa.Column("category_id", sa.BigInteger, server_default="0", nullable=False),
+        sa.Column("currency_original", sa.String(3), nullable=False),
+        sa.Column("total_original", sa.Numeric(18, 2), nullable=False),
+        sa.Column("total_rub", sa.Numeric(18, 2), nullable=False),
+        sa.Column("expense_count", sa.Integer, nullable=False),
+        sa.PrimaryKeyConstraint("project_id", "day", "category_id", "currency_original"),
+    )
+
+    # Rollup поддерживается statement-level триггером: пачка строк
+    # (в т.ч. импорт через COPY + INSERT ... SELECT) агрегируется одним запросом.
+    op.execute(
+        """
+        CREATE FUNCTION expenses_daily_rollup_ins() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO expense_daily_rollup AS r
+                (project_id, day, category_id, currency_original, total_original, total_rub, expense_count)
+            SELECT project_id,
+                   (created_at AT TIME ZONE 'UTC')::date,
+                   COALESCE(category_id, 0),
+                   currency_original,
+                   SUM(amount_original),
+                   SUM(amount_rub),
+                   COUNT(*)
+            FROM new_rows
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (project_id, day, category_id, currency_original) DO UPDATE
+            SET total_original = r.total_original + EXCLUDED.total_original,
+                total_rub      = r.total_rub + EXCLUDED.total_rub,
+                expense_count  = r.expense_count + EXCLUDED.expense_count;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER trg_expenses_daily_rollup
+        AFTER INSERT ON expenses
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION expenses_daily_rollup_ins()
+        """
+    )
+
+    # Заполняем rollup по уже существующим тратам
+    op.execute(
+        """
+        INSERT INTO expense_daily_rollup
+            (project_id, day, category_id, currency_original, total_original, total_rub, expense_count)
+        SELECT project_id,
+               (created_at AT TIME ZONE 'UTC')::date,
+               COALESCE(category_id, 0),
+               currency_original,
+               SUM(amount_original),
+               SUM(amount_rub),
+               COUNT(*)
+        FROM expenses
+        GROUP BY 1, 2, 3, 4
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_expenses_daily_rollup ON expenses")
+    op.execute("DROP FUNCTION IF EXISTS expenses_daily_rollup_ins()")
+    op.drop_table("expense_daily_rollup")
+    op.drop_index("idx_expenses_project_created", table_name="expenses")
@@ -0,0 +1,33 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_budget_limits"
+down_revision = "0002_expense_daily_rollup"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Лимиты на проект (category_id = 0) и на отдельные категории.
+    # spent_rub — бегущая сумма трат, обновляется при каждой записи траты,
+    # alerted_pct — последний порог (80/100), о котором уже предупредили.
+    op.create_table(
+        "budget_limits",
+        sa.Column("id", sa.BigInteger, primary_key=True),
+        sa.Column("project_id", sa.BigInteger, sa.ForeignKey("projects.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("category_id", sa.BigInteger, server_default="0", nullable=False),
+        sa.Column("limit_rub", sa.Numeric(18, 2), nullable=False),
+        sa.Column("spent_rub", sa.Numeric(18, 2), server_default="0", nullable=False),
+        sa.Column("alerted_pct", sa.SmallInteger, server_default="0", nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()")),
+    )
+    op.create_unique_constraint(
+        "uq_budget_limits_project_category",
+        "budget_limits",
+        ["project_id", "category_id"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint("uq_budget_limits_project_category", "budget_limits", type_="unique")
+    op.drop_table("budget_limits")
@@ -0,0 +1,25 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_digest_runs"
+down_revision = "0003_budget_limits"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Прогресс ежедневной рассылки: если процесс перезапустится посреди
+    # рассылки, продолжим с пользователя после last_user_id.
+    op.create_table(
+        "digest_runs",
+        sa.Column("run_date", sa.Date, primary_key=True),
+        sa.Column("last_user_id", sa.BigInteger, server_default="0", nullable=False),
+        sa.Column("sent", sa.Integer, server_default="0", nullable=False),
+        sa.Column("failed", sa.Integer, server_default="0", nullable=False),
+        sa.Column("started_at", sa.DateTime(timezone=True), server_default=sa.text("now()")),
+        sa.Column("finished_at", sa.DateTime(timezone=True)),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("digest_runs")
@@ -0,0 +1,26 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005_expense_idempotency_key"
+down_revision = "0004_digest_runs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Ключ идемпотентности траты ("tg:<chat_id>:<message_id>"): повторная
+    # доставка того же сообщения не создаёт дубль. У импортированных трат
+    # ключа нет, поэтому индекс частичный.
+    op.add_column("expenses", sa.Column("idempotency_key", sa.String(64)))
+    op.create_index(
+        "uq_expenses_idempotency_key",
+        "expenses",
+        ["idempotency_key"],
+        unique=True,
+        postgresql_where=sa.text("idempotency_key IS NOT NULL"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("uq_expenses_idempotency_key", table_name="expenses")
+    op.drop_column("expenses", "idempotency_key")
@@ -0,0 +1,99 @@
+from alembic import op
+
+revision = "0006_money_minor_units"
+down_revision = "0005_expense_idempotency_key"
+branch_labels = None
+depends_on = None
+
+# Копия app/services/money.py: миграции не должны зависеть от кода приложения
+ZERO_DECIMAL = ("BIF", "CLP", "DJF", "GNF", "ISK", "JPY", "KMF", "KRW", "PYG", "RWF", "UGX", "UYI", "VND", "VUV",
+                "XAF", "XOF", "XPF")
+THREE_DECIMAL = ("BHD", "IQD", "JOD", "KWD", "LYD", "OMR", "TND")
+
+
+def _scale(currency_column: str) -> str:
+    """SQL-множитель 10^exponent для валюты в currency_column (без неё — рубли, 100)."""
+    if not currency_column:
+        return "100"
+    zero = ", ".join(f"'{c}'" for c in ZERO_DECIMAL)
+    three = ", ".join(f"'{c}'" for c in THREE_DECIMAL)
+    return (
+        f"CASE WHEN {currency_column} IN ({zero}) THEN 1 "
+        f"WHEN {currency_column} IN ({three}) THEN 1000 "
+        f"WHEN {currency_column} = 'CLF' THEN 10000 "
+        f"ELSE 100 END"
+    )
+
+
+def _to_minor(table: str, column: str, new_name: str, currency_column: str = "") -> None:
+    op.execute(
+        f"ALTER TABLE {table} ALTER COLUMN {column} TYPE bigint "
+        f"USING ROUND({column} * ({_scale(currency_column)}))::bigint"
+    )
+    op.alter_column(table, column, new_column_name=new_name)
+
+
+def _from_minor(table: str, column: str, old_name: str, currency_column: str = "") -> None:
+    op.alter_column(table, column, new_column_name=old_name)
+    op.execute(
+        f"ALTER TABLE {table} ALTER COLUMN {old_name} TYPE numeric(18, 2) "
+        f"USING {old_name}::numeric / ({_scale(currency_column)})"
+    )
+
+
+ROLLUP_FUNCTION = """
+CREATE OR REPLACE FUNCTION expenses_daily_rollup_ins() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO expense_daily_rollup AS r
+        (project_id, day, category_id, currency_original, {total_original}, {total_rub}, expense_count)
+    SELECT project_id,
+           (created_at AT TIME ZONE 'UTC')::date,
+           COALESCE(category_id, 0),
+           currency_original,
+           SUM({amount_original}),
+           SUM({amount_rub}),
+           COUNT(*)
+    FROM new_rows
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (project_id, day, category_id, currency_original) DO UPDATE
+    SET {total_original} = r.{total_original} + EXCLUDED.{total_original},
+        {total_rub}      = r.{total_rub} + EXCLUDED.{total_rub},
+        expense_count  = r.expense_count + EXCLUDED.expense_count;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    # Деньги — BIGINT в минорных единицах валюты (см. app/services/money.py):
+    # суммы точные, агрегаты целочисленные.
+    _to_minor("expenses", "amount_original", "amount_original_minor", "currency_original")
+    _to_minor("expenses", "amount_rub", "amount_rub_minor")
+    _to_minor("expense_daily_rollup", "total_original", "total_original_minor", "currency_original")
+    _to_minor("expense_daily_rollup", "total_rub", "total_rub_minor")
+    _to_minor("budget_limits", "limit_rub", "limit_rub_minor")
+    _to_minor("budget_limits", "spent_rub", "spent_rub_minor")
+
+    op.execute(ROLLUP_FUNCTION.format(
+        total_original="total_original_minor",
+        total_rub="total_rub_minor",
+        amount_original="amount_original_minor",
+        amount_rub="amount_rub_minor",
+    ))
+
+
+def downgrade() -> None:
+    op.execute(ROLLUP_FUNCTION.format(
+        total_original="total_original",
+        total_rub="total_rub",
+        amount_original="amount_original",
+        amount_rub="amount_rub",
+    ))
+
+    _from_minor("budget_limits", "spent_rub_minor", "spent_rub")
+    _from_minor("budget_limits", "limit_rub_minor", "limit_rub")
+    _from_minor("expense_daily_rollup", "total_rub_minor", "total_rub")
+    _from_minor("expense_daily_rollup", "total_original_minor", "total_original", "currency_original")
+    _from_minor("expenses", "amount_rub_minor", "amount_rub")
+    _from_minor("expenses", "amount_original_minor", "amount_original", "currency_original")
@@ -0,0 +1,55 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007_project_members"
+down_revision = "0006_money_minor_units"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Проект может вести несколько человек. projects.user_id остаётся
+    # владельцем, а участие и «активный проект» — у каждого участника свои.
+    op.create_table(
+        "project_members",
+        sa.Column("project_id", sa.BigInteger, sa.ForeignKey("projects.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("user_id", sa.BigInteger, sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("role", sa.String(16), server_default="member", nullable=False),
+        sa.Column("is_active", sa.Boolean, server_default=sa.text("false"), nullable=False),
+        sa.Column("joined_at", sa.DateTime(timezone=True), server_default=sa.text("now()")),
+        sa.PrimaryKeyConstraint("project_id", "user_id"),
+    )
+    op.create_index("idx_project_members_user", "project_members", ["user_id"])
+
+    op.execute(
+        """
+        INSERT INTO project_members (project_id, user_id, role, is_active, joined_at)
+        SELECT id, user_id, 'owner', is_active, created_at
+        FROM projects
+        """
+    )
+    op.drop_column("projects", "is_active")
+
+    # Код приглашения для ссылки t.me/<bot>?start=join_<код>
+    op.add_column("projects", sa.Column("invite_code", sa.String(32)))
+    op.create_index("uq_projects_invite_code", "projects", ["invite_code"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index("uq_projects_invite_code", table_name="projects")
+    op.drop_column("projects", "invite_code")
+
+    op.add_column(
+        "projects",
+        sa.Column("is_active", sa.Boolean, server_default=sa.text("false"), nullable=False),
+    )
+    op.execute(
+        """
+        UPDATE projects p
+        SET is_active = m.is_active
+        FROM project_members m
+        WHERE m.project_id = p.id AND m.user_id = p.user_id
+        """
+    )
+    op.drop_index("idx_project_members_user", table_name="project_members")
+    op.drop_table("project_members")
@@ -0,0 +1,16 @@
+from alembic import op
+
+revision = "0008_expenses_user_index"
+down_revision = "0007_project_members"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Дообучение классификатора категорий (app/services/categorizer.py)
+    # читает траты пользователя после последнего учтённого id
+    op.create_index("idx_expenses_user_id", "expenses", ["user_id", "id"])
+
+
+def downgrade() -> None:
+    op.drop_index("idx_expenses_user_id", table_name="expenses")
@@ -0,0 +1,20 @@
+from alembic import op
+
+revision = "0009_expense_description_trgm"
+down_revision = "0008_expenses_user_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # /find: триграммный GIN-индекс обслуживает и ILIKE '%…%', и нечёткое
+    # сравнение (<%), так что поиск по многолетней истории не сканирует таблицу
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(
+        "CREATE INDEX idx_expenses_description_trgm "
+        "ON expenses USING gin (lower(description) gin_trgm_ops)"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("idx_expenses_description_trgm", table_name="expenses")
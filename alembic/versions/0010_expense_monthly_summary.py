@@ -0,0 +1,30 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010_expense_monthly_summary"
+down_revision = "0009_expense_description_trgm"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Сжатые старые траты (app/services/compaction.py): месяц × категория ×
+    # валюта. Итоги проекта и лимиты читают expenses вместе с этой таблицей;
+    # expense_daily_rollup при сжатии не трогается, так что отчёты по
+    # периодам остаются точными до дня.
+    # category_id = 0 — трата без категории, как в expense_daily_rollup.
+    op.create_table(
+        "expense_monthly_summary",
+        sa.Column("project_id", sa.BigInteger, sa.ForeignKey("projects.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("month", sa.Date, nullable=False),
+        sa.Column("category_id", sa.BigInteger, server_default="0", nullable=False),
+        sa.Column("currency_original", sa.String(3), nullable=False),
+        sa.Column("total_original_minor", sa.BigInteger, nullable=False),
+        sa.Column("total_rub_minor", sa.BigInteger, nullable=False),
+        sa.Column("expense_count", sa.Integer, nullable=False),
+        sa.PrimaryKeyConstraint("project_id", "month", "category_id", "currency_original"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("expense_monthly_summary")
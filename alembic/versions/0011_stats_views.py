@@ -0,0 +1,70 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011_stats_views"
+down_revision = "0010_expense_monthly_summary"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Как разобрана трата: 'text' — своим парсером, 'gpt' — через GPT,
+    # 'import' — из банковской выписки. У старых трат NULL.
+    op.add_column("expenses", sa.Column("parse_source", sa.String(8)))
+
+    # Статистика для /stats (app/services/stats.py). Материализованные
+    # представления обновляются по расписанию через REFRESH ... CONCURRENTLY,
+    # которому нужен уникальный индекс; читать их можно с реплики.
+    op.execute(
+        """
+        CREATE MATERIALIZED VIEW stats_daily AS
+        SELECT (created_at AT TIME ZONE 'UTC')::date AS day,
+               COUNT(*) AS expenses,
+               COUNT(DISTINCT user_id) AS active_users,
+               COUNT(*) FILTER (WHERE parse_source IN ('text', 'gpt')) AS parsed,
+               COUNT(*) FILTER (WHERE parse_source = 'gpt') AS gpt
+        FROM expenses
+        WHERE created_at >= current_date - 30
+        GROUP BY 1
+        """
+    )
+    op.execute("CREATE UNIQUE INDEX uq_stats_daily_day ON stats_daily (day)")
+
+    op.execute(
+        """
+        CREATE MATERIALIZED VIEW stats_currencies AS
+        SELECT currency_original,
+               COUNT(*) AS expenses,
+               SUM(amount_rub_minor)::bigint AS total_rub_minor
+        FROM expenses
+        WHERE created_at >= current_date - 30
+        GROUP BY 1
+        """
+    )
+    op.execute("CREATE UNIQUE INDEX uq_stats_currencies_code ON stats_currencies (currency_original)")
+
+    # Одна строка; уникальных пользователей за неделю/месяц из дневных не сложить
+    op.execute(
+        """
+        CREATE MATERIALIZED VIEW stats_totals AS
+        SELECT 1 AS id,
+               (SELECT COUNT(*) FROM users) AS users,
+               (SELECT COUNT(DISTINCT user_id) FROM expenses
+                WHERE created_at >= current_date - 7) AS active_users_7d,
+               (SELECT COUNT(DISTINCT user_id) FROM expenses
+                WHERE created_at >= current_date - 30) AS active_users_30d,
+               (SELECT COUNT(*) FROM projects WHERE is_deleted = FALSE) AS projects,
+               (SELECT COUNT(*) FROM (
+                    SELECT project_id FROM project_members GROUP BY project_id HAVING COUNT(*) > 1
+                ) shared) AS shared_projects,
+               now() AS refreshed_at
+        """
+    )
+    op.execute("CREATE UNIQUE INDEX uq_stats_totals_id ON stats_totals (id)")
+
+
+def downgrade() -> None:
+    op.execute("DROP MATERIALIZED VIEW stats_totals")
+    op.execute("DROP MATERIALIZED VIEW stats_currencies")
+    op.execute("DROP MATERIALIZED VIEW stats_daily")
+    op.drop_column("expenses", "parse_source")
@@ -0,0 +1,127 @@
+from alembic import op
+
+revision = "0012_shared_project_categories"
+down_revision = "0011_stats_views"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Категории принадлежат пользователю, а лимиты на категорию считаются по
+    # category_id. В общем проекте участники писали траты в свои категории,
+    # и лимит владельца на «еду» не видел «еду» остальных. Теперь траты и
+    # лимиты проекта всегда ссылаются на категории владельца проекта;
+    # переносим на них то, что участники уже успели записать.
+    # expense_daily_rollup не трогаем: отчёты группируют его по имени.
+    op.execute(
+        """
+        CREATE TEMP TABLE category_remap ON COMMIT DROP AS
+        SELECT DISTINCT x.project_id, x.category_id AS old_id, p.user_id AS owner_id, c.name, c.slug,
+               NULL::bigint AS new_id
+        FROM (
+            SELECT project_id, category_id FROM expenses WHERE category_id IS NOT NULL
+            UNION
+            SELECT project_id, category_id FROM budget_limits WHERE category_id <> 0
+            UNION
+            SELECT project_id, category_id FROM expense_monthly_summary WHERE category_id <> 0
+        ) x
+        JOIN projects p ON p.id = x.project_id
+        JOIN categories c ON c.id = x.category_id
+        WHERE c.user_id IS DISTINCT FROM p.user_id
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO categories (user_id, name, slug, is_system)
+        SELECT DISTINCT owner_id, name, slug, FALSE
+        FROM category_remap
+        ON CONFLICT (user_id, name) DO NOTHING
+        """
+    )
+    op.execute(
+        """
+        UPDATE category_remap r
+        SET new_id = c.id
+        FROM categories c
+        WHERE c.user_id = r.owner_id AND c.name = r.name
+        """
+    )
+
+    op.execute(
+        """
+        UPDATE expenses e
+        SET category_id = r.new_id
+        FROM category_remap r
+        WHERE e.project_id = r.project_id AND e.category_id = r.old_id
+        """
+    )
+
+    op.execute(
+        """
+        INSERT INTO expense_monthly_summary AS s
+            (project_id, month, category_id, currency_original, total_original_minor, total_rub_minor, expense_count)
+        SELECT m.project_id, m.month, r.new_id, m.currency_original,
+               SUM(m.total_original_minor), SUM(m.total_rub_minor), SUM(m.expense_count)
+        FROM expense_monthly_summary m
+        JOIN category_remap r ON r.project_id = m.project_id AND r.old_id = m.category_id
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (project_id, month, category_id, currency_original) DO UPDATE
+        SET total_original_minor = s.total_original_minor + EXCLUDED.total_original_minor,
+            total_rub_minor      = s.total_rub_minor + EXCLUDED.total_rub_minor,
+            expense_count        = s.expense_count + EXCLUDED.expense_count
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM expense_monthly_summary m
+        USING category_remap r
+        WHERE m.project_id = r.project_id AND m.category_id = r.old_id
+        """
+    )
+
+    # Несколько лимитов на одну и ту же категорию: оставляем лимит владельца,
+    # а если его нет — самый ранний из лимитов участников
+    op.execute(
+        """
+        DELETE FROM budget_limits b
+        USING category_remap r
+        WHERE b.project_id = r.project_id AND b.category_id = r.old_id
+          AND EXISTS (
+              SELECT 1
+              FROM budget_limits o
+              LEFT JOIN category_remap ro ON ro.project_id = o.project_id AND ro.old_id = o.category_id
+              WHERE o.project_id = b.project_id
+                AND o.id <> b.id
+                AND COALESCE(ro.new_id, o.category_id) = r.new_id
+                AND (ro.old_id IS NULL OR o.id < b.id)
+          )
+        """
+    )
+    op.execute(
+        """
+        UPDATE budget_limits b
+        SET category_id = r.new_id
+        FROM category_remap r
+        WHERE b.project_id = r.project_id AND b.category_id = r.old_id
+        """
+    )
+    # Бегущие суммы лимитов на категории этих проектов считаем заново
+    op.execute(
+        """
+        UPDATE budget_limits b
+        SET spent_rub_minor = COALESCE((
+                SELECT SUM(amount_rub_minor) FROM expenses
+                WHERE project_id = b.project_id AND category_id = b.category_id
+            ), 0) + COALESCE((
+                SELECT SUM(total_rub_minor) FROM expense_monthly_summary
+                WHERE project_id = b.project_id AND category_id = b.category_id
+            ), 0)
+        WHERE b.category_id <> 0
+          AND b.project_id IN (SELECT project_id FROM category_remap)
+        """
+    )
+
+
+def downgrade() -> None:
+    # Какая трата была в чьей категории, не сохраняли — откатывать нечего
+    pass
@@ -0,0 +1,20 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0013_digest_run_claim"
+down_revision = "0012_shared_project_categories"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Кто сейчас рассылает дайджест за день: процесс забирает прогон, только
+    # если его никто не держит или держатель давно не отмечался (упал), —
+    # так два процесса бота не разошлют один и тот же дайджест дважды.
+    op.add_column("digest_runs", sa.Column("claimed_by", sa.Text))
+    op.add_column("digest_runs", sa.Column("heartbeat_at", sa.DateTime(timezone=True)))
+
+
+def downgrade() -> None:
+    op.drop_column("digest_runs", "heartbeat_at")
+    op.drop_column("digest_runs", "claimed_by")
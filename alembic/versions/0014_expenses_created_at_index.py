@@ -0,0 +1,17 @@
+from alembic import op
+
+revision = "0014_expenses_created_at_index"
+down_revision = "0013_digest_run_claim"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Сжатие (app/services/compaction.py) выбирает пачки по created_at < cutoff
+    # по всем проектам; без индекса каждая пачка и последний пустой проход —
+    # полный скан expenses на основной БД
+    op.create_index("idx_expenses_created_at", "expenses", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("idx_expenses_created_at", table_name="expenses")
@@ -3,5 +3,9 @@ from aiogram.fsm.storage.memory import MemoryStorage
 
 from .config import settings
 
-bot = Bot(token=settings.telegram_token, parse_mode="HTML")
 dp = Dispatcher(storage=MemoryStorage())
+
+
+def create_bot() -> Bot:
+    """Бот создаётся в стартовом хуке app.main, а не при импорте."""
+    return Bot(token=settings.telegram_token, parse_mode="HTML")
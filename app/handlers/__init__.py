@@ -1 +1 @@
-from . import start, projects, expenses, reports  # noqa: F401
+from . import start, projects, expenses, budgets, search, admin, reports, imports, inline  # noqa: F401
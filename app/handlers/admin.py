@@ -0,0 +1,62 @@
+from datetime import datetime
+
+from aiogram import Router, types, F
+from aiogram.filters import Command
+
+from app.config import settings
+from app.services import stats as stats_service
+from app.services.money import Money
+
+router = Router()
+# Команды только для ADMIN_IDS; остальным /stats просто не отвечает
+router.message.filter(F.from_user.id.in_(settings.admin_ids))
+
+
+def register(dp):
+    dp.include_router(router)
+
+
+# /stats — статистика по всему боту из материализованных представлений
+@router.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    data = await stats_service.get_stats()
+    totals = data["totals"]
+    if not totals:
+        await message.answer("Статистика ещё не посчитана.")
+        return
+
+    refreshed_at = totals["refreshed_at"]
+    if isinstance(refreshed_at, datetime):
+        refreshed = refreshed_at.strftime("%d.%m.%Y %H:%M UTC")
+    else:
+        refreshed = str(refreshed_at)
+    gpt_rate = data["gpt_rate"]
+    gpt_share = f"{gpt_rate * 100:.1f}%" if gpt_rate is not None else "—"
+    lines = [
+        "<b>Статистика бота</b>",
+        f"Пользователей: <b>{totals['users']}</b>",
+        f"Активных за 7 дней: <b>{totals['active_users_7d']}</b>, "
+        f"за 30 дней: <b>{totals['active_users_30d']}</b>",
+        f"Проектов: <b>{totals['projects']}</b>, из них общих: <b>{totals['shared_projects']}</b>",
+        f"Разбор через GPT: <b>{gpt_share}</b>",
+    ]
+
+    if data["daily"]:
+        lines.append("")
+        lines.append("Траты по дням:")
+        for row in data["daily"]:
+            lines.append(
+                f"• {row['day'].strftime('%d.%m')}: {row['expenses']} "
+                f"(пользователей: {row['active_users']})"
+            )
+
+    if data["currencies"]:
+        lines.append("")
+        lines.append("Валюты за 30 дней:")
+        for row in data["currencies"]:
+            total_rub = Money(int(row["total_rub_minor"] or 0), "RUB")
+            lines.append(f"• {row['currency_original']}: {row['expenses']} трат, {total_rub.format()} RUB")
+
+    lines.append("")
+    lines.append(f"<i>Обновлено: {refreshed}</i>")
+    await message.answer("\n".join(lines))
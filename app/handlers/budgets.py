@@ -0,0 +1,97 @@
+from decimal import Decimal, InvalidOperation
+
+from aiogram import Router, types
+from aiogram.filters import Command, CommandObject
+
+from app.services import users as users_service
+from app.services import projects as projects_service
+from app.services import expenses as expenses_service
+from app.services import budgets as budgets_service
+from app.services.money import Money
+
+router = Router()
+
+
+def register(dp):
+    dp.include_router(router)
+
+
+async def _send_budgets(message: types.Message, project: dict) -> None:
+    budgets = await budgets_service.get_budgets(project["id"])
+    if not budgets:
+        await message.answer(
+            f"Для проекта <b>«{project['name']}»</b> лимиты не заданы.\n\n"
+            "Примеры:\n"
+            "<code>/budget 100000</code> — лимит на весь проект (в RUB)\n"
+            "<code>/budget еда 20000</code> — лимит на категорию\n"
+            "<code>/budget еда 0</code> — убрать лимит"
+        )
+        return
+
+    lines = [f"Лимиты проекта <b>«{project['name']}»</b>:"]
+    for b in budgets:
+        limit_rub = Money(int(b["limit_rub_minor"]), "RUB")
+        spent_rub = Money(int(b["spent_rub_minor"]), "RUB")
+        pct = spent_rub.minor / limit_rub.minor * 100 if limit_rub else 0
+        name = "Весь проект" if not b["category_id"] else (b["category_name"] or "прочее").capitalize()
+        lines.append(f"• {name}: <b>{spent_rub.format()}</b> из {limit_rub.format()} RUB ({pct:.0f}%)")
+
+    await message.answer("\n".join(lines))
+
+
+# /budget — показать лимиты, /budget [категория] <сумма> — задать
+@router.message(Command("budget"))
+async def cmd_budget(message: types.Message, command: CommandObject):
+    tg_user = message.from_user
+    user = await users_service.get_or_create_user_by_telegram_id(
+        telegram_id=tg_user.id,
+        username=tg_user.username,
+        first_name=tg_user.first_name,
+        last_name=tg_user.last_name,
+    )
+
+    project = await projects_service.get_active_project(user["id"])
+    if not project:
+        await message.answer(
+            "У тебя нет активного проекта.\n"
+            "Создай проект через /newproject."
+        )
+        return
+
+    parts = (command.args or "").split()
+    if not parts:
+        await _send_budgets(message, project)
+        return
+
+    try:
+        limit_rub = Money.of(Decimal(parts[-1].replace(",", ".")), "RUB")
+    except InvalidOperation:
+        await message.answer("Сумма лимита должна быть числом, пример: <code>/budget еда 20000</code>.")
+        return
+    if limit_rub.minor < 0:
+        await message.answer("Лимит не может быть отрицательным.")
+        return
+
+    category_id = None
+    category_name = " ".join(parts[:-1]).strip().lower()
+    if category_name:
+        # Категории проекта — категории его владельца (см. handlers/expenses.py)
+        category = await expenses_service.get_or_create_category(project["user_id"], category_name)
+        category_id = category["id"]
+
+    scope = f"категории «{category_name.capitalize()}»" if category_name else "проекта"
+
+    if not limit_rub:
+        await budgets_service.delete_budget(project["id"], category_id)
+        await message.answer(f"Лимит для {scope} убран.")
+        return
+
+    budget = await budgets_service.set_budget(project["id"], category_id, limit_rub)
+    spent_rub = Money(int(budget["spent_rub_minor"]), "RUB")
+    pct = spent_rub.minor / limit_rub.minor * 100
+
+    await message.answer(
+        f"Лимит для {scope}: <b>{limit_rub.format()} RUB</b> ✅\n"
+        f"Уже потрачено: <b>{spent_rub.format()} RUB</b> ({pct:.0f}%).\n"
+        f"Предупрежу, когда будет 80% и 100%."
+    )
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+from decimal import Decimal, InvalidOperation
 from typing import Optional, Dict, Any, List
+import html
 import re
 
 from aiogram import Router, types, F
@@ -9,8 +11,12 @@ from aiogram.filters import Command
 from app.services import users as users_service
 from app.services import projects as projects_service
 from app.services import expenses as expenses_service
-from app.services.currency import get_rate_to_rub
+from app.services import budgets as budgets_service
+from app.services import categorizer, fanout, writebehind
+from app.services import cross_rates, currency_index
+from app.services.currency import ensure_rates, get_rate_to_rub
 from app.services.gpt_client import gpt_parse_expense
+from app.services.money import Money
 
 router = Router()
 
@@ -31,67 +37,13 @@ MAIN_MENU_BUTTONS = {
 
 # --- Нормализация валют -------------------------------------------------------
 
-CURRENCY_SYNONYMS = {
-    "RUB": (
-        "rub",
-        "руб",
-        "рубль",
-        "рубля",
-        "рублей",
-        "рубли",
-        "₽",
-    ),
-    "USD": (
-        "usd",
-        "доллар",
-        "доллара",
-        "долларов",
-        "бакс",
-        "бакса",
-        "баксов",
-        "$",
-        "дол",
-        "долл",
-    ),
-    "EUR": (
-        "eur",
-        "евро",
-        "€",
-    ),
-    "CNY": (
-        "cny",
-        "юань",
-        "юаня",
-        "юаней",
-        "юани",
-        "юан",
-        "yuan",
-    ),
-    "JPY": (
-        "jpy",
-        "йена",
-        "йены",
-        "йен",
-        "иена",
-        "иены",
-        "иен",
-        "yen",
-    ),
-}
-
 
 def normalize_currency_token(token: str) -> Optional[str]:
     """
     Приводим слово типа 'рублей', 'юаней', 'usd', '$' -> ISO-коду.
+    Узнаются только валюты, для которых есть курс (см. currency_index).
     """
-    t = token.strip().lower()
-    t = t.strip(".,;:()[]{}")
-
-    for code, variants in CURRENCY_SYNONYMS.items():
-        if t == code.lower() or t in variants:
-            return code
-
-    return None
+    return currency_index.resolve(token)
 
 
 # --- Простейший парсер текста траты ------------------------------------------
@@ -121,19 +73,26 @@ def basic_parse_expense_text(text: str) -> Optional[Dict[str, Any]]:
     suffix = (m.group("suffix") or "").strip()
     amount_str = m.group("amount").replace(",", ".")
     try:
-        amount = float(amount_str)
-    except ValueError:
+        amount = Decimal(amount_str)
+    except InvalidOperation:
         return None
 
-    # Категория — всё, что до числа (например, "отель Пекин")
-    category = prefix if prefix else "прочее"
-    category = category.strip("•-–").strip()
-
     currency: Optional[str] = None
     if suffix:
         # Берём первое слово после числа ("юаней", "рублей", "CNY" и т.п.)
         first_word = suffix.split()[0]
         currency = normalize_currency_token(first_word)
+    if currency is None and prefix:
+        # Валюта перед суммой: "кофе $5", "такси USD 10"; названия вроде
+        # «сом» здесь не узнаём — это скорее категория
+        *rest, last_word = prefix.split()
+        currency = currency_index.resolve_prefix(last_word)
+        if currency:
+            prefix = " ".join(rest)
+
+    # Категория — всё, что до числа (например, "отель Пекин")
+    category = prefix if prefix else "прочее"
+    category = category.strip("•-–").strip()
 
     return {
         "amount": amount,
@@ -153,6 +112,20 @@ async def _process_expense_message(message: types.Message):
     if text in MAIN_MENU_BUTTONS:
         return
 
+    # Повторная доставка того же сообщения не должна записать трату дважды
+    idempotency_key = expenses_service.message_idempotency_key(message.chat.id, message.message_id)
+    if not expenses_service.claim_idempotency_key(idempotency_key):
+        print(f"[expenses] duplicate delivery of {idempotency_key}, skipped")
+        return
+
+    try:
+        await _record_expense(message, text, idempotency_key)
+    except Exception:
+        expenses_service.release_idempotency_key(idempotency_key)
+        raise
+
+
+async def _record_expense(message: types.Message, text: str, idempotency_key: str):
     tg_user = message.from_user
 
     user = await users_service.get_or_create_user_by_telegram_id(
@@ -170,8 +143,12 @@ async def _process_expense_message(message: types.Message):
         )
         return
 
+    # Курсы нужны уже парсеру: по ним собран индекс валют
+    await ensure_rates()
+
     # 1. Пытаемся распарсить сами
     parsed = basic_parse_expense_text(text)
+    parse_source = "text"
 
     # 2. Если не получилось или нет суммы — пробуем GPT
     use_gpt = parsed is None or parsed.get("amount") is None
@@ -186,6 +163,7 @@ async def _process_expense_message(message: types.Message):
                     if cur:
                         gpt_result["currency"] = cur
             parsed = gpt_result
+            parse_source = "gpt"
 
     if not parsed or not parsed.get("amount"):
         await message.answer(
@@ -195,61 +173,102 @@ async def _process_expense_message(message: types.Message):
         )
         return
 
-    amount = float(parsed["amount"])
-
     # Выбираем валюту: из парсера -> из проекта -> из пользователя -> RUB
     raw_currency = (
         (parsed.get("currency") or "")
         or (project.get("base_currency") or "")
         or (user.get("base_currency") or "")
     )
-    currency = raw_currency.upper() if raw_currency else "RUB"
-
-    # Нормализуем, если это русское слово типа "юаней"
-    norm_from_word = normalize_currency_token(currency)
-    if norm_from_word:
-        currency = norm_from_word
+    # Нормализуем, если это русское слово типа "юаней". Валюту без курса
+    # не подменяем рублями молча, а говорим об этом
+    currency = normalize_currency_token(raw_currency) if raw_currency else "RUB"
+    if currency is None:
+        await message.answer(
+            f"Не знаю курс валюты <b>{html.escape(str(raw_currency))}</b> 😔\n"
+            "Укажи валюту ISO-кодом, например <code>кофе 5 USD</code>."
+        )
+        return
 
-    supported_currencies = {"RUB", "USD", "EUR", "CNY", "JPY"}
-    if currency not in supported_currencies:
-        currency = "RUB"
+    try:
+        amount = Money.of(str(parsed["amount"]).replace(",", "."), currency)
+        # Пересчёт в рубли (тут же ловим суммы, которые в рублях не влезут в BIGINT)
+        if currency == "RUB":
+            amount_rub = amount
+        else:
+            amount_rub = amount.convert(await get_rate_to_rub(currency), "RUB")
+    except InvalidOperation:
+        amount = None
+    if not amount:
+        await message.answer("Не смог понять сумму траты 😔")
+        return
 
     category_name = (parsed.get("category") or "прочее").strip().lower()
     description = parsed.get("description") or text
+    # Текст вроде «кофе старбакс» или «кофэ» — к уже привычной категории пользователя
+    category_name = await categorizer.choose_category(user["id"], description, category_name)
 
-    # Категория
+    # Категория — из категорий владельца проекта, чтобы в общем проекте
+    # траты всех участников попадали в одни и те же категории и лимиты
     category = await expenses_service.get_or_create_category(
-        user_id=user["id"],
+        user_id=project["user_id"],
         name=category_name,
     )
-
-    # Пересчёт в рубли
-    if currency == "RUB":
-        amount_rub = amount
+    categorizer.remember_category(user["id"], category_name)
+
+    if writebehind.enabled():
+        # Трата уходит в локальный журнал, итоги — из кэша; в Postgres её
+        # запишет фоновый писатель, он же пришлёт предупреждения о лимитах
+        totals = await writebehind.submit(
+            user_id=user["id"],
+            project_id=project["id"],
+            project_name=project["name"],
+            chat_id=message.chat.id,
+            category_id=category["id"],
+            amount=amount,
+            amount_rub=amount_rub,
+            description=description,
+            idempotency_key=idempotency_key,
+            parse_source=parse_source,
+        )
+        if totals is None:
+            print(f"[expenses] {idempotency_key} already journaled, skipped")
+            return
+        budget_alerts: List[Dict[str, Any]] = []
     else:
-        rate = await get_rate_to_rub(currency)
-        amount_rub = float(rate) * amount
-
-    # Сохраняем трату с оригинальной валютой и суммой в рублях
-    await expenses_service.create_expense(
-        user_id=user["id"],
-        project_id=project["id"],
-        category_id=category["id"],
-        amount_original=amount,
-        currency_original=currency,
-        amount_rub=amount_rub,
-        description=description,
-    )
+        # Сохраняем трату с оригинальной валютой и суммой в рублях
+        expense = await expenses_service.create_expense(
+            user_id=user["id"],
+            project_id=project["id"],
+            category_id=category["id"],
+            amount=amount,
+            amount_rub=amount_rub,
+            description=description,
+            idempotency_key=idempotency_key,
+            parse_source=parse_source,
+        )
+        if expense is None:
+            # Трата из этого сообщения уже записана (например, до рестарта)
+            print(f"[expenses] {idempotency_key} already recorded, skipped")
+            return
+
+        # Лимиты: сравниваем бегущую сумму до и после этой траты
+        budget_alerts = await budgets_service.record_spend(
+            project_id=project["id"],
+            category_id=category["id"],
+            amount_rub=amount_rub,
+        )
+
+        # Итоги по проекту
+        # Читаем с основной БД: реплика может ещё не увидеть только что записанную трату
+        totals = await expenses_service.get_project_totals(project["id"], primary=True)
 
-    # Итоги по проекту
-    totals = await expenses_service.get_project_totals(project["id"])
     by_currency = totals["by_currency"]
     total_rub = totals["total_rub"]
 
     lines: List[str] = []
 
-    pretty_amount_original = f"{amount:.2f}".rstrip("0").rstrip(".")
-    pretty_amount_rub = f"{amount_rub:.2f}".rstrip("0").rstrip(".")
+    pretty_amount_original = amount.format()
+    pretty_amount_rub = amount_rub.format()
 
     lines.append(f"Записал трату в проект <b>«{project['name']}»</b> ✅")
     lines.append(f"Категория: <b>{category_name.capitalize()}</b>")
@@ -265,15 +284,34 @@ async def _process_expense_message(message: types.Message):
     lines.append("Итоги по проекту:")
 
     for curr_code, total_val in by_currency.items():
-        pretty_total = f"{float(total_val):.2f}".rstrip("0").rstrip(".")
+        pretty_total = total_val.format()
         lines.append(f"• {curr_code}: <b>{pretty_total}</b>")
 
-    pretty_total_rub = f"{float(total_rub):.2f}".rstrip("0").rstrip(".")
+    pretty_total_rub = total_rub.format()
     lines.append("")
     lines.append(f"Общий бюджет в RUB: <b>{pretty_total_rub} RUB</b>")
 
+    # Если у проекта своя валюта — показываем итог и в ней (по курсам на дату трат)
+    base_currency = (project.get("base_currency") or "RUB").upper()
+    rates = cross_rates.current()
+    if base_currency != "RUB" and rates is not None and base_currency in rates:
+        pretty_total_base = total_rub.convert(rates.rate("RUB", base_currency), base_currency).format()
+        lines.append(f"В валюте проекта: <b>≈ {pretty_total_base} {base_currency}</b>")
+
     await message.answer("\n".join(lines))
 
+    # Остальным участникам общего проекта — в ближайшую сводку
+    author = message.from_user.first_name or message.from_user.username or "Кто-то"
+    await fanout.notify_expense(
+        message.bot,
+        project,
+        user["id"],
+        f"{html.escape(author)}: {html.escape(category_name)} — {amount.format()} {currency}",
+    )
+
+    for alert in budget_alerts:
+        await message.answer(budgets_service.format_alert(alert, project["name"]))
+
 
 @router.message(Command("add"))
 async def cmd_add(message: types.Message):
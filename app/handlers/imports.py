@@ -0,0 +1,94 @@
+import os
+import tempfile
+
+from aiogram import Router, types, F
+
+from app.services import users as users_service
+from app.services import projects as projects_service
+from app.services import bank_import
+from app.services import budgets as budgets_service
+from app.services import writebehind
+
+router = Router()
+
+# Telegram Bot API не отдаёт ботам файлы больше 20 МБ
+MAX_STATEMENT_SIZE = 20 * 1024 * 1024
+
+
+def register(dp):
+    dp.include_router(router)
+
+
+def _is_csv(document: types.Document) -> bool:
+    name = (document.file_name or "").lower()
+    return name.endswith(".csv") or document.mime_type in ("text/csv", "text/comma-separated-values")
+
+
+@router.message(F.document)
+async def statement_document(message: types.Message):
+    """Импорт банковской выписки в CSV в текущий проект."""
+    document = message.document
+    if not _is_csv(document):
+        await message.answer(
+            "Пока умею импортировать только выписки в формате CSV "
+            "(выгрузка операций из приложения банка)."
+        )
+        return
+
+    if document.file_size and document.file_size > MAX_STATEMENT_SIZE:
+        await message.answer("Файл слишком большой: Telegram отдаёт ботам файлы до 20 МБ.")
+        return
+
+    tg_user = message.from_user
+    user = await users_service.get_or_create_user_by_telegram_id(
+        telegram_id=tg_user.id,
+        username=tg_user.username,
+        first_name=tg_user.first_name,
+        last_name=tg_user.last_name,
+    )
+
+    project = await projects_service.get_active_project(user["id"])
+    if not project:
+        await message.answer(
+            "У тебя нет активного проекта.\n"
+            "Создай проект через /newproject, затем пришли выписку ещё раз."
+        )
+        return
+
+    fd, path = tempfile.mkstemp(prefix="budgetbot_import_", suffix=".csv")
+    os.close(fd)
+    try:
+        await message.bot.download(document, destination=path)
+        result = await bank_import.import_statement(
+            path,
+            user_id=user["id"],
+            project_id=project["id"],
+            default_currency=project.get("base_currency") or "RUB",
+        )
+    except bank_import.StatementFormatError:
+        await message.answer(
+            "Не смог разобрать выписку 😔\n"
+            "Нужен CSV с колонками «Дата», «Сумма» и «Описание»."
+        )
+        return
+    finally:
+        os.remove(path)
+
+    writebehind.invalidate_totals(project["id"])
+
+    if result.imported == 0:
+        await message.answer("В выписке не нашлось расходов для импорта.")
+        return
+
+    pretty_total_rub = result.total_rub.format()
+    lines = [
+        f"Импортировал в проект <b>«{project['name']}»</b> {result.imported} трат ✅",
+        f"На сумму: <b>{pretty_total_rub} RUB</b>",
+    ]
+    if result.skipped:
+        lines.append(f"Пропущено строк (доходы, отклонённые операции, мусор): {result.skipped}")
+
+    await message.answer("\n".join(lines))
+
+    for alert in await budgets_service.collect_pending_alerts(project["id"]):
+        await message.answer(budgets_service.format_alert(alert, project["name"]))
@@ -0,0 +1,99 @@
+"""
+Inline-режим: «@bot» в любом чате показывает итоги активного проекта.
+
+Глянуть бюджет так можно часто, поэтому готовый ответ держим в памяти по
+telegram_id на INLINE_CACHE_TTL секунд, и столько же его кэширует сам
+Telegram (cache_time, is_personal) — повторный запрос за это время вообще не
+доходит до бота. Итоги могут отставать от последней траты на эти секунды.
+"""
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Router, types
+from aiogram.types import (
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent,
+)
+
+from app.config import settings
+from app.services import users as users_service
+from app.services import projects as projects_service
+from app.services import expenses as expenses_service
+from app.services import cross_rates, writebehind
+
+router = Router()
+
+# Чтобы кэш не рос бесконечно: при переполнении просто очищаем
+INLINE_CACHE_MAX = 10000
+
+# telegram_id -> (результаты, кнопка, время сборки)
+_answers: Dict[int, Tuple[List[InlineQueryResultArticle], Optional[InlineQueryResultsButton], float]] = {}
+
+
+def register(dp):
+    dp.include_router(router)
+
+
+async def _build_answer(
+    tg_user: types.User,
+) -> Tuple[List[InlineQueryResultArticle], Optional[InlineQueryResultsButton]]:
+    start_button = InlineQueryResultsButton(text="Создать проект в боте", start_parameter="inline")
+
+    user = await users_service.get_or_create_user_by_telegram_id(
+        telegram_id=tg_user.id,
+        username=tg_user.username,
+        first_name=tg_user.first_name,
+        last_name=tg_user.last_name,
+    )
+    project = await projects_service.get_active_project(user["id"])
+    if not project:
+        return [], start_button
+
+    if writebehind.enabled():
+        totals = await writebehind.get_totals(project["id"])
+    else:
+        totals = await expenses_service.get_project_totals(project["id"])
+
+    total_rub = totals["total_rub"]
+    by_currency = totals["by_currency"]
+
+    lines = [f"Проект <b>«{project['name']}»</b>"]
+    for code, val in by_currency.items():
+        lines.append(f"• {code}: <b>{val.format()}</b>")
+    lines.append(f"Всего: <b>{total_rub.format()} RUB</b>")
+
+    title = f"«{project['name']}»: {total_rub.format()} RUB"
+    base_currency = (project.get("base_currency") or "RUB").upper()
+    rates = cross_rates.current()
+    if base_currency != "RUB" and rates is not None and base_currency in rates:
+        total_base = total_rub.convert(rates.rate("RUB", base_currency), base_currency).format()
+        lines.append(f"В валюте проекта: <b>≈ {total_base} {base_currency}</b>")
+        title += f" ≈ {total_base} {base_currency}"
+
+    description = ", ".join(f"{code} {val.format()}" for code, val in by_currency.items()) or "Трат пока нет"
+
+    article = InlineQueryResultArticle(
+        id=f"totals:{project['id']}:{total_rub.minor}",
+        title=title,
+        description=description,
+        input_message_content=InputTextMessageContent(message_text="\n".join(lines)),
+    )
+    return [article], None
+
+
+@router.inline_query()
+async def inline_totals(inline_query: types.InlineQuery):
+    tg_id = inline_query.from_user.id
+    ttl = settings.inline_cache_ttl
+
+    cached = _answers.get(tg_id)
+    if cached and time.monotonic() - cached[2] < ttl:
+        results, button = cached[0], cached[1]
+    else:
+        results, button = await _build_answer(inline_query.from_user)
+        if len(_answers) >= INLINE_CACHE_MAX:
+            _answers.clear()
+        _answers[tg_id] = (results, button, time.monotonic())
+
+    await inline_query.answer(results, cache_time=ttl, is_personal=True, button=button)
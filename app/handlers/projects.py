@@ -3,6 +3,7 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.deep_linking import create_start_link
 
 from app.services import users as users_service
 from app.services import projects as projects_service
@@ -111,7 +112,7 @@ async def _send_projects_inline_menu(
         text = "Выбери проект, который сделать активным:"
         prefix = "setproj"
     else:
-        text = "Выбери проект, который удалить (без подтверждения):"
+        text = "Выбери проект, который удалить (из общего 👥 — выйти), без подтверждения:"
         prefix = "delproj"
 
     keyboard = InlineKeyboardMarkup(
@@ -119,7 +120,7 @@ async def _send_projects_inline_menu(
             [
                 InlineKeyboardButton(
                     # убрали отображение ID из текста кнопки
-                    text=f"{p['name']}",
+                    text=f"{p['name']}" if p["role"] == projects_service.ROLE_OWNER else f"👥 {p['name']}",
                     callback_data=f"{prefix}:{p['id']}",
                 )
             ]
@@ -214,13 +215,46 @@ async def cb_delete_project(callback: types.CallbackQuery):
 
     user = await _get_or_create_user(callback.from_user)
 
-    ok = await projects_service.delete_project(
+    project = await projects_service.delete_project(
         user_id=user["id"],
         project_id=project_id,
     )
-    if not ok:
+    if not project:
         await callback.answer("Проект не найден или не принадлежит тебе.", show_alert=True)
         return
 
-    await callback.answer("Проект удалён.", show_alert=False)
-    await callback.message.edit_text("Проект удалён.")
+    if project["role"] == projects_service.ROLE_OWNER:
+        text = "Проект удалён."
+    else:
+        text = f"Ты вышел из проекта «{project['name']}»."
+    await callback.answer(text, show_alert=False)
+    await callback.message.edit_text(text)
+
+
+# --- ОБЩИЕ ПРОЕКТЫ ---
+
+
+@router.message(Command("invite"))
+async def cmd_invite(message: types.Message):
+    """Ссылка-приглашение в активный проект и список участников."""
+    user = await _get_or_create_user(message.from_user)
+    project = await projects_service.get_active_project(user["id"])
+    if not project:
+        await message.answer("У тебя нет активного проекта. Создай его через /newproject.")
+        return
+
+    code = await projects_service.get_invite_code(user["id"], project["id"])
+    if not code:
+        await message.answer("Проект не найден или не принадлежит тебе.")
+        return
+
+    link = await create_start_link(message.bot, f"join_{code}")
+    members = await projects_service.get_project_members(project["id"])
+    names = [m["first_name"] or m["username"] or "без имени" for m in members]
+
+    await message.answer(
+        f"Приглашение в проект <b>«{project['name']}»</b>:\n{link}\n\n"
+        f"Кто перейдёт по ссылке, сможет записывать траты в этот проект, "
+        f"а остальные участники будут получать сводку о новых тратах.\n\n"
+        f"Участники: {', '.join(names)}"
+    )
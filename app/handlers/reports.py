@@ -1,13 +1,22 @@
 from __future__ import annotations
 
-from typing import Dict, Any
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Optional, Tuple
 
 from aiogram import Router, types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
+from aiogram.types import BufferedInputFile, FSInputFile
 
 from app.services import users as users_service
 from app.services import projects as projects_service
 from app.services import expenses as expenses_service
+from app.services import export as export_service
+from app.services import charts as charts_service
+from app.services import currency_index
+from app.services.currency import ensure_rates
+from app.services.money import Money
 from app.services.gpt_client import gpt_summarize_report
 
 router = Router()
@@ -16,15 +25,123 @@ router = Router()
 BUTTON_REPORT_TEXT = "Получить сводку по текущему проекту"
 
 
+UNIT_TITLES = {
+    "day": "по дням",
+    "week": "по неделям",
+    "month": "по месяцам",
+}
+
+# Слова для пересчёта по текущим курсам вместо курсов на дату трат
+CURRENT_RATES_WORDS = {"now", "current", "сейчас", "текущий", "текущим"}
+
+# Диапазоны: 01.05.2024-31.05.2024, 01.05-31.05 (текущий год), 2024-05-01..2024-05-31, 01.05.2024
+RANGE_RE = re.compile(r"^(?P<from>[\d.\-]+?)(?:\.\.|–|-)(?P<to>\d[\d.\-]*)$")
+
+
 def register(dp):
     dp.include_router(router)
 
 
-async def _send_report(message: types.Message) -> None:
+def _parse_date(raw: str) -> date:
+    for fmt in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(raw, fmt).date()
+        except ValueError:
+            continue
+    # Без года — считаем, что текущий
+    return datetime.strptime(f"{raw}.{date.today().year}", "%d.%m.%Y").date()
+
+
+def _parse_range(raw: str) -> Tuple[date, date]:
+    # Одна дата — отчёт за один день. Проверяем её до RANGE_RE: тот разрезал
+    # бы ISO-дату по её собственному '-'
+    try:
+        day = _parse_date(raw)
+        return day, day
+    except ValueError:
+        pass
+
+    # ISO-даты сами содержат '-', поэтому для них разделитель только '..'
+    if ".." in raw:
+        left, right = raw.split("..", 1)
+    else:
+        m = RANGE_RE.match(raw)
+        if not m:
+            raise ValueError(f"bad date range: {raw}")
+        left, right = m.group("from"), m.group("to")
+
+    date_from, date_to = _parse_date(left), _parse_date(right)
+    if date_from > date_to:
+        date_from, date_to = date_to, date_from
+    return date_from, date_to
+
+
+def _auto_unit(date_from: date, date_to: date) -> str:
+    days = (date_to - date_from).days + 1
+    if days <= 31:
+        return "day"
+    if days <= 180:
+        return "week"
+    return "month"
+
+
+def _parse_period_args(args: str) -> Tuple[Optional[str], Optional[date], Optional[date], Optional[str], bool]:
     """
-    Общая функция: строит отчёт и отправляет его.
-    Вызывается и из /report, и из кнопки.
+    Разбирает аргументы /report (в любом порядке):
+      day|week|month          — разбивка (по умолчанию подбирается по длине периода)
+      <диапазон>              — период
+      <валюта>                — валюта отчёта (USD, евро, ₸...), по умолчанию валюта проекта
+      now                     — пересчитать по текущим курсам, а не по курсам на дату трат
+    Возвращает (unit, date_from, date_to, currency, historical); unit=None —
+    аргументов разбивки и периода не было.
     """
+    unit: Optional[str] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    currency: Optional[str] = None
+    historical = True
+
+    for token in args.split():
+        low = token.lower()
+        if low in expenses_service.BUCKET_UNITS:
+            unit = low
+        elif low in CURRENT_RATES_WORDS:
+            historical = False
+        elif currency_index.resolve(low):
+            currency = currency_index.resolve(low)
+        else:
+            date_from, date_to = _parse_range(token)
+
+    if unit is None and date_from:
+        unit = _auto_unit(date_from, date_to)
+    return unit, date_from, date_to, currency, historical
+
+
+def _bucket_label(bucket: date, unit: str) -> str:
+    if unit == "day":
+        return bucket.strftime("%d.%m.%Y")
+    if unit == "week":
+        end = bucket + timedelta(days=6)
+        return f"{bucket.strftime('%d.%m')}–{end.strftime('%d.%m.%Y')}"
+    return bucket.strftime("%m.%Y")
+
+
+def _pretty(value: Money) -> str:
+    return value.format()
+
+
+def _as_float(values: Dict[str, Money]) -> Dict[str, float]:
+    """Для графиков и GPT-сводки, которым нужны обычные числа."""
+    return {key: float(val.to_decimal()) for key, val in values.items()}
+
+
+def _rates_note(report: Dict[str, Any]) -> str:
+    if report["currency"] == "RUB" and report["historical"]:
+        return ""
+    return " — по курсам на дату трат" if report["historical"] else " — по текущим курсам"
+
+
+async def _get_report_project(message: types.Message) -> Optional[Dict[str, Any]]:
     tg_user = message.from_user
 
     user = await users_service.get_or_create_user_by_telegram_id(
@@ -40,15 +157,38 @@ async def _send_report(message: types.Message) -> None:
             "У тебя нет активного проекта.\n"
             "Создай проект через /newproject."
         )
+    return project
+
+
+async def _report_currency(project: Dict[str, Any], requested: Optional[str]) -> str:
+    """Валюта отчёта: запрошенная -> валюта проекта -> RUB."""
+    await ensure_rates()
+    if requested:
+        return requested
+    base = (project.get("base_currency") or "RUB").upper()
+    return base if currency_index.is_supported(base) else "RUB"
+
+
+async def _send_report(
+    message: types.Message,
+    currency: Optional[str] = None,
+    historical: bool = True,
+) -> None:
+    """
+    Общая функция: строит отчёт и отправляет его.
+    Вызывается и из /report, и из кнопки.
+    """
+    project = await _get_report_project(message)
+    if not project:
         return
 
-    totals: Dict[str, Any] = await expenses_service.get_project_totals(project["id"])
-    cat_totals: Dict[str, Any] = await expenses_service.get_project_category_totals_rub(
-        project["id"]
+    currency = await _report_currency(project, currency)
+    report = await expenses_service.get_project_period_report(
+        project["id"], "month", currency=currency, historical=historical
     )
 
-    by_currency = totals["by_currency"]
-    total_rub = totals["total_rub"]
+    by_currency = report["by_currency"]
+    cat_totals = report["categories"]
 
     lines = [f"Отчёт по проекту <b>«{project['name']}»</b>"]
 
@@ -57,40 +197,156 @@ async def _send_report(message: types.Message) -> None:
         lines.append("")
         lines.append("По валютам:")
         for code, val in by_currency.items():
-            pretty = f"{float(val):.2f}".rstrip("0").rstrip(".")
-            lines.append(f"• {code}: <b>{pretty}</b>")
+            lines.append(f"• {code}: <b>{_pretty(val)}</b>")
 
     # Блок по категориям
     if cat_totals:
         lines.append("")
-        lines.append("Разбивка по категориям (в RUB):")
+        lines.append(f"Разбивка по категориям (в {currency}{_rates_note(report)}):")
         for cat_name, val in cat_totals.items():
-            pretty = f"{float(val):.2f}".rstrip("0").rstrip(".")
-            lines.append(f"• {cat_name.capitalize()}: <b>{pretty}</b>")
+            lines.append(f"• {cat_name.capitalize()}: <b>{_pretty(val)}</b>")
 
-    # Итог в рублях
-    pretty_total_rub = f"{float(total_rub):.2f}".rstrip("0").rstrip(".")
+    # Итог в валюте отчёта
     lines.append("")
-    lines.append(f"Итоговый бюджет в RUB: <b>{pretty_total_rub} RUB</b>")
+    lines.append(f"Итоговый бюджет в {currency}: <b>{_pretty(report['total'])} {currency}</b>")
 
     await message.answer("\n".join(lines))
 
+    chart = await charts_service.get_report_chart(project, _as_float(report["categories_in_rub"]))
+    if chart:
+        await message.answer_photo(BufferedInputFile(chart, filename="report.png"))
+
     # Структура для GPT-сводки
     structured = {
         "project_name": project["name"],
-        "totals_by_currency": by_currency,
-        "categories_in_rub": cat_totals,
-        "total_in_rub": total_rub,
+        "report_currency": currency,
+        "totals_by_currency": _as_float(by_currency),
+        "categories": _as_float(cat_totals),
+        "total": float(report["total"].to_decimal()),
     }
     summary = await gpt_summarize_report(structured)
     if summary:
         await message.answer(summary)
 
 
-# Команда /report
+async def _send_period_report(
+    message: types.Message,
+    unit: str,
+    date_from: Optional[date],
+    date_to: Optional[date],
+    currency: Optional[str] = None,
+    historical: bool = True,
+) -> None:
+    """Отчёт за период с разбивкой по дням/неделям/месяцам."""
+    project = await _get_report_project(message)
+    if not project:
+        return
+
+    currency = await _report_currency(project, currency)
+    report = await expenses_service.get_project_period_report(
+        project["id"], unit, date_from, date_to, currency=currency, historical=historical
+    )
+
+    title = f"Отчёт по проекту <b>«{project['name']}»</b>"
+    if date_from and date_to:
+        title += f" за {date_from.strftime('%d.%m.%Y')}–{date_to.strftime('%d.%m.%Y')}"
+    lines = [title]
+
+    if not report["buckets"]:
+        lines.append("")
+        lines.append("За этот период трат нет.")
+        await message.answer("\n".join(lines))
+        return
+
+    lines.append("")
+    lines.append(f"Расходы {UNIT_TITLES[unit]} (в {currency}{_rates_note(report)}):")
+    for item in report["buckets"]:
+        lines.append(f"• {_bucket_label(item['bucket'], unit)}: <b>{_pretty(item['total'])}</b>")
+
+    if report["by_currency"]:
+        lines.append("")
+        lines.append("По валютам:")
+        for code, val in report["by_currency"].items():
+            lines.append(f"• {code}: <b>{_pretty(val)}</b>")
+
+    if report["categories"]:
+        lines.append("")
+        lines.append(f"Разбивка по категориям (в {currency}):")
+        for cat_name, val in report["categories"].items():
+            lines.append(f"• {cat_name.capitalize()}: <b>{_pretty(val)}</b>")
+
+    lines.append("")
+    lines.append(f"Итого за период: <b>{_pretty(report['total'])} {currency}</b>")
+
+    await message.answer("\n".join(lines))
+
+
+# Команда /report [day|week|month] [период] [валюта] [now]
 @router.message(Command("report"))
-async def cmd_report(message: types.Message):
-    await _send_report(message)
+async def cmd_report(message: types.Message, command: CommandObject):
+    # Валюту в аргументах узнаём по индексу, а он строится по таблице курсов
+    await ensure_rates()
+    try:
+        unit, date_from, date_to, currency, historical = _parse_period_args(command.args or "")
+    except ValueError:
+        await message.answer(
+            "Не понял период 😔 Примеры:\n"
+            "<code>/report week</code> — по неделям за всё время\n"
+            "<code>/report 01.05-31.05</code> — за период\n"
+            "<code>/report month 01.01.2024-31.12.2024</code>\n"
+            "<code>/report usd now</code> — в долларах по текущему курсу"
+        )
+        return
+
+    if unit is None:
+        await _send_report(message, currency, historical)
+    else:
+        await _send_period_report(message, unit, date_from, date_to, currency, historical)
+
+
+# Команда /export [csv|xlsx] — выгрузка всех трат текущего проекта файлом
+@router.message(Command("export"))
+async def cmd_export(message: types.Message, command: CommandObject):
+    fmt = (command.args or "csv").strip().lower()
+    if fmt not in export_service.EXPORT_FORMATS:
+        await message.answer(
+            "Поддерживаются форматы: <code>/export csv</code> и <code>/export xlsx</code>."
+        )
+        return
+
+    tg_user = message.from_user
+    user = await users_service.get_or_create_user_by_telegram_id(
+        telegram_id=tg_user.id,
+        username=tg_user.username,
+        first_name=tg_user.first_name,
+        last_name=tg_user.last_name,
+    )
+
+    project = await projects_service.get_active_project(user["id"])
+    if not project:
+        await message.answer(
+            "У тебя нет активного проекта.\n"
+            "Создай проект через /newproject."
+        )
+        return
+
+    try:
+        path, count = await export_service.export_project_expenses(project["id"], fmt)
+    except ImportError:
+        await message.answer("Выгрузка в XLSX сейчас недоступна, попробуй <code>/export csv</code>.")
+        return
+
+    try:
+        if count == 0:
+            await message.answer("В этом проекте пока нет трат, выгружать нечего.")
+            return
+
+        await message.answer_document(
+            FSInputFile(path, filename=f"{project['name']}.{fmt}"),
+            caption=f"Траты проекта <b>«{project['name']}»</b>: {count} шт.",
+        )
+    finally:
+        os.remove(path)
 
 
 # Нажатие кнопки "Получить сводку по текущему проекту"
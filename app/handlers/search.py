@@ -0,0 +1,104 @@
+import html
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from aiogram import Router, types, F
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from app.services import users as users_service
+from app.services import projects as projects_service
+from app.services import expenses as expenses_service
+
+router = Router()
+
+# Короче триграммный индекс не помогает, а находится почти всё подряд
+MIN_QUERY_LENGTH = 3
+
+
+def register(dp):
+    dp.include_router(router)
+
+
+async def _get_project(tg_user: types.User) -> Optional[Dict[str, Any]]:
+    user = await users_service.get_or_create_user_by_telegram_id(
+        telegram_id=tg_user.id,
+        username=tg_user.username,
+        first_name=tg_user.first_name,
+        last_name=tg_user.last_name,
+    )
+    return await projects_service.get_active_project(user["id"])
+
+
+def _render_page(query: str, rows: List[Dict[str, Any]], first_page: bool) -> str:
+    if not rows:
+        return f"По запросу <b>{html.escape(query)}</b> ничего не нашёл." if first_page else "Больше ничего нет."
+
+    lines = [f"Траты по запросу <b>{html.escape(query)}</b>:"] if first_page else []
+    for row in rows:
+        created_at = row["created_at"]
+        day = created_at.strftime("%d.%m.%Y") if isinstance(created_at, datetime) else str(created_at)
+        lines.append(
+            f"• {day} — {html.escape(row['category_name'].capitalize())}: "
+            f"<b>{row['amount'].format()} {row['currency_original']}</b>\n"
+            f"  <i>{html.escape(row['description'] or '')}</i>"
+        )
+    return "\n".join(lines)
+
+
+def _more_keyboard(next_before_id: Optional[int]) -> Optional[InlineKeyboardMarkup]:
+    if next_before_id is None:
+        return None
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text="Ещё", callback_data=f"find:{next_before_id}")]]
+    )
+
+
+# /find <текст> — поиск по описаниям трат текущего проекта
+@router.message(Command("find"))
+async def cmd_find(message: types.Message, command: CommandObject, state: FSMContext):
+    query = (command.args or "").strip()
+    if len(query) < MIN_QUERY_LENGTH:
+        await message.answer(
+            f"Напиши, что искать (от {MIN_QUERY_LENGTH} символов), например: <code>/find такси</code>."
+        )
+        return
+
+    project = await _get_project(message.from_user)
+    if not project:
+        await message.answer(
+            "У тебя нет активного проекта.\n"
+            "Создай проект через /newproject."
+        )
+        return
+
+    rows, next_before_id = await expenses_service.search_expenses(project["id"], query)
+    # Запрос нужен кнопке «Ещё»: в callback_data (64 байта) он может не поместиться
+    await state.update_data(find_query=query, find_project_id=project["id"])
+    await message.answer(_render_page(query, rows, first_page=True), reply_markup=_more_keyboard(next_before_id))
+
+
+@router.callback_query(F.data.startswith("find:"))
+async def cb_find_more(callback: types.CallbackQuery, state: FSMContext):
+    try:
+        before_id = int(callback.data.split(":", 1)[1])
+    except (ValueError, IndexError):
+        await callback.answer("Некорректная страница.", show_alert=True)
+        return
+
+    data = await state.get_data()
+    query = data.get("find_query")
+    project = await _get_project(callback.from_user)
+    if not query or not project or project["id"] != data.get("find_project_id"):
+        await callback.answer("Поиск устарел, повтори /find.", show_alert=True)
+        return
+
+    rows, next_before_id = await expenses_service.search_expenses(project["id"], query, before_id=before_id)
+    await callback.answer()
+    # Кнопку «Ещё» у предыдущей страницы убираем, новая страница — отдельным сообщением
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.message.answer(
+        _render_page(query, rows, first_page=False),
+        reply_markup=_more_keyboard(next_before_id),
+    )
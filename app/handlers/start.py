@@ -1,7 +1,9 @@
-from aiogram import Router, types
-from aiogram.filters import CommandStart
+from aiogram import Router, types, F
+from aiogram.filters import CommandObject, CommandStart
 
 from app.keyboards.main_menu import main_menu_kb
+from app.services import users as users_service
+from app.services import projects as projects_service
 
 router = Router()
 
@@ -10,6 +12,29 @@ def register(dp):
     dp.include_router(router)
 
 
+# Переход по ссылке-приглашению из /invite: /start join_<код>
+@router.message(CommandStart(deep_link=True, magic=F.args.startswith("join_")))
+async def cmd_start_join(message: types.Message, command: CommandObject):
+    tg_user = message.from_user
+    user = await users_service.get_or_create_user_by_telegram_id(
+        telegram_id=tg_user.id,
+        username=tg_user.username,
+        first_name=tg_user.first_name,
+        last_name=tg_user.last_name,
+    )
+
+    project = await projects_service.join_project(user["id"], command.args[len("join_"):])
+    if not project:
+        await message.answer("Приглашение недействительно: проект удалён или ссылка неверная.")
+        return
+
+    await message.answer(
+        f"Ты в проекте <b>«{project['name']}»</b>, он теперь активный ✅\n"
+        f"Присылай траты как обычно — остальные участники увидят их в сводке.",
+        reply_markup=main_menu_kb(),
+    )
+
+
 @router.message(CommandStart())
 async def cmd_start(message: types.Message):
     text = (
@@ -22,6 +47,14 @@ async def cmd_start(message: types.Message):
         "Также доступны команды:\n"
         "/newproject — создать проект\n"
         "/projects — список проектов и выбор активного\n"
-        "/report — отчёт по текущему проекту"
+        "/report — отчёт по текущему проекту\n"
+        "/report week (day, month, 01.05-31.05) — расходы по дням/неделям/месяцам за период\n"
+        "/report usd (now) — отчёт в другой валюте (по текущему курсу)\n"
+        "/invite — пригласить друзей в текущий проект (общий бюджет поездки)\n"
+        "/find такси — найти траты по описанию\n"
+        "/budget — лимиты проекта и категорий с предупреждениями на 80% и 100%\n"
+        "/export — выгрузить траты текущего проекта в CSV (или <code>/export xlsx</code>)\n"
+        "@имя_бота в любом чате — быстро глянуть итоги активного проекта\n\n"
+        "А ещё можно прислать CSV-выписку из банка — импортирую все расходы из неё в текущий проект."
     )
     await message.answer(text, reply_markup=main_menu_kb())
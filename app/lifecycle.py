@@ -0,0 +1,133 @@
+"""
+Жизненный цикл процесса: учёт апдейтов в обработке, health-check и
+аккуратная остановка (дождаться хендлеров, дослать очередь, сохранить FSM).
+"""
+import asyncio
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage, MemoryStorageRecord
+from aiogram.types import TelegramObject
+
+from .config import settings
+
+_ready = False
+
+
+def set_ready(value: bool) -> None:
+    global _ready
+    _ready = value
+
+
+def is_ready() -> bool:
+    return _ready
+
+
+class InFlightTracker:
+    """
+    Outer-middleware, считающее апдейты в обработке. При остановке ждём,
+    пока счётчик не упадёт до нуля, чтобы не оборвать хендлер между
+    записью траты и ответом пользователю.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.count += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.count -= 1
+            if self.count == 0:
+                self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """True — все хендлеры завершились, False — вышли по таймауту."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+in_flight = InFlightTracker()
+
+
+# --- Снимок FSM ---------------------------------------------------------------
+#
+# MemoryStorage теряет состояние при рестарте (например, посреди создания
+# проекта). При остановке сохраняем его в JSON, при старте — поднимаем.
+
+
+def save_fsm_snapshot(storage: MemoryStorage, path: str) -> int:
+    records = [
+        {
+            "key": [key.bot_id, key.chat_id, key.user_id, key.thread_id, key.destiny],
+            "state": record.state,
+            "data": record.data,
+        }
+        for key, record in storage.storage.items()
+        if record.state is not None or record.data
+    ]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def load_fsm_snapshot(storage: MemoryStorage, path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+
+    with open(path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    for item in records:
+        bot_id, chat_id, user_id, thread_id, destiny = item["key"]
+        key = StorageKey(bot_id=bot_id, chat_id=chat_id, user_id=user_id, thread_id=thread_id, destiny=destiny)
+        storage.storage[key] = MemoryStorageRecord(data=item["data"], state=item["state"])
+    os.remove(path)
+    return len(records)
+
+
+# --- Health-check -------------------------------------------------------------
+
+
+async def start_health_server() -> Optional[Any]:
+    """
+    /healthz — процесс жив (liveness), /readyz — прогрет и принимает апдейты
+    (readiness; во время остановки отдаёт 503). HEALTH_PORT=0 — выключено.
+    """
+    if not settings.health_port:
+        return None
+
+    from aiohttp import web
+
+    async def healthz(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "in_flight": in_flight.count})
+
+    async def readyz(request: web.Request) -> web.Response:
+        status = 200 if _ready else 503
+        return web.json_response({"ready": _ready, "in_flight": in_flight.count}, status=status)
+
+    app = web.Application()
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.health_host, settings.health_port)
+    await site.start()
+    print(f"[lifecycle] health endpoint on {settings.health_host}:{settings.health_port}")
+    return runner
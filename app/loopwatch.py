@@ -0,0 +1,92 @@
+"""
+Детектор блокировок event loop (для отладки и canary-запусков).
+
+Корутина-«пульс» на самом loop раз в interval обновляет отметку времени, а
+отдельный поток-сторож проверяет, как давно она обновлялась. Если пульса нет
+дольше порога, значит loop занят синхронным кодом: сторож снимает стек
+потока loop'а через sys._current_frames(), находит в нём хендлер из
+app.handlers и пишет всё это в лог. Когда loop освобождается, в лог уходит
+полная длительность блокировки.
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+from typing import Optional
+
+HANDLERS_PACKAGE = "app.handlers."
+
+# Сколько последних кадров стека печатать
+STACK_LIMIT = 15
+
+
+def _find_handler(frame: Optional[FrameType]) -> Optional[str]:
+    """Ближайший к вершине стека кадр из app.handlers — это и есть виновный хендлер."""
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith(HANDLERS_PACKAGE):
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float, interval: Optional[float] = None):
+        self.threshold = threshold
+        self.interval = interval if interval is not None else min(threshold / 4, 0.1)
+        self.stalls = 0
+
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    async def _pulse(self) -> None:
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _report(self, lag: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        handler = _find_handler(frame) or "unknown"
+        stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame else ""
+        print(f"[loopwatch] event loop blocked for {lag * 1000:.0f}ms in {handler}:\n{stack}", end="")
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            lag = time.monotonic() - beat - self.interval
+
+            if lag > self.threshold and beat != reported_beat:
+                reported_beat = beat
+                self.stalls += 1
+                self._report(lag)
+            elif reported_beat is not None and beat != reported_beat:
+                # Пульс возобновился — loop разблокирован
+                print(f"[loopwatch] event loop unblocked after {(beat - reported_beat) * 1000:.0f}ms")
+                reported_beat = None
+
+    def start(self) -> None:
+        """Вызывать из работающего loop'а."""
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._heartbeat = asyncio.create_task(self._pulse(), name="loopwatch-pulse")
+        self._thread = threading.Thread(target=self._watch, name="loopwatch", daemon=True)
+        self._thread.start()
+        print(f"[loopwatch] watching event loop, threshold {self.threshold * 1000:.0f}ms")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+        if self.stalls:
+            print(f"[loopwatch] {self.stalls} event loop stalls detected")
@@ -1,19 +1,202 @@
 import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict
 
-from .bot import bot, dp
-from .handlers import start, projects, expenses, reports
+from aiogram import Bot
+from aiogram.types import TelegramObject
+
+from . import lifecycle
+from .bot import create_bot, dp
+from .config import settings
 
 
 def register_handlers():
+    # Хендлеры импортируем здесь, а не на уровне модуля: import app.main
+    # остаётся лёгким (нужно для бенчмарка старта и утилит).
+    from .handlers import start, projects, expenses, budgets, search, admin, reports, imports, inline
+
     start.register(dp)
     projects.register(dp)
     expenses.register(dp)
+    budgets.register(dp)
+    # До reports: там последним стоит хендлер на любой текст
+    search.register(dp)
+    admin.register(dp)
     reports.register(dp)
+    imports.register(dp)
+    inline.register(dp)
+
+
+class FirstUpdateTimer:
+    """
+    Outer-middleware: один раз пишет в лог, через сколько секунд после
+    старта процесса пришёл первый апдейт (time-to-first-update).
+    """
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.done = False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.done:
+            self.done = True
+            print(f"[main] first update after {time.perf_counter() - self.started_at:.3f}s")
+        return await handler(event, data)
+
+
+async def warm_up() -> None:
+    """
+    Прогрев перед приёмом апдейтов: открыть пул соединений, поднять курсы из
+    exchange_rates и загрузить пользователей/активные проекты недавно
+    активных чатов. Ошибки прогрева не фатальны — просто будет холодный старт.
+    """
+    from .services import categorizer, currency, db, projects, users
+
+    t0 = time.perf_counter()
+    try:
+        await db.warm_up_pool()
+        t1 = time.perf_counter()
+        print(f"[warmup] opened {settings.db_pool_size} db connections in {t1 - t0:.3f}s")
+
+        rates = await currency.preload_rates()
+        t2 = time.perf_counter()
+        print(f"[warmup] preloaded {rates} exchange rates in {t2 - t1:.3f}s")
+
+        recent = await users.prefetch_recent_users(settings.warmup_recent_days)
+        active = await projects.prefetch_active_projects([u["id"] for u in recent])
+        t3 = time.perf_counter()
+        print(f"[warmup] cached {len(recent)} users and {active} active projects in {t3 - t2:.3f}s")
+
+        models = await asyncio.to_thread(categorizer.load)
+        print(f"[warmup] loaded {models} category models in {time.perf_counter() - t3:.3f}s")
+    except Exception as e:
+        print(f"[warmup] failed after {time.perf_counter() - t0:.3f}s: {e}")
+
+
+async def on_startup() -> Bot:
+    """Создание движка БД и бота — явно при старте, а не при импорте модулей."""
+    from .services import db
+
+    db.init_engine()
+    return create_bot()
+
+
+async def on_shutdown(bot: Bot) -> None:
+    """
+    Вызывается aiogram после остановки поллинга (SIGTERM/SIGINT), но до
+    закрытия сессии бота: новых апдейтов уже нет, а ответить ещё можно.
+    """
+    from .services import categorizer, db, fanout, tracing, writebehind
+    from .services.sender import get_sender
+
+    lifecycle.set_ready(False)
+    deadline = time.perf_counter() + settings.shutdown_timeout
+
+    if lifecycle.in_flight.count:
+        print(f"[main] waiting for {lifecycle.in_flight.count} in-flight updates")
+    if not await lifecycle.in_flight.wait_idle(settings.shutdown_timeout):
+        print(f"[main] {lifecycle.in_flight.count} updates still running after {settings.shutdown_timeout:.0f}s")
+
+    # Дайджест, сжатие и обновление статистики ходят в БД: останавливаем их
+    # до закрытия движка, иначе get_engine() молча создаст новый и он утечёт
+    tasks = [task for task in dp.get("background_tasks", ()) if task is not None]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.wait(tasks, timeout=max(deadline - time.perf_counter(), 0))
+
+    # Дописываем журнал отложенных трат до отправки очереди: там могут быть предупреждения о лимитах
+    await writebehind.shutdown(max(deadline - time.perf_counter(), 0))
+    fanout.shutdown()
+
+    sender = get_sender(bot)
+    if sender.pending and not await sender.flush(max(deadline - time.perf_counter(), 0)):
+        print(f"[main] dropped {sender.pending} queued outbound messages")
+    await sender.close()
+
+    if settings.fsm_snapshot_path:
+        saved = lifecycle.save_fsm_snapshot(dp.storage, settings.fsm_snapshot_path)
+        print(f"[main] saved {saved} FSM records")
+
+    await tracing.shutdown()
+
+    saved = await asyncio.to_thread(categorizer.save)
+    print(
+        f"[main] saved {saved} category models "
+        f"(predicted={categorizer.stats['predicted']} kept={categorizer.stats['kept']})"
+    )
+
+    recorder = dp.get("update_recorder")
+    if recorder is not None:
+        await recorder.flush()
+        print(f"[main] recorded {recorder.recorded} updates to {recorder.path}")
+
+    stats = db.get_statement_stats()
+    for name, st in sorted(stats.items(), key=lambda kv: kv[1]["total_ms"], reverse=True):
+        if st["calls"]:
+            print(
+                f"[db] {name}: calls={st['calls']} errors={st['errors']} "
+                f"avg={st['avg_ms']:.1f}ms max={st['max_ms']:.1f}ms"
+            )
+
+    await asyncio.to_thread(db.dispose_engine)
+    print("[main] shutdown complete")
 
 
 async def main():
+    started_at = time.perf_counter()
+
     register_handlers()
-    await dp.start_polling(bot)
+    dp.update.outer_middleware(FirstUpdateTimer(started_at))
+    dp.update.outer_middleware(lifecycle.in_flight)
+    if settings.record_updates_path:
+        from .recorder import UpdateRecorder
+
+        recorder = UpdateRecorder(settings.record_updates_path, settings.record_salt)
+        dp.update.outer_middleware(recorder)
+        dp["update_recorder"] = recorder
+    dp.shutdown.register(on_shutdown)
+
+    if settings.fsm_snapshot_path:
+        restored = lifecycle.load_fsm_snapshot(dp.storage, settings.fsm_snapshot_path)
+        if restored:
+            print(f"[main] restored {restored} FSM records")
+
+    health = await lifecycle.start_health_server()
+    bot = await on_startup()
+
+    from .services import tracing
+
+    tracing.setup(dp, bot)
+    await warm_up()
+    lifecycle.set_ready(True)
+    print(f"[main] startup took {time.perf_counter() - started_at:.3f}s")
+
+    from .services import charts, compaction, digest, stats, writebehind
+
+    watchdog = None
+    if settings.loop_block_ms:
+        from .loopwatch import LoopWatchdog
+
+        watchdog = LoopWatchdog(settings.loop_block_ms / 1000)
+        watchdog.start()
+
+    writebehind.start(bot)
+    # Останавливаются в on_shutdown, до закрытия движка БД
+    dp["background_tasks"] = [digest.start(bot), compaction.start(), stats.start()]
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if watchdog:
+            watchdog.stop()
+        charts.shutdown()
+        if health:
+            await health.cleanup()
 
 
 if __name__ == "__main__":
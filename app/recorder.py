@@ -0,0 +1,103 @@
+"""
+Запись входящих апдейтов для нагрузочных прогонов (scripts/replay_updates.py).
+
+Outer-middleware складывает каждый апдейт с временем получения в журнал —
+gzip-файл с JSON по строке на апдейт. Перед записью апдейт обезличивается:
+id пользователей и чатов заменяются стабильными псевдонимами (HMAC с солью
+из RECORD_SALT), имена, username, контакты и геопозиция вырезаются. Текст
+сообщений остаётся как есть — именно он определяет, пойдёт трата в простой
+парсер или в GPT, поэтому без него прогон не похож на прод.
+"""
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram.types import TelegramObject, Update
+
+# Поля, которые вырезаем целиком
+DROP_KEYS = {"last_name", "username", "phone_number", "contact", "location", "venue", "bio", "photo"}
+
+# Сколько записей копить в памяти перед сбросом на диск
+FLUSH_EVERY = 100
+FLUSH_INTERVAL = 5.0
+
+
+def _pseudonym(value: int, salt: bytes) -> int:
+    digest = hmac.new(salt, str(abs(value)).encode(), hashlib.sha256).digest()
+    # 48 бит хватает, чтобы не было коллизий, и влезает в bigint/JS number
+    alias = int.from_bytes(digest[:6], "big") or 1
+    return -alias if value < 0 else alias
+
+
+def anonymize(data: Any, salt: bytes) -> Any:
+    """Рекурсивно обезличивает словарь апдейта (результат model_dump)."""
+    if isinstance(data, list):
+        return [anonymize(item, salt) for item in data]
+    if not isinstance(data, dict):
+        return data
+
+    # User и Chat узнаём по характерным полям
+    is_user = "is_bot" in data
+    is_chat = "type" in data and "id" in data and isinstance(data["id"], int)
+
+    out: Dict[str, Any] = {}
+    for key, value in data.items():
+        if key in DROP_KEYS:
+            continue
+        if key == "id" and (is_user or is_chat):
+            out[key] = _pseudonym(value, salt)
+        elif key in ("first_name", "title") and (is_user or is_chat):
+            out[key] = "user" if key == "first_name" else "chat"
+        elif key == "chat_instance":
+            out[key] = hmac.new(salt, value.encode(), hashlib.sha256).hexdigest()[:16]
+        else:
+            out[key] = anonymize(value, salt)
+    return out
+
+
+class UpdateRecorder:
+    """Outer-middleware на dp.update: журналирует апдейты до их обработки."""
+
+    def __init__(self, path: str, salt: str = ""):
+        self.path = path
+        # Без соли псевдонимы перебором сопоставляются с реальными id, поэтому
+        # по умолчанию берём случайную (псевдонимы стабильны в пределах процесса)
+        self.salt = salt.encode() if salt else os.urandom(16)
+        self.recorded = 0
+        self._buffer: List[str] = []
+        self._flushed_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Update):
+            raw = anonymize(event.model_dump(mode="json", exclude_none=True, by_alias=True), self.salt)
+            self._buffer.append(json.dumps({"ts": time.time(), "update": raw}, ensure_ascii=False))
+            self.recorded += 1
+            due = len(self._buffer) >= FLUSH_EVERY or time.monotonic() - self._flushed_at >= FLUSH_INTERVAL
+            if due and (self._flush_task is None or self._flush_task.done()):
+                self._flush_task = asyncio.create_task(self.flush())
+        return await handler(event, data)
+
+    def _write(self, lines: List[str]) -> None:
+        # Каждый сброс — отдельный gzip-member; gzip.open читает их подряд как один поток
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+            f.write("\n")
+
+    async def flush(self) -> None:
+        async with self._lock:
+            lines, self._buffer = self._buffer, []
+            self._flushed_at = time.monotonic()
+            if lines:
+                await asyncio.to_thread(self._write, lines)
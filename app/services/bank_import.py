@@ -0,0 +1,328 @@
+"""
+Импорт банковских выписок (CSV) в траты проекта.
+
+Файл читается построчно, каждая подходящая строка сразу пишется в
+промежуточный CSV (в памяти, а при большом объёме — на диске), который затем
+целиком загружается в временную таблицу через COPY. Категории создаются и
+траты вставляются одним set-based запросом, курсы валют подставляются пачкой.
+"""
+import asyncio
+import csv
+import re
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, IO, Iterator, List, Optional, Set
+
+from sqlalchemy.engine import Connection
+
+from . import currency_index
+from .currency import ensure_rates, get_rates_to_rub
+from .db import execute_on, run_in_transaction, statement
+from .money import Money, exponent, to_minor
+from .parsing import detect_category
+
+# Синонимы заголовков колонок в выгрузках популярных банков (Т-Банк, Сбер, Альфа и т.п.)
+COLUMN_SYNONYMS = {
+    "date": ("дата операции", "дата", "дата транзакции", "date", "transaction date"),
+    "amount": ("сумма операции", "сумма", "сумма в валюте операции", "amount"),
+    "debit": ("расход", "списание", "сумма списания", "debit"),
+    "currency": ("валюта операции", "валюта", "currency"),
+    "description": ("описание", "назначение платежа", "описание операции", "description", "details"),
+    "status": ("статус", "status"),
+}
+
+# Статусы, с которыми строку не импортируем (отклонённые/отменённые операции)
+SKIP_STATUSES = {"failed", "declined", "отклонена", "отменена"}
+
+DATE_FORMATS = (
+    "%d.%m.%Y %H:%M:%S",
+    "%d.%m.%Y %H:%M",
+    "%d.%m.%Y",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d",
+)
+
+# Сколько держать промежуточный CSV в памяти, прежде чем сбросить на диск
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
+
+CREATE_IMPORT_STAGING = statement(
+    "import.create_staging",
+    '''
+    CREATE TEMP TABLE import_staging (
+        created_at            timestamptz,
+        category              text NOT NULL,
+        amount_original_minor bigint NOT NULL,
+        currency_original     varchar(3) NOT NULL,
+        description           text
+    ) ON COMMIT DROP
+    ''',
+)
+
+INSERT_IMPORT_CATEGORIES = statement(
+    "import.insert_categories",
+    '''
+    INSERT INTO categories (user_id, name, slug, is_system)
+    SELECT DISTINCT p.user_id, s.category, s.category, FALSE
+    FROM import_staging s
+    JOIN projects p ON p.id = :project_id
+    ON CONFLICT (user_id, name) DO NOTHING
+    ''',
+)
+
+INSERT_IMPORT_EXPENSES = statement(
+    "import.insert_expenses",
+    '''
+    WITH inserted AS (
+        INSERT INTO expenses
+        (user_id, project_id, category_id, amount_original_minor, currency_original, amount_rub_minor, description,
+         created_at, parse_source)
+        SELECT :user_id,
+               :project_id,
+               c.id,
+               s.amount_original_minor,
+               s.currency_original,
+               ROUND(s.amount_original_minor * r.factor)::bigint,
+               s.description,
+               COALESCE(s.created_at, now()),
+               'import'
+        FROM import_staging s
+        JOIN unnest(CAST(:codes AS text[]), CAST(:factors AS numeric[])) AS r(code, factor)
+          ON r.code = s.currency_original
+        -- Категории проекта — категории его владельца (в общем проекте импортирует и участник)
+        LEFT JOIN categories c
+          ON c.user_id = (SELECT user_id FROM projects WHERE id = :project_id) AND c.name = s.category
+        RETURNING category_id, amount_rub_minor
+    ),
+    spend AS (
+        SELECT COALESCE(category_id, 0) AS category_id, SUM(amount_rub_minor) AS total
+        FROM inserted
+        GROUP BY 1
+    ),
+    bumped AS (
+        -- Бегущие суммы лимитов (см. budgets.py): проект целиком + каждая категория
+        UPDATE budget_limits b
+        SET spent_rub_minor = b.spent_rub_minor + x.total
+        FROM (
+            SELECT category_id, total FROM spend WHERE category_id <> 0
+            UNION ALL
+            SELECT 0, SUM(total) FROM spend
+        ) x
+        WHERE b.project_id = :project_id AND b.category_id = x.category_id
+        RETURNING b.id
+    )
+    SELECT COUNT(*) AS imported, COALESCE(SUM(amount_rub_minor), 0)::bigint AS total_rub_minor
+    FROM inserted
+    ''',
+)
+
+
+@dataclass
+class ImportResult:
+    imported: int = 0
+    skipped: int = 0
+    total_rub: Money = Money.zero("RUB")
+    currencies: Set[str] = field(default_factory=set)
+
+
+class StatementFormatError(ValueError):
+    """Файл не похож на выписку: не нашли колонки с суммой."""
+
+
+def _detect_encoding(path: str) -> str:
+    with open(path, "rb") as f:
+        head = f.read(64 * 1024)
+    try:
+        head.decode("utf-8")
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        # Кусок мог оборваться посреди символа — тогда это всё равно utf-8
+        try:
+            head[:-3].decode("utf-8")
+            return "utf-8-sig"
+        except UnicodeDecodeError:
+            return "cp1251"
+
+
+def _map_columns(header: List[str]) -> Dict[str, int]:
+    normalized = [h.strip().strip('"').lower() for h in header]
+    mapping: Dict[str, int] = {}
+    for key, variants in COLUMN_SYNONYMS.items():
+        for variant in variants:
+            if variant in normalized:
+                mapping[key] = normalized.index(variant)
+                break
+    return mapping
+
+
+def _parse_amount(raw: str) -> Optional[Decimal]:
+    s = re.sub(r"[\s ]", "", raw or "").replace("−", "-").replace(",", ".")
+    if not s:
+        return None
+    try:
+        value = Decimal(s)
+    except InvalidOperation:
+        return None
+    # «NaN»/«Infinity» в ячейке — тоже не сумма
+    return value if value.is_finite() else None
+
+
+def _parse_date(raw: str) -> Optional[datetime]:
+    s = (raw or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _normalize_currency(raw: str, default: str) -> Optional[str]:
+    """
+    Код валюты строки выписки; None — валюта без курса (такую строку
+    пропускаем, а не пересчитываем 1:1).
+    """
+    if not (raw or "").strip():
+        return default
+    return currency_index.resolve(raw)
+
+
+class _SemicolonDialect(csv.excel):
+    delimiter = ";"
+
+
+def _iter_rows(path: str) -> Iterator[List[str]]:
+    encoding = _detect_encoding(path)
+    with open(path, "r", encoding=encoding, newline="") as f:
+        sample = f.read(8192)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
+        except csv.Error:
+            dialect = _SemicolonDialect
+        yield from csv.reader(f, dialect)
+
+
+def _cell(row: List[str], cols: Dict[str, int], key: str) -> str:
+    idx = cols.get(key)
+    if idx is None or idx >= len(row):
+        return ""
+    return row[idx]
+
+
+def _stage_statement(path: str, default_currency: str, out: IO[str], result: ImportResult) -> None:
+    """
+    Потоково разбирает выписку и пишет подходящие строки в out в формате
+    для COPY. Берём только расходы: отрицательные суммы (доходы пропускаем)
+    или любые суммы из колонки «Расход/Списание».
+    """
+    rows = _iter_rows(path)
+    header = next(rows, None)
+    if header is None:
+        raise StatementFormatError("empty file")
+
+    cols = _map_columns(header)
+    amount_col = cols.get("debit", cols.get("amount"))
+    if amount_col is None:
+        raise StatementFormatError("amount column not found")
+    is_debit_col = "debit" in cols
+
+    writer = csv.writer(out)
+    for row in rows:
+        if len(row) <= amount_col:
+            result.skipped += 1
+            continue
+
+        if _cell(row, cols, "status").strip().lower() in SKIP_STATUSES:
+            result.skipped += 1
+            continue
+
+        amount = _parse_amount(row[amount_col])
+        if amount is None or amount == 0:
+            result.skipped += 1
+            continue
+        if not is_debit_col and amount > 0:
+            result.skipped += 1
+            continue
+        amount = abs(amount)
+
+        currency = _normalize_currency(_cell(row, cols, "currency"), default_currency)
+        if currency is None:
+            result.skipped += 1
+            continue
+
+        try:
+            amount_minor = to_minor(amount, currency)
+        except InvalidOperation:
+            result.skipped += 1
+            continue
+
+        description = _cell(row, cols, "description").strip()
+        created_at = _parse_date(_cell(row, cols, "date"))
+
+        writer.writerow([
+            created_at.isoformat(sep=" ") if created_at else "",
+            detect_category(description),
+            amount_minor,
+            currency,
+            description,
+        ])
+        result.currencies.add(currency)
+        result.imported += 1
+
+
+async def import_statement(
+    path: str,
+    user_id: int,
+    project_id: int,
+    default_currency: str,
+) -> ImportResult:
+    """
+    Импортирует выписку из CSV-файла в проект.
+    Всё, включая создание категорий, выполняется в одной транзакции.
+    """
+    result = ImportResult()
+    # Индекс валют строится по таблице курсов — она должна быть загружена до разбора
+    await ensure_rates()
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+", newline="", encoding="utf-8") as staged:
+        await asyncio.to_thread(_stage_statement, path, default_currency, staged, result)
+        if result.imported == 0:
+            return result
+
+        rates = await get_rates_to_rub(result.currencies)
+        codes = sorted(rates)
+        # Копеек за одну минорную единицу валюты: курс со сдвигом на разницу экспонент
+        factors = [Decimal(str(rates[c])).scaleb(exponent("RUB") - exponent(c)) for c in codes]
+
+        def _load(conn: Connection) -> Dict[str, object]:
+            execute_on(conn, CREATE_IMPORT_STAGING)
+            staged.seek(0)
+            cursor = conn.connection.cursor()
+            try:
+                cursor.copy_expert(
+                    "COPY import_staging (created_at, category, amount_original_minor, currency_original, description) "
+                    "FROM STDIN WITH (FORMAT csv, NULL '')",
+                    staged,
+                )
+            finally:
+                cursor.close()
+            execute_on(conn, INSERT_IMPORT_CATEGORIES, {"project_id": project_id})
+            summary = execute_on(
+                conn,
+                INSERT_IMPORT_EXPENSES,
+                {
+                    "user_id": user_id,
+                    "project_id": project_id,
+                    "codes": codes,
+                    "factors": factors,
+                },
+            ).mappings().first()
+            return dict(summary)
+
+        summary = await run_in_transaction(_load)
+
+    result.imported = int(summary["imported"])
+    result.total_rub = Money(int(summary["total_rub_minor"]), "RUB")
+    return result
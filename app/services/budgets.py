@@ -0,0 +1,217 @@
+from typing import Optional, Dict, Any, List
+
+from .db import fetch_all, fetch_all_returning, fetch_one_returning, execute, statement
+from .money import Money
+
+# Пороги, при пересечении которых один раз шлём предупреждение
+BUDGET_ALERT_THRESHOLDS = (80, 100)
+
+# category_id = 0 — лимит на весь проект
+PROJECT_WIDE = 0
+
+UPSERT_BUDGET = statement(
+    "budgets.upsert",
+    '''
+    INSERT INTO budget_limits (project_id, category_id, limit_rub_minor, spent_rub_minor, alerted_pct)
+    SELECT :project_id,
+           :category_id,
+           :limit_rub_minor,
+           s.spent,
+           CASE
+               WHEN s.spent >= :limit_rub_minor THEN 100
+               WHEN s.spent * 10 >= :limit_rub_minor * 8 THEN 80
+               ELSE 0
+           END
+    FROM (
+        SELECT COALESCE(SUM(spent), 0)::bigint AS spent
+        FROM (
+            SELECT amount_rub_minor AS spent
+            FROM expenses
+            WHERE project_id = :project_id
+              AND (:category_id = 0 OR category_id = :category_id)
+            UNION ALL
+            -- Сжатые старые траты (см. compaction.py)
+            SELECT total_rub_minor
+            FROM expense_monthly_summary
+            WHERE project_id = :project_id
+              AND (:category_id = 0 OR category_id = :category_id)
+        ) t
+    ) s
+    ON CONFLICT (project_id, category_id) DO UPDATE
+    SET limit_rub_minor = EXCLUDED.limit_rub_minor,
+        spent_rub_minor = EXCLUDED.spent_rub_minor,
+        alerted_pct = EXCLUDED.alerted_pct
+    RETURNING *
+    ''',
+)
+
+DELETE_BUDGET = statement(
+    "budgets.delete",
+    '''
+    DELETE FROM budget_limits
+    WHERE project_id = :project_id AND category_id = :category_id
+    ''',
+)
+
+LIST_BUDGETS = statement(
+    "budgets.list",
+    '''
+    SELECT b.*, c.name AS category_name
+    FROM budget_limits b
+    LEFT JOIN categories c ON c.id = b.category_id
+    WHERE b.project_id = :project_id
+    ORDER BY b.category_id
+    ''',
+)
+
+# Инкремент бегущих сумм: затрагивает максимум две строки (лимит проекта и
+# лимит категории) по уникальному индексу, без пересчёта агрегатов.
+BUMP_BUDGET_SPENT = statement(
+    "budgets.bump_spent",
+    '''
+    WITH bumped AS (
+        UPDATE budget_limits
+        SET spent_rub_minor = spent_rub_minor + :amount_rub_minor
+        WHERE project_id = :project_id
+          AND category_id IN (0, :category_id)
+        RETURNING id, category_id, limit_rub_minor, spent_rub_minor, alerted_pct
+    )
+    SELECT b.*, b.spent_rub_minor - :amount_rub_minor AS spent_before_minor, c.name AS category_name
+    FROM bumped b
+    LEFT JOIN categories c ON c.id = b.category_id
+    ''',
+)
+
+CLAIM_BUDGET_ALERT = statement(
+    "budgets.claim_alert",
+    '''
+    UPDATE budget_limits
+    SET alerted_pct = :pct
+    WHERE id = :id AND alerted_pct < :pct
+    RETURNING id
+    ''',
+)
+
+# Для пакетных путей записи (импорт): выставляет каждому лимиту максимальный
+# пройденный порог и возвращает только те, что поменялись.
+CLAIM_PENDING_ALERTS = statement(
+    "budgets.claim_pending_alerts",
+    '''
+    WITH pending AS (
+        SELECT id,
+               CASE
+                   WHEN spent_rub_minor >= limit_rub_minor THEN 100
+                   WHEN spent_rub_minor * 10 >= limit_rub_minor * 8 THEN 80
+                   ELSE 0
+               END AS pct
+        FROM budget_limits
+        WHERE project_id = :project_id
+    ),
+    claimed AS (
+        UPDATE budget_limits b
+        SET alerted_pct = p.pct
+        FROM pending p
+        WHERE b.id = p.id AND p.pct > b.alerted_pct
+        RETURNING b.id, b.category_id, b.limit_rub_minor, b.spent_rub_minor, b.alerted_pct
+    )
+    SELECT cl.*, c.name AS category_name
+    FROM claimed cl
+    LEFT JOIN categories c ON c.id = cl.category_id
+    ''',
+)
+
+
+async def set_budget(project_id: int, category_id: Optional[int], limit_rub: Money) -> Dict[str, Any]:
+    """
+    Установить (или поменять) лимит. Текущие траты считаются один раз здесь,
+    дальше spent_rub_minor поддерживается инкрементально в record_spend().
+    """
+    return await fetch_one_returning(
+        UPSERT_BUDGET,
+        {
+            "project_id": project_id,
+            "category_id": category_id or PROJECT_WIDE,
+            "limit_rub_minor": limit_rub.minor,
+        },
+    )
+
+
+async def delete_budget(project_id: int, category_id: Optional[int]) -> None:
+    await execute(
+        DELETE_BUDGET,
+        {"project_id": project_id, "category_id": category_id or PROJECT_WIDE},
+    )
+
+
+async def get_budgets(project_id: int) -> List[Dict[str, Any]]:
+    return await fetch_all(LIST_BUDGETS, {"project_id": project_id}, primary=True)
+
+
+def _alert(row: Dict[str, Any], pct: int) -> Dict[str, Any]:
+    return {
+        "category_id": row["category_id"],
+        "category_name": row.get("category_name"),
+        "limit_rub": Money(int(row["limit_rub_minor"]), "RUB"),
+        "spent_rub": Money(int(row["spent_rub_minor"]), "RUB"),
+        "pct": pct,
+    }
+
+
+async def record_spend(project_id: int, category_id: Optional[int], amount_rub: Money) -> List[Dict[str, Any]]:
+    """
+    Учесть новую трату в лимитах проекта и вернуть предупреждения о только
+    что пройденных порогах. Сравниваем сумму до и после вставки; каждое
+    предупреждение «забираем» условным UPDATE, так что оно приходит один раз.
+    """
+    rows = await fetch_all_returning(
+        BUMP_BUDGET_SPENT,
+        {
+            "project_id": project_id,
+            "category_id": category_id or PROJECT_WIDE,
+            "amount_rub_minor": amount_rub.minor,
+        },
+    )
+
+    alerts: List[Dict[str, Any]] = []
+    for row in rows:
+        limit = int(row["limit_rub_minor"])
+        before = int(row["spent_before_minor"])
+        after = int(row["spent_rub_minor"])
+
+        # Сравнение в целых копейках: порог pct% пройден, если before < limit·pct/100 <= after
+        crossed = [
+            pct for pct in BUDGET_ALERT_THRESHOLDS
+            if before * 100 < limit * pct <= after * 100 and pct > row["alerted_pct"]
+        ]
+        if not crossed:
+            continue
+
+        pct = max(crossed)
+        claimed = await fetch_one_returning(CLAIM_BUDGET_ALERT, {"id": row["id"], "pct": pct})
+        if claimed:
+            alerts.append(_alert(row, pct))
+
+    return alerts
+
+
+async def collect_pending_alerts(project_id: int) -> List[Dict[str, Any]]:
+    """
+    Предупреждения после пакетной записи (импорт выписки и т.п.), где
+    spent_rub_minor обновляется одним запросом без сравнения «до/после».
+    """
+    rows = await fetch_all_returning(CLAIM_PENDING_ALERTS, {"project_id": project_id})
+    return [_alert(row, row["alerted_pct"]) for row in rows]
+
+
+def format_alert(alert: Dict[str, Any], project_name: str) -> str:
+    spent = alert["spent_rub"].format()
+    limit = alert["limit_rub"].format()
+
+    if alert["category_id"]:
+        scope = f"категории <b>«{(alert['category_name'] or 'прочее').capitalize()}»</b>"
+    else:
+        scope = f"проекта <b>«{project_name}»</b>"
+
+    if alert["pct"] >= 100:
+        return f"🚨 Бюджет {scope} превышен: <b>{spent}</b> из {limit} RUB."
+    return f"⚠️ Потрачено {alert['pct']}% бюджета {scope}: <b>{spent}</b> из {limit} RUB."
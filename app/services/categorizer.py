@@ -0,0 +1,237 @@
+"""
+Категории трат по истории самого пользователя.
+
+Парсер берёт категорию из текста как есть («кофе старбакс 350» → «кофе
+старбакс»), и у пользователя плодятся почти одинаковые категории. Здесь по
+его же прошлым тратам (expenses.description → категория) учится наивный
+байесовский классификатор. Признаки — слова и символьные триграммы слов;
+триграммы прощают опечатки: «кофэ» близко к «кофе». Если текст уверенно
+похож на одну из уже существующих категорий, берём её.
+
+Модель — счётчики по crc32-хэшам признаков, так что предсказание — несколько
+десятков dict-lookup'ов. Дообучение инкрементальное: не чаще раза в
+REFRESH_INTERVAL секунд дочитываем траты пользователя с id больше последнего
+учтённого. Модели сохраняются в файл (CATEGORY_MODEL_PATH) при остановке и
+поднимаются при старте, так что после рестарта историю заново не читаем.
+"""
+import gzip
+import json
+import math
+import os
+import re
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.config import settings
+from . import currency_index
+from .db import fetch_all, statement
+
+# Как часто дочитывать новые траты пользователя
+REFRESH_INTERVAL = 600
+TRAINING_BATCH = 2000
+
+# Предсказываем, только если есть хоть какая-то история и триграммы текста
+# в основном уже встречались (иначе «такси» при истории из одной «еды»
+# уверенно станет едой по случайной триграмме)
+MIN_EXAMPLES = 5
+MIN_COVERAGE = 0.5
+MIN_CONFIDENCE = 0.8
+
+# Сглаживание Лапласа
+ALPHA = 0.5
+
+# Чтобы память не росла бесконечно: при переполнении просто очищаем
+MAX_MODELS = 20000
+
+# Категория «не знаю»: её не учим и всегда пробуем заменить предсказанием
+DEFAULT_CATEGORY = "прочее"
+
+TRAINING_ROWS = statement(
+    "categorizer.training_rows",
+    '''
+    SELECT e.id, e.description, c.name AS category_name
+    FROM expenses e
+    JOIN categories c ON c.id = e.category_id
+    WHERE e.user_id = :user_id
+      AND e.id > :after_id
+      AND e.description IS NOT NULL
+      AND c.name <> 'прочее'
+    ORDER BY e.id
+    LIMIT :limit
+    ''',
+    replica=True,
+)
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+def _trigrams(word: str) -> List[int]:
+    padded = f"<{word}>"
+    return [zlib.crc32(f"c:{padded[i:i + 3]}".encode()) for i in range(len(padded) - 2)]
+
+
+def _words(text: str) -> List[str]:
+    """Слова текста без чисел и названий валют."""
+    return [w for w in _WORD_RE.findall((text or "").lower()) if not currency_index.resolve(w)]
+
+
+def features(text: str) -> List[int]:
+    """Хэши слов и их символьных триграмм."""
+    result: List[int] = []
+    for word in _words(text):
+        result.append(zlib.crc32(f"w:{word}".encode()))
+        result.extend(_trigrams(word))
+    return result
+
+
+class CategoryModel:
+    __slots__ = ("last_id", "names", "docs", "feature_totals", "counts", "refreshed_at")
+
+    def __init__(self) -> None:
+        self.last_id = 0
+        # Все известные категории пользователя, в том числе ещё не выученные
+        self.names: Set[str] = set()
+        # категория -> число трат
+        self.docs: Dict[str, int] = {}
+        # категория -> сумма признаков её трат
+        self.feature_totals: Dict[str, int] = {}
+        # признак -> {категория: сколько раз}
+        self.counts: Dict[int, Dict[str, int]] = {}
+        self.refreshed_at = 0.0
+
+    def learn(self, text: str, category: str) -> None:
+        self.names.add(category)
+        feats = features(text)
+        if not feats:
+            return
+        self.docs[category] = self.docs.get(category, 0) + 1
+        self.feature_totals[category] = self.feature_totals.get(category, 0) + len(feats)
+        for f in feats:
+            per = self.counts.setdefault(f, {})
+            per[category] = per.get(category, 0) + 1
+
+    def predict(self, text: str) -> Optional[Tuple[str, float]]:
+        """(категория, апостериорная вероятность) или None, если данных мало."""
+        total_docs = sum(self.docs.values())
+        if total_docs < MIN_EXAMPLES:
+            return None
+        words = _words(text)
+        grams = [f for word in words for f in _trigrams(word)]
+        if not grams or sum(f in self.counts for f in grams) < len(grams) * MIN_COVERAGE:
+            return None
+
+        vocab = len(self.counts)
+        scores = {c: math.log(n / total_docs) for c, n in self.docs.items()}
+        for f in features(text):
+            per = self.counts.get(f)
+            # Незнакомый признак одинаково мало говорит о любой категории
+            if per is None:
+                continue
+            for c in scores:
+                scores[c] += math.log((per.get(c, 0) + ALPHA) / (self.feature_totals[c] + ALPHA * vocab))
+
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        return best, 1.0 / sum(math.exp(s - top) for s in scores.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "last_id": self.last_id,
+            "names": sorted(self.names),
+            "docs": self.docs,
+            "feature_totals": self.feature_totals,
+            "counts": {str(f): per for f, per in self.counts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CategoryModel":
+        model = cls()
+        model.last_id = data["last_id"]
+        model.names = set(data["names"])
+        model.docs = data["docs"]
+        model.feature_totals = data["feature_totals"]
+        model.counts = {int(f): per for f, per in data["counts"].items()}
+        return model
+
+
+# user_id -> модель
+_models: Dict[int, CategoryModel] = {}
+
+# Для логов: сколько раз классификатор поменял категорию из текста
+stats = {"predicted": 0, "kept": 0}
+
+
+async def _get_model(user_id: int) -> CategoryModel:
+    model = _models.get(user_id)
+    if model is None:
+        if len(_models) >= MAX_MODELS:
+            _models.clear()
+        model = _models[user_id] = CategoryModel()
+
+    if time.monotonic() - model.refreshed_at < REFRESH_INTERVAL:
+        return model
+    model.refreshed_at = time.monotonic()
+
+    while True:
+        rows = await fetch_all(
+            TRAINING_ROWS,
+            {"user_id": user_id, "after_id": model.last_id, "limit": TRAINING_BATCH},
+        )
+        for row in rows:
+            # Параллельное дообучение той же модели могло уже учесть эту строку
+            if row["id"] <= model.last_id:
+                continue
+            model.learn(row["description"], row["category_name"])
+            model.last_id = row["id"]
+        if len(rows) < TRAINING_BATCH:
+            return model
+
+
+async def choose_category(user_id: int, text: str, parsed_name: str) -> str:
+    """
+    Категория для траты: название из текста, если такая категория у
+    пользователя уже есть, иначе — уверенное предсказание по его истории,
+    иначе — снова название из текста (станет новой категорией).
+    """
+    model = await _get_model(user_id)
+    if parsed_name != DEFAULT_CATEGORY and parsed_name in model.names:
+        return parsed_name
+
+    prediction = model.predict(text)
+    if prediction and prediction[1] >= MIN_CONFIDENCE:
+        stats["predicted"] += 1
+        return prediction[0]
+    stats["kept"] += 1
+    return parsed_name
+
+
+def remember_category(user_id: int, name: str) -> None:
+    """Категория уже используется, даже если модель её ещё не дочитала из БД."""
+    model = _models.get(user_id)
+    if model is not None:
+        model.names.add(name)
+
+
+def load(path: Optional[str] = None) -> int:
+    """Поднять сохранённые модели (синхронно — звать через to_thread). Возвращает их число."""
+    path = path if path is not None else settings.category_model_path
+    if not path or not os.path.exists(path):
+        return 0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        data = json.load(f)
+    for user_id, model in data.items():
+        _models[int(user_id)] = CategoryModel.from_dict(model)
+    return len(data)
+
+
+def save(path: Optional[str] = None) -> int:
+    """Сохранить модели (синхронно). Пишем во временный файл и переименовываем."""
+    path = path if path is not None else settings.category_model_path
+    if not path or not _models:
+        return 0
+    tmp = f"{path}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump({str(user_id): model.to_dict() for user_id, model in _models.items()}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return len(_models)
@@ -0,0 +1,156 @@
+"""
+Картинки к отчётам: круговая диаграмма по категориям и столбики по дням.
+
+matplotlib — CPU-bound и держит GIL, поэтому рисуем в отдельном процессе
+(ProcessPoolExecutor), а готовые PNG кэшируем по проекту: пока итоги не
+изменились, повторный отчёт отдаёт картинку из кэша.
+"""
+import asyncio
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from .db import fetch_all, statement
+from .money import from_minor
+
+# Сколько процессов держать под отрисовку
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "1"))
+
+# Сколько категорий показывать на круговой диаграмме, остальное — в «прочее»
+MAX_PIE_SLICES = 8
+
+PROJECT_DAILY_TOTALS_RUB = statement(
+    "rollup.project_daily_totals_rub",
+    '''
+    SELECT day, SUM(total_rub_minor)::bigint AS total_rub_minor
+    FROM expense_daily_rollup
+    WHERE project_id = :project_id
+    GROUP BY day
+    ORDER BY day
+    ''',
+    replica=True,
+)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+# project_id -> (отпечаток итогов, PNG); LRU на CHART_CACHE_MAX проектов
+_chart_cache: "OrderedDict[int, Tuple[str, bytes]]" = OrderedDict()
+CHART_CACHE_MAX = 200
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=CHART_WORKERS)
+    return _executor
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _fingerprint(cat_totals: Dict[str, float]) -> str:
+    """
+    Отпечаток итогов по категориям: любая новая трата меняет хотя бы одну
+    сумму, так что этого достаточно, чтобы понять, устарела ли картинка.
+    """
+    h = hashlib.sha1()
+    for name, val in sorted(cat_totals.items()):
+        h.update(f"{name}={val:.2f};".encode())
+    return h.hexdigest()
+
+
+def render_report_chart(
+    title: str,
+    cat_totals: Dict[str, float],
+    daily: List[Tuple[str, float]],
+) -> bytes:
+    """
+    Рисует PNG с двумя графиками. Выполняется в дочернем процессе,
+    поэтому принимает и возвращает только простые данные.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    items = sorted(cat_totals.items(), key=lambda kv: kv[1], reverse=True)
+    if len(items) > MAX_PIE_SLICES:
+        rest = sum(v for _, v in items[MAX_PIE_SLICES - 1:])
+        items = items[:MAX_PIE_SLICES - 1] + [("остальное", rest)]
+
+    fig, (ax_pie, ax_bar) = plt.subplots(1, 2, figsize=(12, 5))
+    fig.suptitle(title)
+
+    if items:
+        ax_pie.pie(
+            [v for _, v in items],
+            labels=[name.capitalize() for name, _ in items],
+            autopct="%1.0f%%",
+            startangle=90,
+        )
+    ax_pie.set_title("По категориям, RUB")
+    ax_pie.axis("equal")
+
+    if daily:
+        ax_bar.bar([d for d, _ in daily], [v for _, v in daily])
+        ax_bar.tick_params(axis="x", labelrotation=60, labelsize=8)
+    ax_bar.set_title("По дням, RUB")
+
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=100)
+    plt.close(fig)
+    return buf.getvalue()
+
+
+async def get_report_chart(project: Dict[str, Any], cat_totals: Dict[str, float]) -> Optional[bytes]:
+    """
+    PNG для отчёта по проекту или None, если рисовать нечего
+    (или matplotlib не установлен).
+    """
+    if not cat_totals:
+        return None
+
+    fingerprint = _fingerprint(cat_totals)
+    cached = _chart_cache.get(project["id"])
+    if cached and cached[0] == fingerprint:
+        _chart_cache.move_to_end(project["id"])
+        return cached[1]
+
+    rows = await fetch_all(PROJECT_DAILY_TOTALS_RUB, {"project_id": project["id"]})
+    days = [row["day"] for row in rows if isinstance(row["day"], date)]
+    # История дольше календарного года — без года подписи повторялись бы
+    day_format = "%d.%m.%y" if days and days[0].year != days[-1].year else "%d.%m"
+    daily = [
+        (
+            row["day"].strftime(day_format) if isinstance(row["day"], date) else str(row["day"]),
+            float(from_minor(row["total_rub_minor"], "RUB")),
+        )
+        for row in rows
+    ]
+
+    loop = asyncio.get_running_loop()
+    try:
+        png = await loop.run_in_executor(
+            _get_executor(),
+            render_report_chart,
+            f"«{project['name']}»",
+            cat_totals,
+            daily,
+        )
+    except ImportError:
+        return None
+
+    _chart_cache[project["id"]] = (fingerprint, png)
+    _chart_cache.move_to_end(project["id"])
+    while len(_chart_cache) > CHART_CACHE_MAX:
+        _chart_cache.popitem(last=False)
+    return png
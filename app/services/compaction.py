@@ -0,0 +1,130 @@
+"""
+Сжатие старых трат в помесячные итоги (COMPACTION_AFTER_DAYS > 0).
+
+У долгих проектов (ремонт, бюджет семьи) старые траты читаются только в
+агрегатах. Траты старше COMPACTION_AFTER_DAYS дней переносятся в
+expense_monthly_summary (проект × месяц × категория × валюта) и удаляются из
+expenses. Итоги проекта, пересчёт лимитов и выгрузка читают обе таблицы, а
+отчёты по периодам — expense_daily_rollup, который при сжатии не меняется,
+так что все суммы остаются прежними. Теряются описания отдельных трат: их
+больше не найдёт /find.
+
+Переносим пачками по COMPACTION_BATCH строк: каждая пачка — один запрос
+(DELETE ... RETURNING + INSERT ... ON CONFLICT в одном CTE), короткие
+блокировки, и прерванный прогон ничего не теряет и не удваивает.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from app.config import settings
+from .db import fetch_one_returning, statement
+
+# Пауза между пачками, чтобы не забивать основную БД
+BATCH_PAUSE = 0.5
+
+COMPACT_BATCH = statement(
+    "compaction.compact_batch",
+    '''
+    WITH moved AS (
+        DELETE FROM expenses e
+        WHERE e.id IN (
+            SELECT id
+            FROM expenses
+            WHERE created_at < :cutoff
+            LIMIT :batch
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING e.project_id, e.category_id, e.currency_original, e.amount_original_minor,
+                  e.amount_rub_minor, e.created_at, pg_column_size(e.*) AS row_bytes
+    ),
+    summary AS (
+        INSERT INTO expense_monthly_summary AS s
+            (project_id, month, category_id, currency_original, total_original_minor, total_rub_minor, expense_count)
+        SELECT project_id,
+               date_trunc('month', created_at AT TIME ZONE 'UTC')::date,
+               COALESCE(category_id, 0),
+               currency_original,
+               SUM(amount_original_minor),
+               SUM(amount_rub_minor),
+               COUNT(*)
+        FROM moved
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (project_id, month, category_id, currency_original) DO UPDATE
+        SET total_original_minor = s.total_original_minor + EXCLUDED.total_original_minor,
+            total_rub_minor      = s.total_rub_minor + EXCLUDED.total_rub_minor,
+            expense_count        = s.expense_count + EXCLUDED.expense_count
+        RETURNING pg_column_size(s.*) AS row_bytes
+    )
+    SELECT (SELECT COUNT(*) FROM moved) AS moved,
+           (SELECT COALESCE(SUM(row_bytes), 0) FROM moved) AS moved_bytes,
+           (SELECT COUNT(*) FROM summary) AS summary_rows,
+           (SELECT COALESCE(SUM(row_bytes), 0) FROM summary) AS summary_bytes
+    ''',
+)
+
+# Метрики последнего прогона (для логов)
+progress: Dict[str, object] = {
+    "moved": 0,
+    "summary_rows": 0,
+    "reclaimed_bytes": 0,
+    "running": False,
+}
+
+
+async def compact(older_than_days: int, batch: Optional[int] = None) -> Dict[str, object]:
+    """
+    Перенести в помесячные итоги все траты старше older_than_days дней.
+    Возвращает метрики прогона: сколько трат перенесено, сколько строк
+    итогов затронуто и примерно сколько байт данных освобождено (место в
+    файлах таблицы переиспользует autovacuum).
+    """
+    batch = batch or settings.compaction_batch
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    progress.update(moved=0, summary_rows=0, reclaimed_bytes=0, running=True)
+    try:
+        while True:
+            row = await fetch_one_returning(COMPACT_BATCH, {"cutoff": cutoff, "batch": batch})
+            moved = int(row["moved"])
+            progress["moved"] += moved
+            progress["summary_rows"] += int(row["summary_rows"])
+            # Строка итогов, которая уже была, просто обновилась — это не новое место, но оценки хватает
+            progress["reclaimed_bytes"] += int(row["moved_bytes"]) - int(row["summary_bytes"])
+            if moved < batch:
+                break
+            await asyncio.sleep(BATCH_PAUSE)
+    finally:
+        progress["running"] = False
+
+    print(
+        f"[compaction] moved {progress['moved']} expenses older than {older_than_days}d "
+        f"into {progress['summary_rows']} monthly rows, ~{progress['reclaimed_bytes'] / 1024 / 1024:.1f} MB reclaimed"
+    )
+    return dict(progress)
+
+
+def _next_run_at(now: datetime) -> datetime:
+    run_at = now.replace(hour=settings.compaction_hour_utc, minute=0, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += timedelta(days=1)
+    return run_at
+
+
+async def run_scheduler() -> None:
+    """Фоновая задача в процессе бота: раз в сутки в COMPACTION_HOUR_UTC."""
+    while True:
+        now = datetime.now(timezone.utc)
+        await asyncio.sleep((_next_run_at(now) - now).total_seconds())
+        try:
+            await compact(settings.compaction_after_days)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Каждая пачка атомарна — следующий прогон продолжит с того же места
+            print(f"[compaction] run failed: {e}")
+
+
+def start() -> Optional[asyncio.Task]:
+    if settings.compaction_after_days <= 0:
+        return None
+    return asyncio.create_task(run_scheduler(), name="compaction-scheduler")
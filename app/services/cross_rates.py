@@ -0,0 +1,101 @@
+"""
+Матрица кросс-курсов для отчётов в любой валюте.
+
+Строится один раз при каждом обновлении таблицы курсов (см. currency.py):
+matrix[i, j] — сколько единиц валюты j стоит одна единица валюты i. Отчёт
+собирает суммы в виде матрицы «строка отчёта × валюта траты», и перевод всех
+строк в целевую валюту — одно умножение матрицы на столбец кросс-курсов.
+
+Два режима:
+- по текущим курсам: суммы в исходных валютах × текущие кросс-курсы;
+- по историческим: суммы в RUB, пересчитанные курсом на момент траты
+  (expenses.amount_rub_minor), × текущий курс RUB к целевой валюте. Для отчёта в
+  RUB это ровно исторические курсы; для других валют — исторический курс к
+  рублю и текущий рубля к целевой (курсы других пар мы не храним).
+
+Суммы на входе и выходе — целые минорные единицы (см. money.py); во float64
+живёт только само умножение, результат округляется обратно до минорных
+единиц валюты отчёта.
+"""
+from typing import TYPE_CHECKING, Dict, Optional, Sequence
+
+from .money import exponent
+
+if TYPE_CHECKING:
+    import numpy
+
+# NumPy импортируется при первой сборке матрицы (после старта), не при импорте модуля
+_np = None
+
+
+def numpy_module():
+    global _np
+    if _np is None:
+        import numpy
+
+        _np = numpy
+    return _np
+
+
+class CrossRates:
+    def __init__(self, rates_to_rub: Dict[str, float]):
+        np = numpy_module()
+        rates = dict(rates_to_rub)
+        rates["RUB"] = 1.0
+
+        self.codes = tuple(sorted(rates))
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        to_rub = np.array([rates[code] for code in self.codes], dtype=np.float64)
+        self.matrix = to_rub[:, None] / to_rub[None, :]
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.index
+
+    def rate(self, source: str, target: str) -> float:
+        """Сколько target за одну единицу source."""
+        return float(self.matrix[self.index[source], self.index[target]])
+
+    def convert(
+        self,
+        amounts: "numpy.ndarray",
+        amounts_rub: "numpy.ndarray",
+        currencies: Sequence[str],
+        target: str,
+        historical: bool = False,
+    ) -> "numpy.ndarray":
+        """
+        amounts — int64-матрица (строки отчёта × currencies) в минорных
+        единицах исходных валют, amounts_rub — те же суммы в копейках по курсу
+        на момент траты. Возвращает int64-вектор итогов строк в минорных
+        единицах target.
+        """
+        np = numpy_module()
+        rub_to_target = self.matrix[self.index["RUB"], self.index[target]] * 10.0 ** (
+            exponent(target) - exponent("RUB")
+        )
+        if historical:
+            return np.rint(amounts_rub.sum(axis=1) * rub_to_target).astype(np.int64)
+
+        # Валюты без текущего курса считаем по историческому рублёвому эквиваленту
+        known = np.array([code in self.index for code in currencies], dtype=bool)
+        factors = np.zeros(len(currencies), dtype=np.float64)
+        if known.any():
+            rows = [self.index[code] for code, ok in zip(currencies, known) if ok]
+            shifts = [exponent(target) - exponent(code) for code, ok in zip(currencies, known) if ok]
+            factors[known] = self.matrix[rows, self.index[target]] * 10.0 ** np.array(shifts, dtype=np.float64)
+
+        totals = amounts @ factors + amounts_rub[:, ~known].sum(axis=1) * rub_to_target
+        return np.rint(totals).astype(np.int64)
+
+
+_current: Optional[CrossRates] = None
+
+
+def rebuild(rates_to_rub: Dict[str, float]) -> None:
+    global _current
+    _current = CrossRates(rates_to_rub)
+
+
+def current() -> Optional[CrossRates]:
+    """Матрица по последним загруженным курсам (None, пока курсы не загружены)."""
+    return _current
@@ -2,10 +2,14 @@ import os
 import time
 import json
 import asyncio
-from typing import Dict, Tuple
+from typing import Dict, Iterable, Optional, Tuple
 from urllib.request import urlopen
 from urllib.error import URLError
 
+from . import cross_rates, currency_index
+from .db import execute, fetch_all, statement
+from .tracing import span
+
 # Настройки API
 API_KEY = os.getenv("EXCHANGE_RATE_API_KEY", "452867c7c0ecd5700db62526")
 API_BASE = os.getenv("EXCHANGE_RATE_API_BASE", "https://v6.exchangerate-api.com/v6")
@@ -13,10 +17,39 @@ API_BASE = os.getenv("EXCHANGE_RATE_API_BASE", "https://v6.exchangerate-api.com/
 # Сколько секунд кэш считается свежим (по умолчанию 1 час)
 CACHE_TTL = int(os.getenv("CURRENCY_CACHE_TTL", "3600"))
 
+# После неудачного запроса к API не пробуем снова столько секунд (по умолчанию 5 минут)
+RETRY_DELAY = int(os.getenv("CURRENCY_RETRY_DELAY", "300"))
+
 # Кэш курсов: храним "сколько RUB за 1 единицу валюты"
 # Пример: {"USD": (79.5, 1732300000.0), ...}
 _rates_cache: Dict[str, Tuple[float, float]] = {}
 
+# Время последней неудачной загрузки и фоновое обновление протухшего кэша
+_failed_at = 0.0
+_refresh_task: Optional[asyncio.Task] = None
+
+# Свежие курсы сохраняем в exchange_rates, чтобы после рестарта поднять их
+# из БД (preload_rates) и не ждать внешний API на первой же трате.
+SAVE_RATES = statement(
+    "exchange_rates.save_all",
+    """
+    INSERT INTO exchange_rates (currency_code, rate_to_rub, fetched_at)
+    SELECT code, rate, to_timestamp(:fetched_at)
+    FROM unnest(CAST(:codes AS text[]), CAST(:rates AS numeric[])) AS r(code, rate)
+    ON CONFLICT (currency_code) DO UPDATE
+    SET rate_to_rub = EXCLUDED.rate_to_rub,
+        fetched_at = EXCLUDED.fetched_at
+    """,
+)
+
+LOAD_RATES = statement(
+    "exchange_rates.load_all",
+    """
+    SELECT currency_code, rate_to_rub, EXTRACT(EPOCH FROM fetched_at) AS fetched_at
+    FROM exchange_rates
+    """,
+)
+
 
 def _build_url() -> str:
     """
@@ -79,11 +112,21 @@ def _fetch_all_rates_sync() -> Dict[str, float]:
     return result
 
 
+def _on_rates_updated() -> None:
+    """Пересобрать всё, что строится по таблице курсов: индекс валют и кросс-курсы."""
+    currency_index.rebuild(_rates_cache)
+    cross_rates.rebuild({code: rate for code, (rate, _) in _rates_cache.items()})
+
+
 async def _ensure_cache() -> None:
     """
     Обновляем кэш, если он устарел или пустой.
+
+    Протухший кэш обновляется в фоне, а трата считается по старым курсам:
+    иначе при лежащем API каждое сообщение ждало бы таймаут запроса. После
+    неудачи следующая попытка — не раньше чем через RETRY_DELAY секунд.
     """
-    global _rates_cache
+    global _refresh_task
 
     now = time.time()
     # если в кэше что-то есть и ещё не протухло — ничего не делаем
@@ -93,15 +136,76 @@ async def _ensure_cache() -> None:
         if now - ts < CACHE_TTL:
             return
 
-    # Иначе тянем новые курсы
+    if now - _failed_at < RETRY_DELAY:
+        return
+
+    if not _rates_cache:
+        await _refresh_rates()
+    elif _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_refresh_rates(), name="currency-refresh")
+
+
+async def _refresh_rates() -> None:
+    global _rates_cache, _failed_at
+
+    now = time.time()
     try:
-        rates = await asyncio.to_thread(_fetch_all_rates_sync)
+        with span("currency fetch_rates"):
+            rates = await asyncio.to_thread(_fetch_all_rates_sync)
         _rates_cache = {code: (rate, now) for code, rate in rates.items()}
+        _on_rates_updated()
     except (URLError, OSError, ValueError) as e:
-        print(f"[currency] failed to fetch rates from exchangerate-api: {e}")
-        # Если кэша нет вообще — хотя бы RUB=1
+        print(f"[currency] failed to fetch rates from exchangerate-api, retry in {RETRY_DELAY}s: {e}")
+        _failed_at = now
+        # Если кэша нет вообще — хотя бы RUB=1 (с нулевым временем: он
+        # считается протухшим, и после паузы курсы попробуем загрузить снова)
         if not _rates_cache:
-            _rates_cache = {"RUB": (1.0, now)}
+            _rates_cache = {"RUB": (1.0, 0.0)}
+            _on_rates_updated()
+        return
+
+    try:
+        await _save_rates(rates, now)
+    except Exception as e:
+        print(f"[currency] failed to save rates to db: {e}")
+
+
+async def _save_rates(rates: Dict[str, float], fetched_at: float) -> None:
+    codes = sorted(rates)
+    await execute(
+        SAVE_RATES,
+        {"codes": codes, "rates": [rates[c] for c in codes], "fetched_at": fetched_at},
+    )
+
+
+async def preload_rates() -> int:
+    """
+    Поднять кэш курсов из таблицы exchange_rates при старте.
+    Время загрузки берём из fetched_at, так что CACHE_TTL продолжает работать:
+    протухшие курсы обновятся из API при первом обращении.
+    Возвращает число загруженных валют.
+    """
+    global _rates_cache
+
+    rows = await fetch_all(LOAD_RATES)
+    if not rows:
+        return 0
+
+    # Кэш считается свежим по любому элементу, поэтому берём самое старое время
+    fetched_at = min(float(row["fetched_at"]) for row in rows)
+    cache = {row["currency_code"]: (float(row["rate_to_rub"]), fetched_at) for row in rows}
+    cache["RUB"] = (1.0, fetched_at)
+    _rates_cache = cache
+    _on_rates_updated()
+    return len(cache)
+
+
+async def ensure_rates() -> None:
+    """
+    Убедиться, что курсы (а с ними и currency_index) загружены и свежие.
+    Дёшево, если кэш не протух.
+    """
+    await _ensure_cache()
 
 
 async def get_rate_to_rub(currency: str) -> float:
@@ -118,6 +222,11 @@ async def get_rate_to_rub(currency: str) -> float:
     if code == "RUB":
         return 1.0
 
+    with span("currency get_rate_to_rub", **{"currency.code": code}):
+        return await _lookup_rate(code)
+
+
+async def _lookup_rate(code: str) -> float:
     await _ensure_cache()
 
     pair = _rates_cache.get(code)
@@ -132,5 +241,28 @@ async def get_rate_to_rub(currency: str) -> float:
         rate, _ = pair
         return float(rate)
 
-    # Совсем на крайний случай — считаем 1:1, чтобы не падать
+    # Совсем на крайний случай — считаем 1:1, чтобы не падать. Хендлеры до
+    # сюда валюты без курса не пускают (см. currency_index.is_supported)
+    print(f"[currency] no rate for {code}, using 1:1")
     return 1.0
+
+
+async def get_rates_to_rub(currencies: Iterable[str]) -> Dict[str, float]:
+    """
+    Пакетный вариант get_rate_to_rub: один раз проверяет кэш и возвращает
+    курсы сразу для всех переданных валют (code -> RUB за 1 единицу).
+    Неизвестные валюты, как и в get_rate_to_rub, считаются 1:1.
+    """
+    codes = {c.upper() for c in currencies if c}
+    if codes - {"RUB"}:
+        with span("currency get_rates_to_rub", **{"currency.count": len(codes)}):
+            await _ensure_cache()
+
+    result: Dict[str, float] = {}
+    for code in codes:
+        if code == "RUB":
+            result[code] = 1.0
+            continue
+        pair = _rates_cache.get(code)
+        result[code] = float(pair[0]) if pair else 1.0
+    return result
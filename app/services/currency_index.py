@@ -0,0 +1,102 @@
+"""
+Индекс валют: какие валюты бот понимает и как их узнавать в тексте.
+
+Набор валют берётся из таблицы курсов (currency._rates_cache) и
+пересобирается при каждом её обновлении: валюта поддерживается, только если
+для неё есть курс, поэтому трату в незнакомой валюте бот не пересчитает
+молча 1:1. Поиск — один dict-lookup по нормализованному слову: ISO-код,
+символ или русское название в любом падеже.
+"""
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+# Символы, названия и склонения. Активны только валюты, для которых есть курс;
+# ISO-коды всех валют из таблицы курсов узнаются и без этого словаря.
+# Неоднозначные слова («крона», «песо», «динар», «¥») намеренно не включены.
+CURRENCY_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "RUB": ("rur", "₽", "р", "руб", "рубль", "рубля", "рублей", "рубли"),
+    "USD": (
+        "$", "us$", "доллар", "доллара", "долларов", "доллары",
+        "бакс", "бакса", "баксов", "баксы", "дол", "долл",
+    ),
+    "EUR": ("€", "евро"),
+    "CNY": ("юань", "юаня", "юаней", "юани", "юан", "yuan", "rmb", "жэньминьби"),
+    "JPY": ("円", "йена", "йены", "йен", "иена", "иены", "иен", "yen"),
+    "GBP": ("£", "фунт", "фунта", "фунтов", "фунты"),
+    "CHF": ("франк", "франка", "франков", "франки"),
+    "KZT": ("₸", "тенге"),
+    "UAH": ("₴", "гривна", "гривны", "гривен", "гривень", "грн"),
+    "BYN": ("br", "бел.руб"),
+    "TRY": ("₺", "лира", "лиры", "лир"),
+    "GEL": ("₾", "лари"),
+    "AMD": ("֏", "драм", "драма", "драмов"),
+    "AZN": ("₼", "манат", "маната", "манатов"),
+    "UZS": ("сум", "сума", "сумов"),
+    "KGS": ("сом", "сома", "сомов"),
+    "THB": ("฿", "бат", "бата", "батов"),
+    "VND": ("₫", "донг", "донга", "донгов"),
+    "KRW": ("₩", "вона", "воны", "вон"),
+    "INR": ("₹", "рупия", "рупии", "рупий"),
+    "ILS": ("₪", "шекель", "шекеля", "шекелей"),
+    "AED": ("дирхам", "дирхама", "дирхамов"),
+    "MNT": ("₮", "тугрик", "тугрика", "тугриков"),
+    "PLN": ("zł", "злотый", "злотых", "злотого", "злотые"),
+    "BRL": ("r$", "реал", "реала", "реалов"),
+    "CAD": ("c$", "ca$"),
+    "AUD": ("a$", "au$"),
+    "HKD": ("hk$",),
+    "SGD": ("s$",),
+}
+
+# Знаки препинания, которые отрезаем по краям слова ("руб.", "(USD)")
+_STRIP_CHARS = ".,;:()[]{}\"'«»"
+
+_index: Dict[str, str] = {}
+_codes: FrozenSet[str] = frozenset()
+
+
+def normalize_token(token: str) -> str:
+    return (token or "").strip().strip(_STRIP_CHARS).lower()
+
+
+def rebuild(codes: Iterable[str]) -> int:
+    """
+    Пересобрать индекс по набору валют, для которых есть курс.
+    Возвращает число поддерживаемых валют.
+    """
+    global _index, _codes
+
+    available = frozenset(code.upper() for code in codes) | {"RUB"}
+    index: Dict[str, str] = {code.lower(): code for code in available}
+    for code, aliases in CURRENCY_ALIASES.items():
+        if code in available:
+            for alias in aliases:
+                index[alias] = code
+
+    # Подменяем целиком: читатели в рабочих потоках видят либо старый индекс, либо новый
+    _index, _codes = index, available
+    return len(available)
+
+
+def resolve(token: str) -> Optional[str]:
+    """ISO-код по слову из текста ('юаней', '$', 'usd') или None."""
+    return _index.get(normalize_token(token))
+
+
+def resolve_prefix(token: str) -> Optional[str]:
+    """
+    Как resolve(), но для слова перед суммой: только ISO-код или символ.
+    Русские названия там слишком часто обычные слова: «сом 500» — рыба,
+    а не киргизские сомы, «сум 300» или «р 100» — тоже не валюта.
+    """
+    word = normalize_token(token)
+    if word.isalpha() and word.upper() not in _codes:
+        return None
+    return _index.get(word)
+
+
+def is_supported(code: str) -> bool:
+    return (code or "").upper() in _codes
+
+
+def supported_codes() -> FrozenSet[str]:
+    return _codes
@@ -1,47 +1,371 @@
 import asyncio
-from typing import Any, Dict, List, Optional
+import time
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
 
 from sqlalchemy import create_engine, text
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection, CursorResult, Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql.elements import TextClause
 
 from app.config import settings
+from .tracing import current_span, span
 
-engine: Engine = create_engine(settings.database_url, future=True)
+# Движки создаются не при импорте, а в init_engine() из стартового хука
+# (или лениво при первом запросе), чтобы импорт модулей оставался дешёвым.
+engine: Optional[Engine] = None
 
+# Реплика для read-only запросов (отчёты, списки). Если не настроена — всё идёт в engine.
+replica_engine: Optional[Engine] = None
+
+# Как часто перепроверять отставание реплики и сколько не трогать её после ошибки
+REPLICA_LAG_CHECK_INTERVAL = 5.0
+REPLICA_RETRY_AFTER = 30.0
+
+T = TypeVar("T")
+
+
+def init_engine() -> Engine:
+    """Создать движки основной БД и реплики (если ещё не созданы)."""
+    global engine, replica_engine
+    if engine is None:
+        engine = create_engine(settings.database_url, future=True, pool_size=settings.db_pool_size)
+        if settings.database_replica_url:
+            replica_engine = create_engine(
+                settings.database_replica_url,
+                future=True,
+                pool_size=settings.db_pool_size,
+            )
+    return engine
+
+
+def get_engine() -> Engine:
+    return engine if engine is not None else init_engine()
+
+
+def _warm_pool(source: Engine, size: int) -> None:
+    # Держим все соединения одновременно, иначе пул будет отдавать одно и то же
+    conns = []
+    try:
+        for _ in range(size):
+            conn = source.connect()
+            conns.append(conn)
+            conn.exec_driver_sql("SELECT 1")
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+async def warm_up_pool() -> None:
+    """Заранее открыть settings.db_pool_size соединений (и к реплике, если есть)."""
+    init_engine()
+    await asyncio.to_thread(_warm_pool, engine, settings.db_pool_size)
+    if replica_engine is not None:
+        try:
+            await asyncio.to_thread(_warm_pool, replica_engine, settings.db_pool_size)
+        except OperationalError as e:
+            _mark_replica_down(str(e.orig))
+
+
+def dispose_engine() -> None:
+    """Закрыть все соединения пулов (при остановке бота)."""
+    global engine, replica_engine
+    if replica_engine is not None:
+        replica_engine.dispose()
+        replica_engine = None
+    if engine is not None:
+        engine.dispose()
+        engine = None
+
+
+# --- Реестр именованных запросов ---------------------------------------------
+#
+# Каждый сервис объявляет свои запросы один раз при импорте через statement(),
+# а хелперы ниже выполняют их по имени. text() строится один раз, и SQLAlchemy
+# берёт скомпилированную форму из compiled cache движка вместо разбора строки
+# на каждом вызове. По каждому запросу копятся счётчики вызовов и времени.
+
+
+@dataclass
+class Statement:
+    name: str
+    clause: TextClause
+    # Можно ли выполнять запрос на реплике (только чистые SELECT без read-your-writes)
+    replica: bool = False
+    calls: int = 0
+    replica_calls: int = 0
+    errors: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+
+
+_statements: Dict[str, Statement] = {}
+_stats_lock = Lock()
+
+
+def statement(name: str, sql: str, replica: bool = False) -> str:
+    """
+    Регистрирует запрос под именем и возвращает это имя.
+    replica=True разрешает fetch_one/fetch_all отправлять его на реплику.
+    Повторная регистрация того же имени с другим SQL — ошибка.
+    """
+    existing = _statements.get(name)
+    if existing is not None:
+        if existing.clause.text != sql:
+            raise ValueError(f"Statement {name!r} is already registered with different SQL")
+        return name
+
+    _statements[name] = Statement(name=name, clause=text(sql), replica=replica)
+    return name
+
+
+def get_statement_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Снимок счётчиков по всем зарегистрированным запросам:
+    name -> {calls, errors, total_ms, avg_ms, max_ms}.
+    """
+    with _stats_lock:
+        return {
+            st.name: {
+                "calls": st.calls,
+                "replica_calls": st.replica_calls,
+                "errors": st.errors,
+                "total_ms": st.total_time * 1000,
+                "avg_ms": (st.total_time / st.calls * 1000) if st.calls else 0.0,
+                "max_ms": st.max_time * 1000,
+            }
+            for st in _statements.values()
+        }
+
+
+def _get_statement(name: str) -> Statement:
+    st = _statements.get(name)
+    if st is None:
+        raise KeyError(f"Unknown statement {name!r}, register it with db.statement()")
+    return st
+
+
+def _db_span(name: str, operation: str):
+    return span(f"db {name}", **{"db.system": "postgresql", "db.operation": operation})
+
+
+def _execute(
+    conn: Connection,
+    st: Statement,
+    params: Optional[Dict[str, Any]],
+    on_replica: bool = False,
+):
+    started = time.perf_counter()
+    try:
+        return conn.execute(st.clause, params or {})
+    except Exception:
+        with _stats_lock:
+            st.errors += 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        with _stats_lock:
+            st.calls += 1
+            if on_replica:
+                st.replica_calls += 1
+            st.total_time += elapsed
+            if elapsed > st.max_time:
+                st.max_time = elapsed
+
+
+# --- Маршрутизация чтения на реплику -----------------------------------------
+
+REPLICA_LAG = statement(
+    "db.replica_lag",
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag
+    """,
+)
+
+_replica_lock = Lock()
+_replica_down_until = 0.0
+_replica_lag_checked_at = 0.0
+_replica_lag_ok = True
+
+
+def _mark_replica_down(reason: str) -> None:
+    global _replica_down_until
+    with _replica_lock:
+        _replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER
+    print(f"[db] replica unavailable, reading from primary for {REPLICA_RETRY_AFTER:.0f}s: {reason}")
+
+
+def _replica_usable() -> bool:
+    """
+    Вызывается из рабочего потока. Реплика годится, если она настроена,
+    не падала последние REPLICA_RETRY_AFTER секунд и отстаёт не больше
+    settings.replica_max_lag. Отставание проверяем не чаще раза в
+    REPLICA_LAG_CHECK_INTERVAL секунд.
+    """
+    global _replica_lag_checked_at, _replica_lag_ok
+
+    if replica_engine is None:
+        return False
+
+    now = time.monotonic()
+    with _replica_lock:
+        if now < _replica_down_until:
+            return False
+        if now - _replica_lag_checked_at < REPLICA_LAG_CHECK_INTERVAL:
+            return _replica_lag_ok
+        _replica_lag_checked_at = now
+
+    try:
+        with replica_engine.connect() as conn:
+            lag = float(_execute(conn, _statements[REPLICA_LAG], None, on_replica=True).scalar() or 0)
+    except OperationalError as e:
+        _mark_replica_down(str(e.orig))
+        return False
+
+    lag_ok = lag <= settings.replica_max_lag
+    with _replica_lock:
+        if lag_ok != _replica_lag_ok:
+            state = "back in sync" if lag_ok else "lagging"
+            print(f"[db] replica {state}: lag={lag:.1f}s")
+        _replica_lag_ok = lag_ok
+    return lag_ok
+
+
+def _read(
+    st: Statement,
+    params: Optional[Dict[str, Any]],
+    primary: bool,
+    consume: Callable[[CursorResult], T],
+) -> T:
+    """
+    Выполняет SELECT на реплике, если запрос это разрешает и вызывающий не
+    попросил primary=True (read-your-writes). При проблемах с соединением
+    к реплике прозрачно повторяет запрос на основной БД.
+    """
+    if st.replica and not primary and _replica_usable():
+        traced = current_span()
+        if traced is not None:
+            traced.set_attribute("db.replica", True)
+        try:
+            with replica_engine.connect() as conn:
+                return consume(_execute(conn, st, params, on_replica=True))
+        except OperationalError as e:
+            _mark_replica_down(str(e.orig))
+
+    with get_engine().connect() as conn:
+        return consume(_execute(conn, st, params))
+
+
+def stream_rows(
+    name: str,
+    params: Optional[Dict[str, Any]] = None,
+    batch_size: int = 1000,
+    primary: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Синхронный генератор для рабочего потока (asyncio.to_thread): читает
+    результат через server-side cursor пачками по batch_size строк, так что
+    в памяти никогда не лежит вся выборка целиком.
+    """
+    st = _get_statement(name)
+    on_replica = st.replica and not primary and _replica_usable()
+    source = replica_engine if on_replica else get_engine()
+
+    with _db_span(name, "stream_rows"), source.connect() as conn:
+        conn = conn.execution_options(stream_results=True, yield_per=batch_size)
+        result = _execute(conn, st, params, on_replica=on_replica)
+        for row in result.mappings():
+            yield dict(row)
+
+
+def _first_row(result: CursorResult) -> Optional[Dict[str, Any]]:
+    row = result.mappings().first()
+    return dict(row) if row else None
+
+
+def _all_rows(result: CursorResult) -> List[Dict[str, Any]]:
+    return [dict(row) for row in result.mappings().all()]
+
+
+# --- Хелперы ------------------------------------------------------------------
+
+
+async def fetch_one(
+    name: str,
+    params: Optional[Dict[str, Any]] = None,
+    primary: bool = False,
+) -> Optional[Dict[str, Any]]:
+    st = _get_statement(name)
+    with _db_span(name, "fetch_one"):
+        return await asyncio.to_thread(_read, st, params, primary, _first_row)
+
+
+async def fetch_all(
+    name: str,
+    params: Optional[Dict[str, Any]] = None,
+    primary: bool = False,
+) -> List[Dict[str, Any]]:
+    st = _get_statement(name)
+    with _db_span(name, "fetch_all"):
+        return await asyncio.to_thread(_read, st, params, primary, _all_rows)
+
+
+async def execute(name: str, params: Optional[Dict[str, Any]] = None) -> None:
+    st = _get_statement(name)
 
-async def fetch_one(query: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
     def _run():
-        with engine.connect() as conn:
-            result = conn.execute(text(query), params or {})
-            row = result.mappings().first()
-            return dict(row) if row else None
+        with get_engine().begin() as conn:
+            _execute(conn, st, params)
 
-    return await asyncio.to_thread(_run)
+    with _db_span(name, "execute"):
+        await asyncio.to_thread(_run)
 
 
-async def fetch_all(query: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+async def fetch_one_returning(name: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Для INSERT ... RETURNING *"""
+    st = _get_statement(name)
+
     def _run():
-        with engine.connect() as conn:
-            result = conn.execute(text(query), params or {})
-            return [dict(row) for row in result.mappings().all()]
+        with get_engine().begin() as conn:
+            return _first_row(_execute(conn, st, params))
 
-    return await asyncio.to_thread(_run)
+    with _db_span(name, "fetch_one_returning"):
+        return await asyncio.to_thread(_run)
 
 
-async def execute(query: str, params: Optional[Dict[str, Any]] = None) -> None:
+async def fetch_all_returning(name: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Для UPDATE/INSERT ... RETURNING, затрагивающих несколько строк"""
+    st = _get_statement(name)
+
     def _run():
-        with engine.begin() as conn:
-            conn.execute(text(query), params or {})
+        with get_engine().begin() as conn:
+            return _all_rows(_execute(conn, st, params))
 
-    await asyncio.to_thread(_run)
+    with _db_span(name, "fetch_all_returning"):
+        return await asyncio.to_thread(_run)
 
 
-async def fetch_one_returning(query: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
-    """Для INSERT ... RETURNING *"""
+def execute_on(conn: Connection, name: str, params: Optional[Dict[str, Any]] = None) -> CursorResult:
+    """
+    Выполнить зарегистрированный запрос на уже открытом соединении —
+    для многошаговых операций внутри run_in_transaction().
+    """
+    return _execute(conn, _get_statement(name), params)
+
+
+async def run_in_transaction(fn: Callable[[Connection], T]) -> T:
+    """
+    Запускает fn(conn) в рабочем потоке внутри одной транзакции на основной БД.
+    Нужен там, где несколько запросов (или COPY) должны пройти атомарно.
+    """
     def _run():
-        with engine.begin() as conn:
-            result = conn.execute(text(query), params or {})
-            row = result.mappings().first()
-            return dict(row) if row else None
+        with get_engine().begin() as conn:
+            return fn(conn)
 
-    return await asyncio.to_thread(_run)
+    with _db_span("transaction", "run_in_transaction"):
+        return await asyncio.to_thread(_run)
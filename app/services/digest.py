@@ -0,0 +1,254 @@
+"""
+Ежедневный дайджест: вчерашние траты по активному проекту каждого пользователя.
+
+Все данные считаются одним сгруппированным запросом по expense_daily_rollup,
+рассылка идёт через PacedSender, а прогресс пишется в digest_runs после
+каждого получателя, чтобы после перезапуска продолжить с того же места.
+Прогон за день рассылает один процесс: он забирает строку digest_runs и
+отмечается в ней (heartbeat_at), а забрать её у другого можно, только если
+тот не отмечался дольше CLAIM_TTL секунд.
+"""
+import asyncio
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from itertools import groupby
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+
+from app.config import settings
+from .db import execute, fetch_all, fetch_one, fetch_one_returning, statement
+from .money import format_minor
+from .sender import get_sender
+
+# Через сколько секунд без отметки прогон считается брошенным (процесс упал)
+CLAIM_TTL = 300
+# Пауза перед повтором прогона, упавшего с ошибкой
+RETRY_DELAY = 60
+
+# Сколько категорий показывать в дайджесте
+TOP_CATEGORIES = 3
+
+# Забрать прогон: новый, отпущенный или брошенный. Пустой результат — прогон
+# уже закончен или его прямо сейчас рассылает другой процесс.
+CLAIM_DIGEST_RUN = statement(
+    "digest.claim_run",
+    '''
+    INSERT INTO digest_runs AS d (run_date, claimed_by, heartbeat_at)
+    VALUES (:run_date, :token, now())
+    ON CONFLICT (run_date) DO UPDATE
+    SET claimed_by = EXCLUDED.claimed_by,
+        heartbeat_at = now()
+    WHERE d.finished_at IS NULL
+      AND (d.heartbeat_at IS NULL OR d.heartbeat_at < now() - make_interval(secs => :claim_ttl))
+    RETURNING *
+    ''',
+)
+
+# Прогресс и отметка; не наш прогон (его забрали) — пустой результат
+CHECKPOINT_DIGEST_RUN = statement(
+    "digest.checkpoint",
+    '''
+    UPDATE digest_runs
+    SET last_user_id = :last_user_id,
+        sent = :sent,
+        failed = :failed,
+        heartbeat_at = now()
+    WHERE run_date = :run_date
+      AND claimed_by = :token
+    RETURNING run_date
+    ''',
+)
+
+# При остановке отпускаем прогон, чтобы после рестарта не ждать CLAIM_TTL
+RELEASE_DIGEST_RUN = statement(
+    "digest.release",
+    '''
+    UPDATE digest_runs
+    SET heartbeat_at = NULL
+    WHERE run_date = :run_date
+      AND claimed_by = :token
+      AND finished_at IS NULL
+    ''',
+)
+
+FINISH_DIGEST_RUN = statement(
+    "digest.finish",
+    '''
+    UPDATE digest_runs
+    SET finished_at = now()
+    WHERE run_date = :run_date
+      AND claimed_by = :token
+    ''',
+)
+
+DIGEST_RUN_FINISHED = statement(
+    "digest.run_finished",
+    '''
+    SELECT run_date FROM digest_runs
+    WHERE run_date = :run_date AND finished_at IS NOT NULL
+    ''',
+)
+
+# Одна строка на пользователя × категорию за день; порядок по user_id
+# позволяет продолжить рассылку с места остановки.
+DIGEST_ROWS = statement(
+    "digest.rows",
+    '''
+    SELECT u.id AS user_id,
+           u.telegram_id,
+           p.name AS project_name,
+           COALESCE(c.name, 'прочее') AS category_name,
+           SUM(r.total_rub_minor)::bigint AS total_rub_minor,
+           SUM(r.expense_count) AS expense_count
+    FROM expense_daily_rollup r
+    JOIN projects p ON p.id = r.project_id
+                   AND p.is_deleted = FALSE
+    JOIN project_members m ON m.project_id = r.project_id
+                          AND m.is_active = TRUE
+    JOIN users u ON u.id = m.user_id
+    LEFT JOIN categories c ON c.id = r.category_id
+    WHERE r.day = :day
+      AND u.id > :after_user_id
+    GROUP BY u.id, u.telegram_id, p.name, category_name
+    ORDER BY u.id, total_rub_minor DESC
+    ''',
+    replica=True,
+)
+
+# Метрики последнего/текущего прогона (для логов и health-check)
+progress: Dict[str, Any] = {
+    "run_date": None,
+    "total": 0,
+    "sent": 0,
+    "failed": 0,
+    "running": False,
+}
+
+
+def render_digest(day: date, rows: List[Dict[str, Any]]) -> str:
+    total_rub = sum(int(r["total_rub_minor"]) for r in rows)
+    count = sum(int(r["expense_count"]) for r in rows)
+
+    lines = [
+        f"Вчера ({day.strftime('%d.%m')}) в проекте <b>«{rows[0]['project_name']}»</b>:",
+        f"потрачено <b>{format_minor(total_rub, 'RUB')} RUB</b>, трат: {count}.",
+    ]
+    top = rows[:TOP_CATEGORIES]
+    if top:
+        lines.append("")
+        for r in top:
+            lines.append(f"• {r['category_name'].capitalize()}: <b>{format_minor(r['total_rub_minor'], 'RUB')}</b>")
+    return "\n".join(lines)
+
+
+async def run_daily_digest(bot: Bot, day: date) -> bool:
+    """
+    Разослать дайджест за день day. Повторный вызов для того же дня
+    продолжает незавершённую рассылку или ничего не делает, если она окончена.
+    False — прогон сейчас держит другой процесс, стоит попробовать позже.
+    """
+    token = uuid.uuid4().hex
+    run = await fetch_one_returning(
+        CLAIM_DIGEST_RUN,
+        {"run_date": day, "token": token, "claim_ttl": CLAIM_TTL},
+    )
+    if run is None:
+        done = await fetch_one(DIGEST_RUN_FINISHED, {"run_date": day})
+        return done is not None
+
+    rows = await fetch_all(DIGEST_ROWS, {"day": day, "after_user_id": run["last_user_id"]})
+    per_user = [(uid, list(group)) for uid, group in groupby(rows, key=lambda r: r["user_id"])]
+
+    sender = get_sender(bot)
+    sent, failed = run["sent"], run["failed"]
+    progress.update(run_date=day, total=sent + failed + len(per_user), sent=sent, failed=failed, running=True)
+    if run["last_user_id"]:
+        print(f"[digest] resuming {day} after user {run['last_user_id']}: {len(per_user)} left")
+    else:
+        print(f"[digest] starting {day}: {len(per_user)} recipients")
+
+    finished = False
+    try:
+        for i, (user_id, user_rows) in enumerate(per_user, start=1):
+            ok = await sender.send(user_rows[0]["telegram_id"], render_digest(day, user_rows))
+            if ok:
+                sent += 1
+            else:
+                failed += 1
+            progress.update(sent=sent, failed=failed)
+
+            # После каждого получателя: упав, повторим дайджест максимум одному
+            owned = await fetch_one_returning(
+                CHECKPOINT_DIGEST_RUN,
+                {"run_date": day, "token": token, "last_user_id": user_id, "sent": sent, "failed": failed},
+            )
+            if owned is None:
+                print(f"[digest] run for {day} was taken over by another process, stopping")
+                return True
+            if i % 100 == 0:
+                print(f"[digest] {day}: {i}/{len(per_user)} processed, sent={sent}, failed={failed}")
+
+        await execute(FINISH_DIGEST_RUN, {"run_date": day, "token": token})
+        finished = True
+        print(f"[digest] finished {day}: sent={sent}, failed={failed}")
+        return True
+    finally:
+        progress["running"] = False
+        if not finished:
+            try:
+                await execute(RELEASE_DIGEST_RUN, {"run_date": day, "token": token})
+            except Exception as e:
+                # Не отпустили — прогон заберут после CLAIM_TTL
+                print(f"[digest] failed to release run for {day}: {e}")
+
+
+def _next_run_at(now: datetime) -> datetime:
+    run_at = now.replace(hour=settings.digest_hour_utc, minute=0, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += timedelta(days=1)
+    return run_at
+
+
+async def run_scheduler(bot: Bot) -> None:
+    """
+    Фоновая задача в процессе бота. При старте догоняет сегодняшнюю рассылку,
+    если её время уже прошло (или она оборвалась), дальше — раз в сутки.
+    """
+    now = datetime.now(timezone.utc)
+    if now.hour >= settings.digest_hour_utc:
+        await _safe_run(bot, now.date() - timedelta(days=1))
+
+    while True:
+        now = datetime.now(timezone.utc)
+        run_at = _next_run_at(now)
+        await asyncio.sleep((run_at - now).total_seconds())
+        await _safe_run(bot, run_at.date() - timedelta(days=1))
+
+
+async def _safe_run(bot: Bot, day: date) -> None:
+    # Прогон держит другой процесс — если тот упал, заберём прогон после
+    # CLAIM_TTL; упали сами (например, БД недоступна) — повторим через
+    # RETRY_DELAY, прогресс сохранён в digest_runs и рассылка продолжится.
+    # Повторяем до следующего планового прогона, чтобы не заблокировать его
+    give_up_at = _next_run_at(datetime.now(timezone.utc))
+    while True:
+        try:
+            if await run_daily_digest(bot, day):
+                return
+            delay = CLAIM_TTL
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[digest] run for {day} failed, retrying in {RETRY_DELAY}s: {e}")
+            delay = RETRY_DELAY
+        if datetime.now(timezone.utc) + timedelta(seconds=delay) >= give_up_at:
+            print(f"[digest] giving up on {day}: next scheduled run is due")
+            return
+        await asyncio.sleep(delay)
+
+
+def start(bot: Bot) -> Optional[asyncio.Task]:
+    if not settings.digest_enabled:
+        return None
+    return asyncio.create_task(run_scheduler(bot), name="digest-scheduler")
@@ -2,42 +2,50 @@ from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 from typing import Optional, Dict, Any
 
-import httpx
-
 from app.config import settings
-from .db import fetch_one, fetch_one_returning
+from .db import fetch_one, fetch_one_returning, statement
 
 CACHE_TTL_HOURS = 24
 
+GET_CACHED_RATE = statement(
+    "exchange_rates.get",
+    """
+    SELECT * FROM exchange_rates
+    WHERE currency_code = :code
+    """,
+)
+
+UPSERT_RATE = statement(
+    "exchange_rates.upsert",
+    """
+    INSERT INTO exchange_rates (currency_code, rate_to_rub, fetched_at)
+    VALUES (:code, :rate, now())
+    ON CONFLICT (currency_code) DO UPDATE
+    SET rate_to_rub = EXCLUDED.rate_to_rub,
+        fetched_at = EXCLUDED.fetched_at
+    RETURNING *
+    """,
+)
+
 
 async def _get_cached_rate(currency_code: str) -> Optional[Dict[str, Any]]:
     return await fetch_one(
-        """
-        SELECT * FROM exchange_rates
-        WHERE currency_code = :code
-        """
-        ,
+        GET_CACHED_RATE,
         {"code": currency_code},
     )
 
 
 async def _save_rate(currency_code: str, rate: Decimal) -> Dict[str, Any]:
     record = await fetch_one_returning(
-        """
-        INSERT INTO exchange_rates (currency_code, rate_to_rub, fetched_at)
-        VALUES (:code, :rate, now())
-        ON CONFLICT (currency_code) DO UPDATE
-        SET rate_to_rub = EXCLUDED.rate_to_rub,
-            fetched_at = EXCLUDED.fetched_at
-        RETURNING *
-        """
-        ,
+        UPSERT_RATE,
         {"code": currency_code, "rate": rate},
     )
     return record
 
 
 async def _fetch_rate_from_api(currency_code: str) -> Decimal:
+    import httpx
+
     async with httpx.AsyncClient() as client:
         resp = await client.get(
             settings.currency_api_url,
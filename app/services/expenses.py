@@ -1,28 +1,197 @@
-from typing import Optional, Dict, Any
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Optional, Dict, Any, List, Tuple
 
-from .db import fetch_one, fetch_all, fetch_one_returning
+from . import cross_rates
+from .money import Money
+from .db import fetch_one, fetch_all, fetch_one_returning, statement
+
+GET_CATEGORY = statement(
+    "categories.get_by_name",
+    '''
+    SELECT * FROM categories
+    WHERE user_id = :user_id AND lower(name) = :name
+    ''',
+)
+
+INSERT_CATEGORY = statement(
+    "categories.insert",
+    '''
+    INSERT INTO categories (user_id, name, slug, is_system)
+    VALUES (:user_id, :name, :slug, FALSE)
+    RETURNING *
+    ''',
+)
+
+INSERT_EXPENSE = statement(
+    "expenses.insert",
+    '''
+    INSERT INTO expenses
+    (user_id, project_id, category_id, amount_original_minor, currency_original, amount_rub_minor, description,
+     idempotency_key, parse_source)
+    VALUES
+    (:user_id, :project_id, :category_id, :amount_original_minor, :currency_original, :amount_rub_minor, :description,
+     :idempotency_key, :parse_source)
+    ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+    RETURNING *
+    ''',
+)
+
+# Итог в рублях — сумма по строкам, отдельный запрос не нужен.
+# Старые траты могут быть сжаты в expense_monthly_summary (см. compaction.py).
+PROJECT_TOTALS_BY_CURRENCY = statement(
+    "expenses.project_totals_by_currency",
+    '''
+    SELECT currency_original,
+           SUM(total_minor)::bigint AS total_minor,
+           SUM(total_rub_minor)::bigint AS total_rub_minor
+    FROM (
+        SELECT currency_original, amount_original_minor AS total_minor, amount_rub_minor AS total_rub_minor
+        FROM expenses
+        WHERE project_id = :project_id
+        UNION ALL
+        SELECT currency_original, total_original_minor, total_rub_minor
+        FROM expense_monthly_summary
+        WHERE project_id = :project_id
+    ) t
+    GROUP BY currency_original
+    ''',
+    replica=True,
+)
+
+# Отчёты за период читаются из expense_daily_rollup (поддерживается триггером
+# на expenses), поэтому многомесячный проект — это сотни строк, а не все траты.
+
+# Суммы разбиты ещё и по валюте траты: перевод в валюту отчёта делается уже
+# в приложении, матрицей кросс-курсов (см. cross_rates.py).
+
+PERIOD_BUCKETS_BY_CURRENCY = statement(
+    "rollup.period_buckets_by_currency",
+    '''
+    SELECT date_trunc(:unit, r.day::timestamp)::date AS bucket,
+           r.currency_original,
+           SUM(r.total_original_minor)::bigint AS total_minor,
+           SUM(r.total_rub_minor)::bigint AS total_rub_minor,
+           SUM(r.expense_count) AS expense_count
+    FROM expense_daily_rollup r
+    WHERE r.project_id = :project_id
+      AND (CAST(:date_from AS date) IS NULL OR r.day >= CAST(:date_from AS date))
+      AND (CAST(:date_to AS date) IS NULL OR r.day <= CAST(:date_to AS date))
+    GROUP BY bucket, r.currency_original
+    ORDER BY bucket
+    ''',
+    replica=True,
+)
+
+PERIOD_CATEGORIES_BY_CURRENCY = statement(
+    "rollup.period_categories_by_currency",
+    '''
+    SELECT COALESCE(c.name, 'прочее') AS category_name,
+           r.currency_original,
+           SUM(r.total_original_minor)::bigint AS total_minor,
+           SUM(r.total_rub_minor)::bigint AS total_rub_minor
+    FROM expense_daily_rollup r
+    LEFT JOIN categories c ON r.category_id = c.id
+    WHERE r.project_id = :project_id
+      AND (CAST(:date_from AS date) IS NULL OR r.day >= CAST(:date_from AS date))
+      AND (CAST(:date_to AS date) IS NULL OR r.day <= CAST(:date_to AS date))
+    GROUP BY category_name, r.currency_original
+    ''',
+    replica=True,
+)
+
+BUCKET_UNITS = ("day", "week", "month")
+
+# Поиск по описаниям: подстрока или нечёткое совпадение слова (опечатки).
+# Оба условия обслуживает триграммный индекс по lower(description);
+# страницы — по id (keyset), без OFFSET.
+SEARCH_EXPENSES = statement(
+    "expenses.search",
+    '''
+    SELECT e.id,
+           e.created_at,
+           COALESCE(c.name, 'прочее') AS category_name,
+           e.amount_original_minor,
+           e.currency_original,
+           e.description
+    FROM expenses e
+    LEFT JOIN categories c ON c.id = e.category_id
+    WHERE e.project_id = :project_id
+      AND (lower(e.description) LIKE :pattern OR :query <% lower(e.description))
+      AND (CAST(:before_id AS bigint) IS NULL OR e.id < CAST(:before_id AS bigint))
+    ORDER BY e.id DESC
+    LIMIT :limit
+    ''',
+    replica=True,
+)
+
+SEARCH_PAGE_SIZE = 10
+
+# --- Идемпотентность ----------------------------------------------------------
+#
+# Одно и то же сообщение может прийти повторно (рестарт поллинга, повторная
+# доставка вебхука, наши ретраи). Перед БД стоит короткоживущий набор уже
+# виденных ключей — дубль отсекается до парсинга и GPT, — а окончательно
+# дубль отсекает уникальный индекс по expenses.idempotency_key.
+
+IDEMPOTENCY_TTL = 600
+IDEMPOTENCY_MAX_KEYS = 10000
+
+_seen_keys: "OrderedDict[str, float]" = OrderedDict()
+
+
+def message_idempotency_key(chat_id: int, message_id: int) -> str:
+    return f"tg:{chat_id}:{message_id}"
+
+
+def claim_idempotency_key(key: str) -> bool:
+    """
+    False — ключ уже обрабатывался в последние IDEMPOTENCY_TTL секунд.
+    Иначе запоминает ключ и возвращает True.
+    """
+    now = time.monotonic()
+    while _seen_keys:
+        seen_at = next(iter(_seen_keys.values()))
+        if now - seen_at < IDEMPOTENCY_TTL and len(_seen_keys) < IDEMPOTENCY_MAX_KEYS:
+            break
+        _seen_keys.popitem(last=False)
+
+    if key in _seen_keys:
+        return False
+    _seen_keys[key] = now
+    return True
+
+
+def release_idempotency_key(key: str) -> None:
+    """Обработка упала до записи — разрешаем повтор с тем же ключом."""
+    _seen_keys.pop(key, None)
+
+
+# Категории не переименовываются и не удаляются, поэтому кэш без TTL
+_category_cache: Dict[tuple, Dict[str, Any]] = {}
+CATEGORY_CACHE_MAX = 50000
 
 
 async def get_or_create_category(user_id: int, name: str) -> Dict[str, Any]:
     lower_name = name.lower()
+    cached = _category_cache.get((user_id, lower_name))
+    if cached is not None:
+        return cached
+
     category = await fetch_one(
-        '''
-        SELECT * FROM categories
-        WHERE user_id = :user_id AND lower(name) = :name
-        ''',
+        GET_CATEGORY,
         {"user_id": user_id, "name": lower_name},
     )
-    if category:
-        return category
-
-    category = await fetch_one_returning(
-        '''
-        INSERT INTO categories (user_id, name, slug, is_system)
-        VALUES (:user_id, :name, :slug, FALSE)
-        RETURNING *
-        ''',
-        {"user_id": user_id, "name": lower_name, "slug": lower_name},
-    )
+    if not category:
+        category = await fetch_one_returning(
+            INSERT_CATEGORY,
+            {"user_id": user_id, "name": lower_name, "slug": lower_name},
+        )
+
+    if len(_category_cache) >= CATEGORY_CACHE_MAX:
+        _category_cache.clear()
+    _category_cache[(user_id, lower_name)] = category
     return category
 
 
@@ -30,71 +199,173 @@ async def create_expense(
     user_id: int,
     project_id: int,
     category_id: Optional[int],
-    amount_original: float,
-    currency_original: str,
-    amount_rub: float,
+    amount: Money,
+    amount_rub: Money,
     description: str,
-) -> Dict[str, Any]:
+    idempotency_key: Optional[str] = None,
+    parse_source: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Записывает трату (amount — в валюте траты, amount_rub — в рублях).
+    parse_source — как разобран текст: 'text' или 'gpt' (для /stats).
+    Если трата с таким idempotency_key уже есть, ничего не вставляет и
+    возвращает None.
+    """
     exp = await fetch_one_returning(
-        '''
-        INSERT INTO expenses
-        (user_id, project_id, category_id, amount_original, currency_original, amount_rub, description)
-        VALUES
-        (:user_id, :project_id, :category_id, :amount_original, :currency_original, :amount_rub, :description)
-        RETURNING *
-        ''',
+        INSERT_EXPENSE,
         {
             "user_id": user_id,
             "project_id": project_id,
             "category_id": category_id,
-            "amount_original": amount_original,
-            "currency_original": currency_original,
-            "amount_rub": amount_rub,
+            "amount_original_minor": amount.minor,
+            "currency_original": amount.currency,
+            "amount_rub_minor": amount_rub.minor,
             "description": description,
+            "idempotency_key": idempotency_key,
+            "parse_source": parse_source,
         },
     )
     return exp
 
 
-async def get_project_totals(project_id: int) -> Dict[str, Any]:
-    rows_by_curr = await fetch_all(
-        '''
-        SELECT currency_original, SUM(amount_original) AS total
-        FROM expenses
-        WHERE project_id = :project_id
-        GROUP BY currency_original
-        ''',
+async def get_project_totals(project_id: int, primary: bool = False) -> Dict[str, Any]:
+    """
+    Итоги по проекту: {"by_currency": {code: Money}, "total_rub": Money}.
+    primary=True — читать с основной БД (например, сразу после
+    create_expense, когда реплика может ещё не увидеть новую трату).
+    """
+    rows = await fetch_all(
+        PROJECT_TOTALS_BY_CURRENCY,
         {"project_id": project_id},
+        primary=primary,
     )
 
-    by_currency = {row["currency_original"]: float(row["total"]) for row in rows_by_curr}
+    return {
+        "by_currency": {
+            row["currency_original"]: Money(int(row["total_minor"]), row["currency_original"])
+            for row in rows
+        },
+        "total_rub": Money(sum(int(row["total_rub_minor"]) for row in rows), "RUB"),
+    }
+
+
+def _pivot(rows: List[Dict[str, Any]], key: str, currencies: List[str]):
+    """
+    Строки (key, currency_original, total_minor, total_rub_minor) -> список
+    ключей и две int64-матрицы «ключ × валюта» в минорных единицах: в
+    исходных валютах и в RUB.
+    """
+    np = cross_rates.numpy_module()
+    keys: List[Any] = []
+    positions: Dict[Any, int] = {}
+    for row in rows:
+        if row[key] not in positions:
+            positions[row[key]] = len(keys)
+            keys.append(row[key])
+
+    col = {code: j for j, code in enumerate(currencies)}
+    amounts = np.zeros((len(keys), len(currencies)), dtype=np.int64)
+    amounts_rub = np.zeros_like(amounts)
+    for row in rows:
+        i, j = positions[row[key]], col[row["currency_original"]]
+        amounts[i, j] += int(row["total_minor"])
+        amounts_rub[i, j] += int(row["total_rub_minor"])
+    return keys, amounts, amounts_rub
 
-    row_total_rub = await fetch_one(
-        '''
-        SELECT SUM(amount_rub) AS total_rub
-        FROM expenses
-        WHERE project_id = :project_id
-        ''',
-        {"project_id": project_id},
-    )
 
-    total_rub = float(row_total_rub["total_rub"]) if row_total_rub and row_total_rub["total_rub"] is not None else 0.0
+async def get_project_period_report(
+    project_id: int,
+    unit: str,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    currency: str = "RUB",
+    historical: bool = True,
+) -> Dict[str, Any]:
+    """
+    Отчёт за период [date_from, date_to] (границы включительно, None — без
+    ограничения) с разбивкой по дням/неделям/месяцам (unit), в валюте
+    currency. historical=True — по курсам на момент трат, False — по текущим
+    (подробности в cross_rates.py). Все суммы — Money.
+    """
+    if unit not in BUCKET_UNITS:
+        raise ValueError(f"Unsupported bucket unit: {unit}")
+
+    params = {
+        "project_id": project_id,
+        "unit": unit,
+        "date_from": date_from,
+        "date_to": date_to,
+    }
+
+    bucket_rows = await fetch_all(PERIOD_BUCKETS_BY_CURRENCY, params)
+    category_rows = await fetch_all(PERIOD_CATEGORIES_BY_CURRENCY, params)
+
+    rates = cross_rates.current()
+    if rates is None or currency not in rates:
+        raise ValueError(f"No exchange rate for {currency}")
+
+    currencies = sorted({row["currency_original"] for row in bucket_rows})
+    buckets, bucket_amounts, bucket_amounts_rub = _pivot(bucket_rows, "bucket", currencies)
+    categories, cat_amounts, cat_amounts_rub = _pivot(category_rows, "category_name", currencies)
+
+    bucket_totals = rates.convert(bucket_amounts, bucket_amounts_rub, currencies, currency, historical)
+    cat_totals = rates.convert(cat_amounts, cat_amounts_rub, currencies, currency, historical)
+
+    counts: Dict[Any, int] = {}
+    for row in bucket_rows:
+        counts[row["bucket"]] = counts.get(row["bucket"], 0) + int(row["expense_count"])
 
     return {
-        "by_currency": by_currency,
-        "total_rub": total_rub,
+        "currency": currency,
+        "historical": historical,
+        "buckets": [
+            {"bucket": bucket, "total": Money(int(total), currency), "expense_count": counts[bucket]}
+            for bucket, total in zip(buckets, bucket_totals)
+        ],
+        "by_currency": {
+            code: Money(int(total), code)
+            for code, total in zip(currencies, bucket_amounts.sum(axis=0))
+        },
+        "categories": {name: Money(int(total), currency) for name, total in zip(categories, cat_totals)},
+        # Для графиков, которые всегда в RUB
+        "categories_in_rub": {
+            name: Money(int(total), "RUB") for name, total in zip(categories, cat_amounts_rub.sum(axis=1))
+        },
+        "total": Money(int(bucket_totals.sum()), currency),
+        "total_rub": Money(int(bucket_amounts_rub.sum()), "RUB"),
     }
 
 
-async def get_project_category_totals_rub(project_id: int) -> Dict[str, float]:
+def _like_pattern(query: str) -> str:
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+async def search_expenses(
+    project_id: int,
+    query: str,
+    before_id: Optional[int] = None,
+    limit: int = SEARCH_PAGE_SIZE,
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    Траты проекта, в описании которых встречается query (новые сначала).
+    Возвращает (траты, before_id для следующей страницы или None).
+    """
+    query = query.strip().lower()
     rows = await fetch_all(
-        '''
-        SELECT COALESCE(c.name, 'прочее') AS category_name, SUM(e.amount_rub) AS total_rub
-        FROM expenses e
-        LEFT JOIN categories c ON e.category_id = c.id
-        WHERE e.project_id = :project_id
-        GROUP BY category_name
-        ''',
-        {"project_id": project_id},
+        SEARCH_EXPENSES,
+        {
+            "project_id": project_id,
+            "pattern": _like_pattern(query),
+            "query": query,
+            "before_id": before_id,
+            "limit": limit + 1,
+        },
     )
-    return {row["category_name"]: float(row["total_rub"]) for row in rows}
+    for row in rows:
+        row["amount"] = Money(int(row.pop("amount_original_minor")), row["currency_original"])
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1]["id"]
+    return rows, None
@@ -0,0 +1,125 @@
+import asyncio
+import csv
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Tuple
+
+from .db import statement, stream_rows
+from .money import from_minor
+
+EXPORT_PROJECT_EXPENSES = statement(
+    "expenses.export_project",
+    '''
+    SELECT created_at, category_name, amount_original_minor, currency_original, amount_rub_minor, description
+    FROM (
+        -- Сжатые старые траты (см. compaction.py) — одной строкой на месяц × категорию × валюту
+        SELECT 0 AS part,
+               s.month - DATE '1970-01-01' AS sort_key,
+               s.month::timestamptz AS created_at,
+               COALESCE(c.name, 'прочее') AS category_name,
+               s.total_original_minor AS amount_original_minor,
+               s.currency_original,
+               s.total_rub_minor AS amount_rub_minor,
+               'Итог за месяц, трат: ' || s.expense_count AS description
+        FROM expense_monthly_summary s
+        LEFT JOIN categories c ON s.category_id = c.id
+        WHERE s.project_id = :project_id
+        UNION ALL
+        SELECT 1,
+               e.id,
+               e.created_at,
+               COALESCE(c.name, 'прочее'),
+               e.amount_original_minor,
+               e.currency_original,
+               e.amount_rub_minor,
+               e.description
+        FROM expenses e
+        LEFT JOIN categories c ON e.category_id = c.id
+        WHERE e.project_id = :project_id
+    ) t
+    ORDER BY part, sort_key
+    ''',
+    replica=True,
+)
+
+EXPORT_FORMATS = ("csv", "xlsx")
+
+EXPORT_HEADERS = ["Дата", "Категория", "Сумма", "Валюта", "Сумма в RUB", "Описание"]
+
+# Сколько строк тянуть с сервера за один раз
+EXPORT_BATCH_SIZE = 2000
+
+
+def _export_row(row: Dict[str, Any]) -> list:
+    created_at = row["created_at"]
+    if isinstance(created_at, datetime):
+        created_at = created_at.strftime("%Y-%m-%d %H:%M")
+    return [
+        created_at,
+        row["category_name"],
+        from_minor(row["amount_original_minor"], row["currency_original"]),
+        row["currency_original"],
+        from_minor(row["amount_rub_minor"], "RUB"),
+        row["description"] or "",
+    ]
+
+
+def _write_csv(project_id: int, path: str) -> int:
+    """
+    Пишет траты проекта в CSV построчно прямо из курсора.
+    utf-8-sig и ';' — чтобы файл нормально открывался в русском Excel.
+    """
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(EXPORT_HEADERS)
+        for row in stream_rows(EXPORT_PROJECT_EXPENSES, {"project_id": project_id}, EXPORT_BATCH_SIZE):
+            writer.writerow(_export_row(row))
+            count += 1
+    return count
+
+
+def _write_xlsx(project_id: int, path: str) -> int:
+    """
+    Пишет траты проекта в XLSX в write-only режиме openpyxl:
+    строки сразу уходят в файл и не копятся в памяти.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Траты")
+    ws.append(EXPORT_HEADERS)
+
+    count = 0
+    for row in stream_rows(EXPORT_PROJECT_EXPENSES, {"project_id": project_id}, EXPORT_BATCH_SIZE):
+        values = _export_row(row)
+        # Decimal из Numeric openpyxl пишет как число, но float надёжнее для Excel
+        values[2] = float(values[2])
+        values[4] = float(values[4])
+        ws.append(values)
+        count += 1
+
+    wb.save(path)
+    return count
+
+
+async def export_project_expenses(project_id: int, fmt: str = "csv") -> Tuple[str, int]:
+    """
+    Выгружает траты проекта во временный файл в рабочем потоке, чтобы не
+    блокировать event loop. Возвращает (путь к файлу, число строк).
+    Файл после отправки удаляет вызывающий.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    writer = _write_xlsx if fmt == "xlsx" else _write_csv
+
+    fd, path = tempfile.mkstemp(prefix=f"budgetbot_export_{project_id}_", suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        count = await asyncio.to_thread(writer, project_id, path)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, count
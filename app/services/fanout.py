@@ -0,0 +1,82 @@
+"""
+Уведомления участникам общего проекта о новых тратах.
+
+Писать каждому участнику по сообщению на каждую трату — это N сообщений на
+трату и спам в активной поездке. Вместо этого строки копятся по ключу
+(участник, проект), и раз в FANOUT_WINDOW секунд каждому участнику уходит
+одно сообщение со всеми тратами остальных за это окно. Отправка — через
+очередь PacedSender (sender.py), так что лимиты Telegram соблюдаются.
+"""
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+
+from app.config import settings
+from .projects import get_project_members
+from .sender import get_sender
+
+# Больше строк в одном сообщении не показываем — остальное «и ещё N»
+MAX_LINES = 15
+
+# (telegram_id участника, project_id) -> (название проекта, строки)
+_pending: Dict[Tuple[int, int], Tuple[str, List[str]]] = {}
+_flush_task: Optional[asyncio.Task] = None
+_bot: Optional[Bot] = None
+
+
+async def notify_expense(bot: Bot, project: Dict, author_user_id: int, line: str) -> int:
+    """
+    Поставить строку о трате в ближайшую сводку всем участникам проекта,
+    кроме автора. Возвращает число адресатов (0 — проект не общий).
+    """
+    global _bot, _flush_task
+
+    members = await get_project_members(project["id"])
+    recipients = [m["telegram_id"] for m in members if m["user_id"] != author_user_id]
+    if not recipients:
+        return 0
+
+    for telegram_id in recipients:
+        key = (telegram_id, project["id"])
+        _pending.setdefault(key, (project["name"], []))[1].append(line)
+
+    _bot = bot
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_later(settings.fanout_window))
+    return len(recipients)
+
+
+def _render(project_name: str, lines: List[str]) -> str:
+    text = [f"Новые траты в проекте <b>«{project_name}»</b>:"]
+    text.extend(f"• {line}" for line in lines[:MAX_LINES])
+    if len(lines) > MAX_LINES:
+        text.append(f"…и ещё {len(lines) - MAX_LINES}")
+    return "\n".join(text)
+
+
+def flush() -> int:
+    """Отдать все накопленные сводки в очередь отправки. Возвращает число сообщений."""
+    if not _pending or _bot is None:
+        return 0
+
+    batch = dict(_pending)
+    _pending.clear()
+    sender = get_sender(_bot)
+    for (telegram_id, _project_id), (project_name, lines) in batch.items():
+        sender.enqueue(telegram_id, _render(project_name, lines))
+    return len(batch)
+
+
+async def _flush_later(delay: float) -> None:
+    await asyncio.sleep(delay)
+    sent = flush()
+    if sent:
+        print(f"[fanout] queued {sent} digest messages")
+
+
+def shutdown() -> None:
+    """При остановке: не ждать окна, сразу отдать всё в очередь отправки."""
+    if _flush_task is not None and not _flush_task.done():
+        _flush_task.cancel()
+    flush()
@@ -2,11 +2,21 @@ import asyncio
 import json
 from typing import Optional, Dict, Any
 
-import openai
-
 from app.config import settings
+from .tracing import span
+
+_openai = None
+
+
+def _get_openai():
+    """SDK OpenAI тяжёлый, поэтому грузим его при первом GPT-вызове, а не при импорте."""
+    global _openai
+    if _openai is None:
+        import openai
 
-openai.api_key = settings.openai_api_key
+        openai.api_key = settings.openai_api_key
+        _openai = openai
+    return _openai
 
 PARSE_SYSTEM_PROMPT = (
     "Ты — парсер финансовых расходов для Telegram-бота. "
@@ -49,7 +59,8 @@ async def gpt_parse_expense(text: str) -> Optional[Dict[str, Any]]:
     loop = asyncio.get_running_loop()
 
     def _call():
-        resp = openai.ChatCompletion.create(
+        # Импорт SDK (при первом вызове) тоже происходит здесь, в рабочем потоке
+        resp = _get_openai().ChatCompletion.create(
             model=settings.openai_model,
             messages=[
                 {"role": "system", "content": PARSE_SYSTEM_PROMPT},
@@ -58,7 +69,8 @@ async def gpt_parse_expense(text: str) -> Optional[Dict[str, Any]]:
         )
         return resp["choices"][0]["message"]["content"]
 
-    content = await loop.run_in_executor(None, _call)
+    with span("gpt parse_expense", **{"gpt.model": settings.openai_model}):
+        content = await loop.run_in_executor(None, _call)
 
     try:
         data = json.loads(content)
@@ -74,7 +86,7 @@ async def gpt_summarize_report(structured: Dict[str, Any]) -> Optional[str]:
     loop = asyncio.get_running_loop()
 
     def _call():
-        resp = openai.ChatCompletion.create(
+        resp = _get_openai().ChatCompletion.create(
             model=settings.openai_model,
             messages=[
                 {
@@ -92,5 +104,6 @@ async def gpt_summarize_report(structured: Dict[str, Any]) -> Optional[str]:
         )
         return resp["choices"][0]["message"]["content"]
 
-    content = await loop.run_in_executor(None, _call)
+    with span("gpt summarize_report", **{"gpt.model": settings.openai_model}):
+        content = await loop.run_in_executor(None, _call)
     return content.strip()
@@ -0,0 +1,100 @@
+"""
+Деньги в целых минорных единицах валюты (копейки, центы, иены).
+
+Суммы хранятся в БД как BIGINT минорных единиц (expenses.amount_original_minor,
+amount_rub_minor и т.д.), поэтому SUM в Postgres и сложение в Python точные и
+целочисленные. Число знаков после запятой зависит от валюты (ISO 4217): у
+JPY и KRW их нет, у KWD и BHD — три, у остальных — два.
+
+Money — неизменяемая пара (minor, currency). Из Decimal/строки/float в неё
+переводим на входе (парсер, курсы), обратно в Decimal — только для вывода.
+"""
+from dataclasses import dataclass
+from decimal import ROUND_HALF_EVEN, ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Union
+
+# Валюты, у которых число минорных знаков не 2
+CURRENCY_EXPONENTS = {
+    **dict.fromkeys(
+        ("BIF", "CLP", "DJF", "GNF", "ISK", "JPY", "KMF", "KRW", "PYG", "RWF", "UGX", "UYI", "VND", "VUV",
+         "XAF", "XOF", "XPF"),
+        0,
+    ),
+    **dict.fromkeys(("BHD", "IQD", "JOD", "KWD", "LYD", "OMR", "TND"), 3),
+    "CLF": 4,
+}
+DEFAULT_EXPONENT = 2
+
+# Колонки *_minor — BIGINT
+MAX_MINOR = 2 ** 63 - 1
+
+Number = Union[Decimal, int, float, str]
+
+
+def exponent(currency: str) -> int:
+    return CURRENCY_EXPONENTS.get(currency, DEFAULT_EXPONENT)
+
+
+def _checked(value: Decimal) -> int:
+    """NaN, бесконечность и суммы больше BIGINT — InvalidOperation, как и любое нечисло."""
+    if not value.is_finite() or abs(value) > MAX_MINOR:
+        raise InvalidOperation(f"amount out of range: {value}")
+    return int(value)
+
+
+def to_minor(amount: Number, currency: str) -> int:
+    """Сумма в основных единицах -> целые минорные единицы (округление до ближайшего)."""
+    value = amount if isinstance(amount, Decimal) else Decimal(str(amount))
+    return _checked(value.scaleb(exponent(currency)).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(minor: int, currency: str) -> Decimal:
+    return Decimal(int(minor)).scaleb(-exponent(currency))
+
+
+def format_minor(minor: int, currency: str) -> str:
+    """Для сообщений: без лишних нулей, '1500', '12.5', '0.99'."""
+    text = f"{from_minor(minor, currency):f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return text
+
+
+@dataclass(frozen=True)
+class Money:
+    __slots__ = ("minor", "currency")
+
+    minor: int
+    currency: str
+
+    @classmethod
+    def of(cls, amount: Number, currency: str) -> "Money":
+        return cls(to_minor(amount, currency), currency)
+
+    @classmethod
+    def zero(cls, currency: str) -> "Money":
+        return cls(0, currency)
+
+    def __add__(self, other: "Money") -> "Money":
+        if other.currency != self.currency:
+            raise ValueError(f"Can't add {other.currency} to {self.currency}")
+        return Money(self.minor + other.minor, self.currency)
+
+    def __bool__(self) -> bool:
+        return self.minor != 0
+
+    def to_decimal(self) -> Decimal:
+        return from_minor(self.minor, self.currency)
+
+    def convert(self, rate: Number, target: str) -> "Money":
+        """
+        Перевод по курсу rate (единиц target за единицу self.currency):
+        минорные единицы умножаются на курс и сдвиг между экспонентами.
+        """
+        rate_dec = rate if isinstance(rate, Decimal) else Decimal(str(rate))
+        shift = exponent(target) - exponent(self.currency)
+        value = (Decimal(self.minor) * rate_dec).scaleb(shift)
+        return Money(_checked(value.quantize(Decimal(1), rounding=ROUND_HALF_EVEN)), target)
+
+    def format(self) -> str:
+        return format_minor(self.minor, self.currency)
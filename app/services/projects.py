@@ -1,38 +1,236 @@
-from typing import Optional, Dict, Any, List
+import secrets
+import time
+from typing import Optional, Dict, Any, List, Tuple
 
-from .db import fetch_one, fetch_all, execute, fetch_one_returning
+from .db import fetch_one, fetch_all, execute, fetch_all_returning, fetch_one_returning, statement
+
+# Активный проект читается на каждую трату; меняется он только через функции
+# ниже, которые сами сбрасывают кэш, так что TTL — лишь страховка.
+ACTIVE_PROJECT_CACHE_TTL = 300
+
+# Состав проекта нужен на каждую трату (кому слать уведомления); меняется он
+# только при вступлении/выходе/удалении, которые сбрасывают кэш.
+MEMBERS_CACHE_TTL = 300
+
+ROLE_OWNER = "owner"
+ROLE_MEMBER = "member"
+
+# Проекты пользователя — через project_members: у общего проекта у каждого
+# участника свой флаг is_active. projects.user_id — владелец.
+
+GET_ACTIVE_PROJECT = statement(
+    "projects.get_active",
+    """
+    SELECT p.*, m.role
+    FROM project_members m
+    JOIN projects p ON p.id = m.project_id
+    WHERE m.user_id = :user_id
+      AND m.is_active = TRUE
+      AND p.is_deleted = FALSE
+    """,
+)
+
+ACTIVE_PROJECTS_FOR_USERS = statement(
+    "projects.get_active_for_users",
+    """
+    SELECT p.*, m.role, m.user_id AS member_id
+    FROM project_members m
+    JOIN projects p ON p.id = m.project_id
+    WHERE m.user_id = ANY(CAST(:user_ids AS bigint[]))
+      AND m.is_active = TRUE
+      AND p.is_deleted = FALSE
+    """,
+)
+
+LIST_PROJECTS = statement(
+    "projects.list",
+    """
+    SELECT p.*, m.role
+    FROM project_members m
+    JOIN projects p ON p.id = m.project_id
+    WHERE m.user_id = :user_id
+      AND p.is_deleted = FALSE
+    ORDER BY p.id
+    """,
+    replica=True,
+)
+
+GET_USER_PROJECT = statement(
+    "projects.get_for_user",
+    """
+    SELECT p.*, m.role
+    FROM project_members m
+    JOIN projects p ON p.id = m.project_id
+    WHERE m.project_id = :id
+      AND m.user_id = :user_id
+      AND p.is_deleted = FALSE
+    """,
+)
+
+DEACTIVATE_USER_PROJECTS = statement(
+    "projects.deactivate_all",
+    """
+    UPDATE project_members
+    SET is_active = FALSE
+    WHERE user_id = :user_id
+    """,
+)
+
+ACTIVATE_PROJECT = statement(
+    "projects.activate",
+    """
+    UPDATE project_members
+    SET is_active = TRUE
+    WHERE project_id = :id
+      AND user_id = :user_id
+    """,
+)
+
+INSERT_PROJECT = statement(
+    "projects.insert",
+    """
+    WITH p AS (
+        INSERT INTO projects (user_id, name, base_currency, is_deleted)
+        VALUES (:user_id, :name, :base_currency, FALSE)
+        RETURNING *
+    ),
+    m AS (
+        INSERT INTO project_members (project_id, user_id, role, is_active)
+        SELECT id, user_id, 'owner', TRUE FROM p
+    )
+    SELECT p.*, 'owner' AS role FROM p
+    """,
+)
+
+SOFT_DELETE_PROJECT = statement(
+    "projects.soft_delete",
+    """
+    UPDATE projects
+    SET is_deleted = TRUE
+    WHERE id = :id
+    """,
+)
+
+DEACTIVATE_PROJECT_MEMBERS = statement(
+    "projects.deactivate_members",
+    """
+    UPDATE project_members
+    SET is_active = FALSE
+    WHERE project_id = :id
+    RETURNING user_id
+    """,
+)
+
+DELETE_MEMBER = statement(
+    "projects.delete_member",
+    """
+    DELETE FROM project_members
+    WHERE project_id = :id
+      AND user_id = :user_id
+    """,
+)
+
+SET_INVITE_CODE = statement(
+    "projects.set_invite_code",
+    """
+    UPDATE projects
+    SET invite_code = COALESCE(invite_code, :code)
+    WHERE id = :id
+    RETURNING invite_code
+    """,
+)
+
+GET_PROJECT_BY_INVITE = statement(
+    "projects.get_by_invite",
+    """
+    SELECT *
+    FROM projects
+    WHERE invite_code = :code
+      AND is_deleted = FALSE
+    """,
+)
+
+INSERT_MEMBER = statement(
+    "projects.insert_member",
+    """
+    INSERT INTO project_members (project_id, user_id, role, is_active)
+    VALUES (:id, :user_id, 'member', FALSE)
+    ON CONFLICT (project_id, user_id) DO NOTHING
+    """,
+)
+
+LIST_MEMBERS = statement(
+    "projects.list_members",
+    """
+    SELECT m.user_id, m.role, u.telegram_id, u.first_name, u.username
+    FROM project_members m
+    JOIN users u ON u.id = m.user_id
+    WHERE m.project_id = :id
+    ORDER BY m.joined_at
+    """,
+)
+
+# user_id -> (активный проект или None, время загрузки)
+_active_cache: Dict[int, Tuple[Optional[Dict[str, Any]], float]] = {}
+
+# project_id -> (участники, время загрузки)
+_members_cache: Dict[int, Tuple[List[Dict[str, Any]], float]] = {}
+
+
+def _invalidate_active(user_id: int) -> None:
+    _active_cache.pop(user_id, None)
+
+
+def _invalidate_members(project_id: int) -> None:
+    _members_cache.pop(project_id, None)
 
 
 async def get_active_project(user_id: int) -> Optional[Dict[str, Any]]:
     """
     Получить текущий активный проект пользователя (или None, если его нет).
     """
-    return await fetch_one(
-        """
-        SELECT *
-        FROM projects
-        WHERE user_id = :user_id
-          AND is_deleted = FALSE
-          AND is_active = TRUE
-        """,
-        {"user_id": user_id},
-    )
+    cached = _active_cache.get(user_id)
+    if cached and time.monotonic() - cached[1] < ACTIVE_PROJECT_CACHE_TTL:
+        return cached[0]
+
+    project = await fetch_one(GET_ACTIVE_PROJECT, {"user_id": user_id})
+    _active_cache[user_id] = (project, time.monotonic())
+    return project
+
+
+async def prefetch_active_projects(user_ids: List[int]) -> int:
+    """Загрузить в кэш активные проекты сразу для многих пользователей (прогрев)."""
+    if not user_ids:
+        return 0
+
+    rows = await fetch_all(ACTIVE_PROJECTS_FOR_USERS, {"user_ids": user_ids})
+    now = time.monotonic()
+    by_user = {row.pop("member_id"): row for row in rows}
+    for user_id in user_ids:
+        _active_cache[user_id] = (by_user.get(user_id), now)
+    return len(rows)
 
 
 async def get_projects(user_id: int) -> List[Dict[str, Any]]:
     """
-    Получить список всех НЕ удалённых проектов пользователя.
-    """
-    return await fetch_all(
-        """
-        SELECT *
-        FROM projects
-        WHERE user_id = :user_id
-          AND is_deleted = FALSE
-        ORDER BY id
-        """,
-        {"user_id": user_id},
-    )
+    Получить список всех НЕ удалённых проектов пользователя (свои и общие).
+    """
+    return await fetch_all(LIST_PROJECTS, {"user_id": user_id})
+
+
+async def get_project_members(project_id: int) -> List[Dict[str, Any]]:
+    """Участники проекта (user_id, role, telegram_id, имя), из кэша."""
+    cached = _members_cache.get(project_id)
+    if cached and time.monotonic() - cached[1] < MEMBERS_CACHE_TTL:
+        return cached[0]
+
+    members = await fetch_all(LIST_MEMBERS, {"id": project_id})
+    _members_cache[project_id] = (members, time.monotonic())
+    return members
+
+
+async def is_member(project_id: int, user_id: int) -> bool:
+    return any(m["user_id"] == user_id for m in await get_project_members(project_id))
 
 
 async def create_project(user_id: int, name: str, base_currency: str) -> Dict[str, Any]:
@@ -41,28 +239,18 @@ async def create_project(user_id: int, name: str, base_currency: str) -> Dict[st
     Все остальные проекты пользователя становятся неактивными.
     """
     # Сбрасываем активность у всех проектов пользователя
-    await execute(
-        """
-        UPDATE projects
-        SET is_active = FALSE
-        WHERE user_id = :user_id
-        """,
-        {"user_id": user_id},
-    )
+    await execute(DEACTIVATE_USER_PROJECTS, {"user_id": user_id})
 
-    # Создаём новый проект и сразу делаем его активным
+    # Создаём новый проект (и запись владельца) и сразу делаем его активным
     project = await fetch_one_returning(
-        """
-        INSERT INTO projects (user_id, name, base_currency, is_active, is_deleted)
-        VALUES (:user_id, :name, :base_currency, TRUE, FALSE)
-        RETURNING *
-        """,
+        INSERT_PROJECT,
         {
             "user_id": user_id,
             "name": name,
             "base_currency": base_currency,
         },
     )
+    _active_cache[user_id] = (project, time.monotonic())
     return project
 
 
@@ -71,69 +259,65 @@ async def set_active_project(user_id: int, project_id: int) -> Optional[Dict[str
     Сделать выбранный проект активным.
     Возвращает проект, если всё ок, или None, если проект не найден / чужой / удалён.
     """
-    project = await fetch_one(
-        """
-        SELECT *
-        FROM projects
-        WHERE id = :id
-          AND user_id = :user_id
-          AND is_deleted = FALSE
-        """,
-        {"id": project_id, "user_id": user_id},
-    )
+    project = await fetch_one(GET_USER_PROJECT, {"id": project_id, "user_id": user_id})
     if not project:
         return None
 
     # Сбрасываем активность у всех проектов пользователя
-    await execute(
-        """
-        UPDATE projects
-        SET is_active = FALSE
-        WHERE user_id = :user_id
-        """,
-        {"user_id": user_id},
-    )
+    await execute(DEACTIVATE_USER_PROJECTS, {"user_id": user_id})
 
     # Делаем активным только выбранный проект
-    await execute(
-        """
-        UPDATE projects
-        SET is_active = TRUE
-        WHERE id = :id
-        """,
-        {"id": project_id},
-    )
+    await execute(ACTIVATE_PROJECT, {"id": project_id, "user_id": user_id})
 
+    _invalidate_active(user_id)
     return await get_active_project(user_id)
 
 
-async def delete_project(user_id: int, project_id: int) -> bool:
+async def delete_project(user_id: int, project_id: int) -> Optional[Dict[str, Any]]:
     """
-    Помечает проект как удалённый (soft delete) и снимает с него флаг is_active.
-    Ничего физически не удаляем из БД, просто is_deleted = TRUE.
-    Возвращает True, если проект реально существовал и был помечен как удалённый.
+    Владелец помечает проект как удалённый (soft delete) — у всех участников
+    он перестаёт быть активным. Участник, который не владелец, просто выходит
+    из проекта. Возвращает проект (с role пользователя) или None, если проект
+    не найден / чужой / уже удалён.
     """
-    project = await fetch_one(
-        """
-        SELECT *
-        FROM projects
-        WHERE id = :id
-          AND user_id = :user_id
-          AND is_deleted = FALSE
-        """,
-        {"id": project_id, "user_id": user_id},
-    )
+    project = await fetch_one(GET_USER_PROJECT, {"id": project_id, "user_id": user_id})
     if not project:
-        return False
-
-    await execute(
-        """
-        UPDATE projects
-        SET is_deleted = TRUE,
-            is_active  = FALSE
-        WHERE id = :id
-        """,
-        {"id": project_id},
+        return None
+
+    if project["role"] == ROLE_OWNER:
+        await execute(SOFT_DELETE_PROJECT, {"id": project_id})
+        deactivated = await fetch_all_returning(DEACTIVATE_PROJECT_MEMBERS, {"id": project_id})
+        for row in deactivated:
+            _invalidate_active(row["user_id"])
+    else:
+        await execute(DELETE_MEMBER, {"id": project_id, "user_id": user_id})
+
+    _invalidate_active(user_id)
+    _invalidate_members(project_id)
+    return project
+
+
+async def get_invite_code(user_id: int, project_id: int) -> Optional[str]:
+    """Код приглашения в проект (создаётся при первом запросе). None — не участник."""
+    if not await is_member(project_id, user_id):
+        return None
+
+    row = await fetch_one_returning(
+        SET_INVITE_CODE,
+        {"id": project_id, "code": secrets.token_urlsafe(12)},
     )
+    return row["invite_code"] if row else None
+
+
+async def join_project(user_id: int, code: str) -> Optional[Dict[str, Any]]:
+    """
+    Вступить в проект по коду приглашения и сделать его активным.
+    None — код неверный или проект удалён.
+    """
+    project = await fetch_one(GET_PROJECT_BY_INVITE, {"code": code})
+    if not project:
+        return None
 
-    return True
+    await execute(INSERT_MEMBER, {"id": project["id"], "user_id": user_id})
+    _invalidate_members(project["id"])
+    return await set_active_project(user_id, project["id"])
@@ -0,0 +1,103 @@
+"""
+Отправка сообщений с соблюдением лимитов Telegram.
+
+Бот может слать примерно 30 сообщений в секунду суммарно, поэтому массовые
+рассылки (дайджесты, уведомления) идут через PacedSender: он выдерживает
+интервал между отправками, ждёт при RetryAfter и не ретраит пользователей,
+которые заблокировали бота. Сообщения можно как отправлять сразу (send),
+так и складывать в очередь (enqueue), которую разбирает фоновая задача.
+"""
+import asyncio
+import time
+from typing import Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from app.config import settings
+
+# Сколько раз повторять отправку после RetryAfter
+MAX_RETRIES = 3
+
+
+class PacedSender:
+    def __init__(self, bot: Bot, rate: float):
+        self.bot = bot
+        self.min_interval = 1.0 / rate if rate > 0 else 0.0
+        self.sent = 0
+        self.failed = 0
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+        self._queue: "asyncio.Queue[Tuple[int, str]]" = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    async def _wait_turn(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            if self._next_at > now:
+                await asyncio.sleep(self._next_at - now)
+                now = self._next_at
+            self._next_at = now + self.min_interval
+
+    async def send(self, chat_id: int, text: str) -> bool:
+        """Отправить сообщение с учётом темпа. True — доставлено."""
+        for _ in range(MAX_RETRIES):
+            await self._wait_turn()
+            try:
+                await self.bot.send_message(chat_id, text)
+                self.sent += 1
+                return True
+            except TelegramRetryAfter as e:
+                print(f"[sender] flood control, sleeping {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Бот заблокирован / чат не найден — повторять бессмысленно
+                print(f"[sender] can't deliver to {chat_id}: {e}")
+                break
+
+        self.failed += 1
+        return False
+
+    def enqueue(self, chat_id: int, text: str) -> None:
+        """Поставить сообщение в очередь фоновой отправки."""
+        self._queue.put_nowait((chat_id, text))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._drain())
+
+    async def _drain(self) -> None:
+        while True:
+            chat_id, text = await self._queue.get()
+            try:
+                await self.send(chat_id, text)
+            except Exception as e:
+                print(f"[sender] unexpected error sending to {chat_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def flush(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться отправки всего из очереди. False — не успели за timeout."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+
+_sender: Optional[PacedSender] = None
+
+
+def get_sender(bot: Bot) -> PacedSender:
+    """Общий на процесс отправщик: лимит Telegram один на бота."""
+    global _sender
+    if _sender is None:
+        _sender = PacedSender(bot, settings.telegram_rate_limit)
+    return _sender
@@ -0,0 +1,104 @@
+"""
+Статистика по всему боту для /stats (только для ADMIN_IDS).
+
+Агрегаты по всем expenses и users на основной БД мешали бы живым
+пользователям, поэтому они посчитаны в материализованных представлениях
+(миграция 0011) и обновляются фоновой задачей раз в STATS_REFRESH_MINUTES
+через REFRESH MATERIALIZED VIEW CONCURRENTLY — читатели при этом не
+блокируются. /stats читает только готовые представления (с реплики).
+Без ADMIN_IDS читать их некому, и обновление не запускается.
+
+Представления считают только expenses за последние 30 дней. Сжатие
+(COMPACTION_AFTER_DAYS, см. compaction.py) переносит старые траты в
+помесячные итоги без пользователей и дней, поэтому при COMPACTION_AFTER_DAYS
+меньше 30 статистика за окно занижена: сжатые траты в неё не попадают.
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from .db import execute, fetch_all, fetch_one, statement
+
+STATS_VIEWS = ("stats_daily", "stats_currencies", "stats_totals")
+
+# Окно представлений из миграции 0011
+STATS_WINDOW_DAYS = 30
+
+REFRESH_STATEMENTS = {
+    view: statement(f"stats.refresh_{view}", f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+    for view in STATS_VIEWS
+}
+
+STATS_TOTALS = statement(
+    "stats.totals",
+    "SELECT * FROM stats_totals",
+    replica=True,
+)
+
+STATS_DAILY = statement(
+    "stats.daily",
+    '''
+    SELECT day, expenses, active_users, parsed, gpt
+    FROM stats_daily
+    ORDER BY day DESC
+    LIMIT :days
+    ''',
+    replica=True,
+)
+
+STATS_TOP_CURRENCIES = statement(
+    "stats.top_currencies",
+    '''
+    SELECT currency_original, expenses, total_rub_minor
+    FROM stats_currencies
+    ORDER BY expenses DESC
+    LIMIT :limit
+    ''',
+    replica=True,
+)
+
+
+async def refresh() -> None:
+    for view in STATS_VIEWS:
+        t0 = time.perf_counter()
+        await execute(REFRESH_STATEMENTS[view])
+        print(f"[stats] refreshed {view} in {time.perf_counter() - t0:.2f}s")
+
+
+async def get_stats(days: int = 14, top_currencies: int = 5) -> Dict[str, Any]:
+    totals = await fetch_one(STATS_TOTALS)
+    daily = await fetch_all(STATS_DAILY, {"days": days})
+    currencies = await fetch_all(STATS_TOP_CURRENCIES, {"limit": top_currencies})
+
+    parsed = sum(int(r["parsed"]) for r in daily)
+    gpt = sum(int(r["gpt"]) for r in daily)
+    return {
+        "totals": totals,
+        "daily": daily,
+        "currencies": currencies,
+        "gpt_rate": gpt / parsed if parsed else None,
+    }
+
+
+async def run_scheduler() -> None:
+    """Фоновая задача в процессе бота: обновление сразу при старте и дальше по интервалу."""
+    while True:
+        try:
+            await refresh()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[stats] refresh failed: {e}")
+        await asyncio.sleep(settings.stats_refresh_minutes * 60)
+
+
+def start() -> Optional[asyncio.Task]:
+    if settings.stats_refresh_minutes <= 0 or not settings.admin_ids:
+        return None
+    if 0 < settings.compaction_after_days < STATS_WINDOW_DAYS:
+        print(
+            f"[stats] COMPACTION_AFTER_DAYS={settings.compaction_after_days} is shorter than the "
+            f"{STATS_WINDOW_DAYS}-day stats window: compacted expenses are not counted"
+        )
+    return asyncio.create_task(run_scheduler(), name="stats-refresh")
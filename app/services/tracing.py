@@ -0,0 +1,311 @@
+"""
+Трассировка обработки апдейтов в формате, совместимом с OpenTelemetry.
+
+На каждый апдейт открывается корневой спан (TracingMiddleware), внутри него —
+дочерние спаны на запросы к БД, вызовы GPT, получение курсов и запросы к
+Telegram API. Контекст передаётся через contextvars, поэтому спаны корректно
+вкладываются и в asyncio-задачах, и в потоках asyncio.to_thread.
+
+Готовые трейсы копятся в буфере и периодически выгружаются в JSON-файл
+(по строке OTLP/JSON на пачку) или в OTLP/HTTP-коллектор. Апдейты дольше
+settings.trace_slow_ms целиком сохраняются в отдельный файл медленных трейсов.
+"""
+import asyncio
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from aiogram.types import TelegramObject
+
+from app.config import settings
+
+SERVICE_NAME = "budgetbot"
+
+# Как часто выгружать накопленные трейсы (секунды) и максимум трейсов в буфере
+EXPORT_INTERVAL = 5.0
+MAX_BUFFERED_TRACES = 5000
+
+
+@dataclass
+class Span:
+    trace: "Trace"
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    start_ns: int
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    spans: List[Span] = field(default_factory=list)
+    # Корневой спан закрыт, трейс ушёл в буфер экспорта
+    finished: bool = False
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+_buffer: List[Trace] = []
+_slow_buffer: List[Trace] = []
+_export_task: Optional[asyncio.Task] = None
+
+
+def _new_id(n_bytes: int) -> str:
+    return os.urandom(n_bytes).hex()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Дочерний спан текущего трейса. Вне трейса (трассировка выключена или
+    код вызван не из апдейта) ничего не делает и отдаёт None.
+
+    Фоновые задачи, запущенные из хендлера (очередь отправки, fanout,
+    обновление курсов), копируют контекст апдейта и видят его корневой спан
+    и после того, как апдейт обработан. Такой трейс уже выгружен — спаны в
+    него не пишем, иначе они пропадут, а долгоживущие задачи будут без конца
+    раздувать его список спанов.
+    """
+    parent = _current_span.get()
+    if parent is None or parent.trace.finished:
+        yield None
+        return
+
+    s = Span(
+        trace=parent.trace,
+        span_id=_new_id(8),
+        parent_id=parent.span_id,
+        name=name,
+        start_ns=time.time_ns(),
+        attributes=attributes,
+    )
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        _current_span.reset(token)
+        # list.append атомарен, спаны из рабочих потоков можно добавлять без блокировки
+        if not s.trace.finished:
+            s.trace.spans.append(s)
+
+
+def _start_root(name: str, attributes: Dict[str, Any]) -> Span:
+    trace = Trace(trace_id=_new_id(16))
+    return Span(
+        trace=trace,
+        span_id=_new_id(8),
+        parent_id=None,
+        name=name,
+        start_ns=time.time_ns(),
+        attributes=attributes,
+    )
+
+
+def _finish_root(root: Span) -> None:
+    root.end_ns = time.time_ns()
+    root.trace.spans.append(root)
+    root.trace.finished = True
+
+    if settings.trace_slow_ms and root.duration_ms >= settings.trace_slow_ms:
+        _slow_buffer.append(root.trace)
+        print(f"[tracing] slow update {root.attributes.get('update.id')}: {root.duration_ms:.0f}ms")
+
+    if settings.trace_export and len(_buffer) < MAX_BUFFERED_TRACES:
+        _buffer.append(root.trace)
+
+
+class TracingMiddleware:
+    """Outer-middleware на dp.update: корневой спан на каждый апдейт."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        attributes: Dict[str, Any] = {
+            "update.id": getattr(event, "update_id", None),
+            "update.type": getattr(event, "event_type", None),
+        }
+        user = data.get("event_from_user")
+        if user is not None:
+            attributes["telegram.user_id"] = user.id
+
+        root = _start_root("update", attributes)
+        token = _current_span.set(root)
+        try:
+            return await handler(event, data)
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            _finish_root(root)
+
+
+class HandlerNameMiddleware:
+    """
+    Inner-middleware: дописывает в корневой спан имя сработавшего хендлера
+    (outer-middleware его ещё не знает).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        s = _current_span.get()
+        handler_obj = data.get("handler")
+        if s is not None and handler_obj is not None:
+            callback = handler_obj.callback
+            s.set_attribute("handler", f"{callback.__module__}.{callback.__qualname__}")
+        return await handler(event, data)
+
+
+class TelegramRequestTracer:
+    """Request-middleware сессии бота: спан на каждый вызов Telegram Bot API."""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram.{method.__api_method__}"):
+            return await make_request(bot, method)
+
+
+# --- Экспорт ------------------------------------------------------------------
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(s: Span) -> Dict[str, Any]:
+    out: Dict[str, Any] = {
+        "traceId": s.trace.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": 2 if s.parent_id is None else 1,  # SERVER для корня, INTERNAL для остальных
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": [
+            {"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items() if v is not None
+        ],
+        "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+    }
+    if s.parent_id:
+        out["parentSpanId"] = s.parent_id
+    return out
+
+
+def to_otlp(traces: List[Trace]) -> Dict[str, Any]:
+    """Пачка трейсов в формате OTLP/JSON (ExportTraceServiceRequest)."""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}],
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": SERVICE_NAME},
+                        "spans": [_otlp_span(s) for t in traces for s in t.spans],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def _append_json_line(path: str, payload: Dict[str, Any]) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(payload, ensure_ascii=False))
+        f.write("\n")
+
+
+async def _post_otlp(payload: Dict[str, Any]) -> None:
+    import httpx
+
+    async with httpx.AsyncClient() as client:
+        resp = await client.post(
+            f"{settings.trace_otlp_endpoint.rstrip('/')}/v1/traces",
+            json=payload,
+            timeout=10.0,
+        )
+        resp.raise_for_status()
+
+
+async def flush() -> None:
+    """Выгрузить накопленные трейсы (вызывается периодически и при остановке)."""
+    global _buffer, _slow_buffer
+
+    traces, _buffer = _buffer, []
+    slow, _slow_buffer = _slow_buffer, []
+
+    try:
+        if slow:
+            await asyncio.to_thread(_append_json_line, settings.trace_slow_file, to_otlp(slow))
+        if traces:
+            payload = to_otlp(traces)
+            if settings.trace_export == "otlp":
+                await _post_otlp(payload)
+            else:
+                await asyncio.to_thread(_append_json_line, settings.trace_file, payload)
+    except Exception as e:
+        print(f"[tracing] export failed, dropped {len(traces)} traces: {e}")
+
+
+async def _export_loop() -> None:
+    while True:
+        await asyncio.sleep(EXPORT_INTERVAL)
+        await flush()
+
+
+def setup(dp, bot) -> None:
+    """Подключить трассировку к диспетчеру и сессии бота (если включена)."""
+    global _export_task
+
+    if not settings.tracing_enabled:
+        return
+
+    dp.update.outer_middleware(TracingMiddleware())
+    for observer in (dp.message, dp.callback_query, dp.inline_query):
+        observer.middleware(HandlerNameMiddleware())
+    bot.session.middleware(TelegramRequestTracer())
+
+    if _export_task is None:
+        _export_task = asyncio.create_task(_export_loop(), name="trace-exporter")
+
+
+async def shutdown() -> None:
+    global _export_task
+    if _export_task is not None:
+        _export_task.cancel()
+        _export_task = None
+    await flush()
@@ -1,8 +1,53 @@
-from typing import Optional, Dict, Any
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
 
-from .db import fetch_one, fetch_one_returning
+from .db import fetch_all, fetch_one, fetch_one_returning, statement
 from app.config import settings
 
+# Записи users после создания не меняются, так что кэш можно держать долго
+USER_CACHE_TTL = 600
+
+GET_USER_BY_TELEGRAM_ID = statement(
+    "users.get_by_telegram_id",
+    "SELECT * FROM users WHERE telegram_id = :telegram_id",
+)
+
+INSERT_USER = statement(
+    "users.insert",
+    '''
+    INSERT INTO users (telegram_id, username, first_name, last_name, base_currency)
+    VALUES (:telegram_id, :username, :first_name, :last_name, :base_currency)
+    RETURNING *
+    ''',
+)
+
+RECENTLY_ACTIVE_USERS = statement(
+    "users.recently_active",
+    '''
+    SELECT u.*
+    FROM users u
+    WHERE u.id IN (
+        SELECT DISTINCT m.user_id
+        FROM expense_daily_rollup r
+        JOIN project_members m ON m.project_id = r.project_id
+        WHERE r.day >= current_date - CAST(:days AS integer)
+    )
+    ''',
+    replica=True,
+)
+
+# telegram_id -> (user, время загрузки); LRU на USER_CACHE_MAX пользователей
+_user_cache: "OrderedDict[int, Tuple[Dict[str, Any], float]]" = OrderedDict()
+USER_CACHE_MAX = 50000
+
+
+def _cache_user(user: Dict[str, Any]) -> None:
+    _user_cache[user["telegram_id"]] = (user, time.monotonic())
+    _user_cache.move_to_end(user["telegram_id"])
+    while len(_user_cache) > USER_CACHE_MAX:
+        _user_cache.popitem(last=False)
+
 
 async def get_or_create_user_by_telegram_id(
     telegram_id: int,
@@ -10,19 +55,21 @@ async def get_or_create_user_by_telegram_id(
     first_name: Optional[str],
     last_name: Optional[str],
 ) -> Dict[str, Any]:
+    cached = _user_cache.get(telegram_id)
+    if cached and time.monotonic() - cached[1] < USER_CACHE_TTL:
+        _user_cache.move_to_end(telegram_id)
+        return cached[0]
+
     user = await fetch_one(
-        "SELECT * FROM users WHERE telegram_id = :telegram_id",
+        GET_USER_BY_TELEGRAM_ID,
         {"telegram_id": telegram_id},
     )
     if user:
+        _cache_user(user)
         return user
 
     user = await fetch_one_returning(
-        '''
-        INSERT INTO users (telegram_id, username, first_name, last_name, base_currency)
-        VALUES (:telegram_id, :username, :first_name, :last_name, :base_currency)
-        RETURNING *
-        ''',
+        INSERT_USER,
         {
             "telegram_id": telegram_id,
             "username": username,
@@ -31,4 +78,16 @@ async def get_or_create_user_by_telegram_id(
             "base_currency": settings.base_currency,
         },
     )
+    _cache_user(user)
     return user
+
+
+async def prefetch_recent_users(days: int) -> List[Dict[str, Any]]:
+    """
+    Загрузить в кэш пользователей, писавших траты за последние days дней.
+    Используется при прогреве на старте.
+    """
+    users = await fetch_all(RECENTLY_ACTIVE_USERS, {"days": days})
+    for user in users:
+        _cache_user(user)
+    return users
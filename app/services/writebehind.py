@@ -0,0 +1,407 @@
+"""
+Отложенная запись трат (WRITE_BEHIND=1).
+
+Разобранная трата сначала дописывается в локальный журнал — SQLite в режиме
+WAL с synchronous=FULL, так что после ответа пользователю она переживёт
+падение процесса. Ответ строится по итогам проекта из кэша (итоги из БД плюс
+ещё не записанные траты из журнала), без запросов к Postgres.
+
+Фоновый писатель забирает записи из журнала пачками и вставляет их в
+expenses одним запросом (json_to_recordset), в той же транзакции обновляя
+бегущие суммы лимитов. Записи из журнала удаляются только после коммита;
+если процесс упадёт между коммитом и удалением, при повторе дубли отсечёт
+idempotency_key. Всё, что не успели записать, дописывается после рестарта.
+
+Если Postgres отверг пачку из-за данных (нарушение ограничения, например
+категория успела удалиться), повтор её не спасёт: такая пачка пишется по
+одной трате, а отвергнутые переносятся в failed_expenses того же журнала,
+чтобы не держать за собой все следующие траты. Недоступность БД
+(OperationalError) — по-прежнему повтор той же пачки через RETRY_DELAY.
+"""
+import asyncio
+import json
+import sqlite3
+import time
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app.config import settings
+from . import budgets
+from .db import fetch_all_returning, statement
+from .expenses import get_project_totals
+from .money import Money
+from .sender import get_sender
+
+# Сколько держать итоги проекта в кэше, прежде чем перечитать из БД
+TOTALS_TTL = 300
+
+# Пауза перед повтором, если Postgres недоступен
+RETRY_DELAY = 5.0
+
+FLUSH_EXPENSES = statement(
+    "writebehind.flush_expenses",
+    '''
+    WITH inserted AS (
+        INSERT INTO expenses
+        (user_id, project_id, category_id, amount_original_minor, currency_original, amount_rub_minor,
+         description, idempotency_key, created_at, parse_source)
+        SELECT r.user_id, r.project_id, r.category_id, r.amount_original_minor, r.currency_original,
+               r.amount_rub_minor, r.description, r.idempotency_key, r.created_at, r.parse_source
+        FROM json_to_recordset(CAST(:rows AS json)) AS r(
+            user_id bigint, project_id bigint, category_id bigint, amount_original_minor bigint,
+            currency_original text, amount_rub_minor bigint, description text, idempotency_key text,
+            created_at timestamptz, parse_source text
+        )
+        ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+        RETURNING project_id, category_id, amount_rub_minor
+    ),
+    spend AS (
+        SELECT project_id, COALESCE(category_id, 0) AS category_id, SUM(amount_rub_minor) AS total
+        FROM inserted
+        GROUP BY 1, 2
+    ),
+    bumped AS (
+        -- Бегущие суммы лимитов (см. budgets.py): проект целиком + каждая категория
+        UPDATE budget_limits b
+        SET spent_rub_minor = b.spent_rub_minor + x.total
+        FROM (
+            SELECT project_id, category_id, total FROM spend WHERE category_id <> 0
+            UNION ALL
+            SELECT project_id, 0, SUM(total) FROM spend GROUP BY project_id
+        ) x
+        WHERE b.project_id = x.project_id AND b.category_id = x.category_id
+        RETURNING b.id
+    )
+    SELECT project_id, COUNT(*) AS inserted
+    FROM inserted
+    GROUP BY project_id
+    ''',
+)
+
+
+class ExpenseJournal:
+    """Журнал ещё не записанных в Postgres трат. Методы синхронные — звать через to_thread."""
+
+    def __init__(self, path: str):
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pending_expenses (
+                id                    INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key       TEXT UNIQUE,
+                project_id            INTEGER NOT NULL,
+                currency              TEXT NOT NULL,
+                amount_original_minor INTEGER NOT NULL,
+                amount_rub_minor      INTEGER NOT NULL,
+                payload               TEXT NOT NULL
+            )
+            """
+        )
+        # Траты, которые Postgres отверг из-за данных: для ручного разбора
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS failed_expenses (
+                id              INTEGER PRIMARY KEY,
+                idempotency_key TEXT,
+                payload         TEXT NOT NULL,
+                error           TEXT NOT NULL,
+                failed_at       TEXT NOT NULL
+            )
+            """
+        )
+
+    def append(self, entry: Dict[str, Any]) -> bool:
+        """False — трата с таким idempotency_key уже в журнале."""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO pending_expenses "
+                "(idempotency_key, project_id, currency, amount_original_minor, amount_rub_minor, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    entry["idempotency_key"],
+                    entry["project_id"],
+                    entry["currency_original"],
+                    entry["amount_original_minor"],
+                    entry["amount_rub_minor"],
+                    json.dumps(entry, ensure_ascii=False),
+                ),
+            )
+            return cur.rowcount == 1
+
+    def peek(self, limit: int) -> List[Tuple[int, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, payload FROM pending_expenses ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def delete(self, ids: List[int]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM pending_expenses WHERE id = ?", [(i,) for i in ids])
+            self._conn.execute("COMMIT")
+
+    def dead_letter(self, row_id: int, error: str) -> None:
+        """Перенести запись из pending_expenses в failed_expenses."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO failed_expenses (id, idempotency_key, payload, error, failed_at) "
+                "SELECT id, idempotency_key, payload, ?, ? FROM pending_expenses WHERE id = ?",
+                (error, datetime.now(timezone.utc).isoformat(), row_id),
+            )
+            self._conn.execute("DELETE FROM pending_expenses WHERE id = ?", (row_id,))
+            self._conn.execute("COMMIT")
+
+    def pending_totals(self, project_id: int) -> Dict[str, Tuple[int, int]]:
+        """currency -> (сумма в валюте, сумма в RUB) в минорных единицах по ещё не записанным тратам проекта."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT currency, SUM(amount_original_minor), SUM(amount_rub_minor) "
+                "FROM pending_expenses WHERE project_id = ? GROUP BY currency",
+                (project_id,),
+            ).fetchall()
+        return {code: (orig, rub) for code, orig, rub in rows}
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending_expenses").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_journal: Optional[ExpenseJournal] = None
+_writer_task: Optional[asyncio.Task] = None
+_wakeup: Optional[asyncio.Event] = None
+_stopping = False
+
+# project_id -> (итоги в формате get_project_totals, когда загружены)
+_totals: Dict[int, Tuple[Dict[str, Any], float]] = {}
+
+# _cache_lock: загрузка итогов и добавление траты в журнал+кэш атомарны друг
+# относительно друга; _flush_lock: пока пачка закоммичена в Postgres, но ещё
+# не удалена из журнала, итоги не перечитываем (иначе посчитаем её дважды).
+_cache_lock: Optional[asyncio.Lock] = None
+_flush_lock: Optional[asyncio.Lock] = None
+
+
+def enabled() -> bool:
+    return settings.write_behind
+
+
+def _get_journal() -> ExpenseJournal:
+    global _journal, _cache_lock, _flush_lock, _wakeup
+    if _journal is None:
+        _journal = ExpenseJournal(settings.write_behind_journal)
+        _cache_lock = asyncio.Lock()
+        _flush_lock = asyncio.Lock()
+        _wakeup = asyncio.Event()
+    return _journal
+
+
+async def _load_totals(project_id: int) -> Dict[str, Any]:
+    journal = _get_journal()
+    async with _flush_lock:
+        totals = await get_project_totals(project_id, primary=True)
+        pending = await asyncio.to_thread(journal.pending_totals, project_id)
+
+    by_currency = dict(totals["by_currency"])
+    total_rub = totals["total_rub"]
+    for code, (orig, rub) in pending.items():
+        by_currency[code] = by_currency.get(code, Money.zero(code)) + Money(orig, code)
+        total_rub += Money(rub, "RUB")
+    return {"by_currency": by_currency, "total_rub": total_rub}
+
+
+async def _cached_totals(project_id: int) -> Dict[str, Any]:
+    cached = _totals.get(project_id)
+    if cached is not None and time.monotonic() - cached[1] < TOTALS_TTL:
+        return cached[0]
+    totals = await _load_totals(project_id)
+    _totals[project_id] = (totals, time.monotonic())
+    return totals
+
+
+async def get_totals(project_id: int) -> Dict[str, Any]:
+    """Итоги проекта с учётом ещё не записанных трат (копия, её можно менять)."""
+    _get_journal()
+    async with _cache_lock:
+        totals = await _cached_totals(project_id)
+        return {"by_currency": dict(totals["by_currency"]), "total_rub": totals["total_rub"]}
+
+
+def invalidate_totals(project_id: int) -> None:
+    """Итоги проекта поменялись в обход журнала (импорт и т.п.)."""
+    _totals.pop(project_id, None)
+
+
+async def submit(
+    user_id: int,
+    project_id: int,
+    project_name: str,
+    chat_id: int,
+    category_id: Optional[int],
+    amount: Money,
+    amount_rub: Money,
+    description: str,
+    idempotency_key: str,
+    parse_source: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Записывает трату в журнал и возвращает итоги проекта с её учётом.
+    None — трата с этим ключом уже принята.
+    """
+    journal = _get_journal()
+    entry = {
+        "user_id": user_id,
+        "project_id": project_id,
+        "project_name": project_name,
+        "chat_id": chat_id,
+        "category_id": category_id,
+        "amount_original_minor": amount.minor,
+        "currency_original": amount.currency,
+        "amount_rub_minor": amount_rub.minor,
+        "description": description,
+        "idempotency_key": idempotency_key,
+        "parse_source": parse_source,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+    async with _cache_lock:
+        totals = await _cached_totals(project_id)
+        if not await asyncio.to_thread(journal.append, entry):
+            return None
+        by_currency = totals["by_currency"]
+        by_currency[amount.currency] = by_currency.get(amount.currency, Money.zero(amount.currency)) + amount
+        totals["total_rub"] += amount_rub
+        snapshot = {"by_currency": dict(by_currency), "total_rub": totals["total_rub"]}
+
+    _wakeup.set()
+    return snapshot
+
+
+async def _send_alerts(bot: Bot, batch: List[Dict[str, Any]], project_ids: List[int]) -> None:
+    # Предупреждение уходит в чат последней траты проекта из пачки
+    last_entry = {entry["project_id"]: entry for entry in batch}
+    sender = get_sender(bot)
+    for project_id in project_ids:
+        entry = last_entry.get(project_id)
+        if entry is None:
+            continue
+        for alert in await budgets.collect_pending_alerts(project_id):
+            sender.enqueue(entry["chat_id"], budgets.format_alert(alert, entry["project_name"]))
+
+
+async def flush_batch(bot: Optional[Bot]) -> int:
+    """Записать одну пачку из журнала в Postgres. Возвращает размер пачки."""
+    journal = _get_journal()
+    pending = await asyncio.to_thread(journal.peek, settings.write_behind_batch)
+    if not pending:
+        return 0
+
+    batch = [entry for _, entry in pending]
+    async with _flush_lock:
+        try:
+            rows = await _write(batch)
+            await asyncio.to_thread(journal.delete, [row_id for row_id, _ in pending])
+        except (IntegrityError, DataError) as e:
+            print(f"[writebehind] batch of {len(batch)} rejected, writing one by one: {e.orig}")
+            rows, batch = await _write_one_by_one(journal, pending)
+
+    if bot is not None and rows:
+        await _send_alerts(bot, batch, [row["project_id"] for row in rows])
+    return len(pending)
+
+
+async def _write(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return await fetch_all_returning(FLUSH_EXPENSES, {"rows": json.dumps(entries, ensure_ascii=False)})
+
+
+async def _write_one_by_one(
+    journal: ExpenseJournal,
+    pending: List[Tuple[int, Dict[str, Any]]],
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Пачку отвергли из-за данных: пишем по одной, отвергнутые — в failed_expenses.
+    Возвращает (строки RETURNING, записанные траты).
+    """
+    rows: List[Dict[str, Any]] = []
+    written: List[Dict[str, Any]] = []
+    for row_id, entry in pending:
+        try:
+            rows.extend(await _write([entry]))
+        except (IntegrityError, DataError) as e:
+            print(f"[writebehind] expense {entry['idempotency_key']} moved to failed_expenses: {e.orig}")
+            await asyncio.to_thread(journal.dead_letter, row_id, str(e.orig))
+            # В кэше итогов эта трата уже учтена
+            invalidate_totals(entry["project_id"])
+            continue
+        await asyncio.to_thread(journal.delete, [row_id])
+        written.append(entry)
+    return rows, written
+
+
+async def _writer_loop(bot: Bot) -> None:
+    while True:
+        # Сбрасываем сигнал до чтения пачки: трата, пришедшая во время записи
+        # в Postgres, снова его выставит, и мы её не проспим
+        _wakeup.clear()
+        try:
+            flushed = await flush_batch(bot)
+        except Exception as e:
+            print(f"[writebehind] flush failed, retrying in {RETRY_DELAY:.0f}s: {e}")
+            await asyncio.sleep(RETRY_DELAY)
+            continue
+
+        # Полная пачка — в журнале, скорее всего, есть ещё; иначе ждём новых трат
+        if flushed < settings.write_behind_batch:
+            if _stopping:
+                return
+            await _wakeup.wait()
+            if not _stopping:
+                # Даём набраться пачке, а не пишем каждую трату отдельно
+                await asyncio.sleep(settings.write_behind_interval)
+
+
+def start(bot: Bot) -> Optional[asyncio.Task]:
+    """Запустить фонового писателя; он же дописывает всё, что осталось в журнале после рестарта."""
+    global _writer_task
+    if not enabled():
+        return None
+
+    left = _get_journal().count()
+    if left:
+        print(f"[writebehind] replaying {left} journaled expenses")
+    _writer_task = asyncio.create_task(_writer_loop(bot), name="expense-writer")
+    return _writer_task
+
+
+async def shutdown(timeout: float) -> None:
+    """Дописать журнал в Postgres (сколько успеем за timeout) и закрыть его."""
+    global _stopping, _writer_task, _journal
+    if _writer_task is None:
+        return
+
+    _stopping = True
+    _wakeup.set()
+    try:
+        await asyncio.wait_for(asyncio.shield(_writer_task), timeout)
+    except asyncio.TimeoutError:
+        _writer_task.cancel()
+
+    left = await asyncio.to_thread(_journal.count)
+    if left:
+        print(f"[writebehind] {left} expenses left in journal, will be written after restart")
+    _journal.close()
+    _journal = None
+    _writer_task = None
@@ -0,0 +1,158 @@
+"""
+Бенчмарк холодного старта бота.
+
+    python scripts/bench_startup.py                  # время импорта app.main и стартового хука
+    python scripts/bench_startup.py --importtime     # + самые тяжёлые модули (python -X importtime)
+    python scripts/bench_startup.py --first-update   # + реальный запуск: time-to-first-update
+
+Каждый замер — отдельный свежий интерпретатор, чтобы не мешали уже
+импортированные модули. Для --first-update нужен настоящий TELEGRAM_BOT_TOKEN
+и БД; после старта пришли боту любое сообщение.
+"""
+import argparse
+import os
+import select
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_SNIPPET = """
+import asyncio, time
+t0 = time.perf_counter()
+import app.main as m
+t1 = time.perf_counter()
+m.register_handlers()
+t2 = time.perf_counter()
+asyncio.run(m.on_startup())
+t3 = time.perf_counter()
+print(f"{t1 - t0:.6f} {t2 - t1:.6f} {t3 - t2:.6f}")
+"""
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    # Для замеров без реального бота хватит синтаксически валидного токена
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")
+    return env
+
+
+def _run(snippet: str) -> list:
+    out = subprocess.run(
+        [sys.executable, "-c", snippet],
+        cwd=ROOT,
+        env=_env(),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip().splitlines()[-1]
+    return [float(x) for x in out.split()]
+
+
+def _report(name: str, values: list) -> None:
+    print(
+        f"{name:<22} min={min(values) * 1000:8.1f} ms  "
+        f"median={statistics.median(values) * 1000:8.1f} ms  "
+        f"max={max(values) * 1000:8.1f} ms"
+    )
+
+
+def bench_import(runs: int) -> None:
+    samples = [_run(STARTUP_SNIPPET) for _ in range(runs)]
+    _report("import app.main", [s[0] for s in samples])
+    _report("register_handlers()", [s[1] for s in samples])
+    _report("on_startup()", [s[2] for s in samples])
+    _report("total", [sum(s) for s in samples])
+
+
+def bench_importtime(top: int) -> None:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main; app.main.register_handlers()"],
+        cwd=ROOT,
+        env=_env(),
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), int(cumulative_us), name.strip()))
+
+    print(f"\nTop {top} modules by self import time:")
+    for self_us, cumulative_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {self_us / 1000:8.1f} ms (cumulative {cumulative_us / 1000:8.1f} ms)  {name}")
+
+
+def _read_lines(proc: subprocess.Popen, deadline: float):
+    """
+    Строки вывода процесса до deadline (perf_counter). Ждём через select():
+    если бот молчит, по таймауту выходим, а не висим на чтении.
+    """
+    fd = proc.stdout.fileno()
+    buf = b""
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            return
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            return
+        *lines, buf = (buf + chunk).split(b"\n")
+        for line in lines:
+            yield line.decode(errors="replace")
+
+
+def bench_first_update(timeout: float) -> None:
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-u", "-m", "app.main"],
+        cwd=ROOT,
+        env=dict(os.environ),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    ready_at = None
+    try:
+        for line in _read_lines(proc, started + timeout):
+            now = time.perf_counter() - started
+            if "[main] startup took" in line and ready_at is None:
+                ready_at = now
+                print(f"\nready to poll after    {ready_at * 1000:8.1f} ms — пришли боту сообщение")
+            elif "[main] first update after" in line:
+                print(f"first update after     {now * 1000:8.1f} ms (с момента запуска процесса)")
+                return
+        if proc.poll() is not None:
+            print(f"bot exited with code {proc.returncode} before the first update")
+        else:
+            print("timeout waiting for the first update")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="сколько раз повторить замер импорта")
+    parser.add_argument("--importtime", action="store_true", help="показать самые тяжёлые модули")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--first-update", action="store_true", help="запустить бота и дождаться первого апдейта")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    bench_import(args.runs)
+    if args.importtime:
+        bench_importtime(args.top)
+    if args.first_update:
+        bench_first_update(args.timeout)
+
+
+if __name__ == "__main__":
+    main()
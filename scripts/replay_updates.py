@@ -0,0 +1,255 @@
+"""
+Прогон записанного трафика (RECORD_UPDATES, см. app/recorder.py) через Dispatcher.
+
+    python scripts/replay_updates.py updates.jsonl.gz                 # в реальном темпе (1×)
+    python scripts/replay_updates.py updates.jsonl.gz --speed 10      # в 10 раз быстрее
+    python scripts/replay_updates.py updates.jsonl.gz --speed max     # без пауз
+
+Апдейты проходят через настоящие хендлеры и настоящую БД (DATABASE_URL —
+укажи локальную копию!), а внешние сервисы подменяются заглушками:
+Telegram Bot API (ответы не уходят, задержка --tg-latency), GPT (простой
+парсер с задержкой --gpt-latency) и API курсов валют (фиксированные курсы).
+В конце — пропускная способность, распределение задержек обработки по типам
+апдейтов и самые тяжёлые запросы к БД.
+"""
+import argparse
+import asyncio
+import gzip
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:replay")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import TelegramMethod  # noqa: E402
+from aiogram.types import Chat, File, Message, Update  # noqa: E402
+
+# Курсы для заглушки API: RUB за 1 единицу валюты
+STUB_RATES = {"RUB": 1.0, "USD": 92.0, "EUR": 99.0, "CNY": 12.7, "JPY": 0.61, "GBP": 116.0}
+
+
+class StubSession(BaseSession):
+    """Сессия бота, которая никуда не ходит и отвечает правдоподобными объектами."""
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.calls[method.__api_method__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        returning = method.__returning__
+        if returning is Message:
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(timezone.utc),
+                chat=Chat(id=int(getattr(method, "chat_id", 0) or 0), type="private"),
+                text=getattr(method, "text", None),
+            ).as_(bot)
+        if returning is File:
+            return File(file_id="replay", file_unique_id="replay", file_path="replay/stub")
+        return True
+
+    async def stream_content(
+        self,
+        url: str,
+        headers: Optional[Dict[str, Any]] = None,
+        timeout: int = 30,
+        chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        # Содержимое файлов в журнал не пишется — отдаём пустой файл
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+class _StubChatCompletion:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def create(self, model: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        from app.services.gpt_client import PARSE_SYSTEM_PROMPT
+        from app.services.parsing import basic_parse_expense_text, detect_category
+
+        # Вызывается в рабочем потоке, как и настоящий SDK
+        time.sleep(self.latency)
+        if messages[0]["content"] == PARSE_SYSTEM_PROMPT:
+            text = messages[-1]["content"].split('"', 1)[-1].rstrip('"')
+            parsed = basic_parse_expense_text(text) or {}
+            content = json.dumps({
+                "amount": parsed.get("amount"),
+                "currency": parsed.get("currency"),
+                "category": detect_category(text),
+                "description": text,
+                "confidence": 0.5,
+            }, ensure_ascii=False)
+        else:
+            content = "Сводка для нагрузочного прогона."
+        return {"choices": [{"message": {"content": content}}]}
+
+
+class _StubOpenAI:
+    def __init__(self, latency: float):
+        self.ChatCompletion = _StubChatCompletion(latency)
+
+
+def install_stubs(gpt_latency: float) -> None:
+    from app.config import settings
+    from app.services import currency, gpt_client
+
+    settings.openai_api_key = "replay"
+    gpt_client._openai = _StubOpenAI(gpt_latency)
+    currency._fetch_all_rates_sync = lambda: dict(STUB_RATES)
+
+
+def load_journal(path: str, limit: int) -> List[Tuple[float, Dict[str, Any]]]:
+    records = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            records.append((record["ts"], record["update"]))
+            if limit and len(records) >= limit:
+                break
+    records.sort(key=lambda r: r[0])
+    return records
+
+
+def update_kind(update: Update) -> str:
+    if update.callback_query:
+        return "callback"
+    if update.inline_query:
+        return "inline"
+    message = update.message
+    if message is None:
+        return "other"
+    if message.document:
+        return "document"
+    if message.text and message.text.startswith("/"):
+        return "command"
+    if message.text:
+        return "text"
+    return "other"
+
+
+def _percentile(values: List[float], pct: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+def report(latencies: Dict[str, List[float]], errors: Counter, elapsed: float, session: StubSession) -> None:
+    from app.services import db
+
+    total = sum(len(v) for v in latencies.values())
+    print(f"\nreplayed {total} updates in {elapsed:.2f}s — {total / elapsed:.1f} updates/s")
+    print(f"\n{'kind':<10} {'count':>6} {'errors':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}  (ms)")
+    everything = [x for v in latencies.values() for x in v]
+    for kind, values in sorted(latencies.items()) + [("all", everything)]:
+        if not values:
+            continue
+        err = sum(errors.values()) if kind == "all" else errors[kind]
+        print(
+            f"{kind:<10} {len(values):>6} {err:>6} "
+            f"{_percentile(values, 50) * 1000:>9.1f} {_percentile(values, 90) * 1000:>9.1f} "
+            f"{_percentile(values, 99) * 1000:>9.1f} {max(values) * 1000:>9.1f}"
+        )
+
+    print("\nBot API calls: " + ", ".join(f"{m}={n}" for m, n in session.calls.most_common()))
+
+    print("\nTop statements by total time:")
+    stats = db.get_statement_stats()
+    for name, st in sorted(stats.items(), key=lambda kv: kv[1]["total_ms"], reverse=True)[:10]:
+        if st["calls"]:
+            print(f"  {name:<40} calls={st['calls']:<6} avg={st['avg_ms']:7.1f}ms max={st['max_ms']:7.1f}ms")
+
+
+async def replay(args: argparse.Namespace) -> None:
+    from app.bot import dp
+    from app.main import register_handlers
+    from app.services import db
+
+    records = load_journal(args.journal, args.limit)
+    if not records:
+        print("journal is empty")
+        return
+
+    install_stubs(args.gpt_latency / 1000)
+    register_handlers()
+    db.init_engine()
+    await db.warm_up_pool()
+
+    session = StubSession(args.tg_latency / 1000)
+    bot = Bot(token=os.environ["TELEGRAM_BOT_TOKEN"], session=session, parse_mode="HTML")
+    speed = None if args.speed == "max" else float(args.speed)
+    limiter = asyncio.Semaphore(args.concurrency)
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Counter = Counter()
+
+    async def _feed(update: Update) -> None:
+        kind = update_kind(update)
+        async with limiter:
+            started = time.perf_counter()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception as e:
+                errors[kind] += 1
+                if args.verbose:
+                    print(f"[replay] update {update.update_id} failed: {e!r}")
+            latencies[kind].append(time.perf_counter() - started)
+
+    print(f"[replay] {len(records)} updates, speed {args.speed}, concurrency {args.concurrency}")
+    first_ts = records[0][0]
+    started = time.perf_counter()
+    tasks = []
+    for ts, raw in records:
+        if speed:
+            delay = (ts - first_ts) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        update = Update.model_validate(raw, context={"bot": bot})
+        tasks.append(asyncio.create_task(_feed(update)))
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    report(latencies, errors, elapsed, session)
+    await asyncio.to_thread(db.dispose_engine)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("journal", help="gzip-журнал, записанный с RECORD_UPDATES")
+    parser.add_argument("--speed", default="1", help="множитель темпа (1, 10, ...) или max")
+    parser.add_argument("--concurrency", type=int, default=100, help="максимум апдейтов в обработке одновременно")
+    parser.add_argument("--limit", type=int, default=0, help="прогнать только первые N апдейтов")
+    parser.add_argument("--tg-latency", type=float, default=50.0, help="задержка заглушки Bot API, мс")
+    parser.add_argument("--gpt-latency", type=float, default=800.0, help="задержка заглушки GPT, мс")
+    parser.add_argument("--verbose", action="store_true", help="печатать ошибки хендлеров")
+    args = parser.parse_args()
+
+    if args.speed != "max" and float(args.speed) <= 0:
+        parser.error("--speed must be positive or 'max'")
+    asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()